@@ -0,0 +1,153 @@
+"""
+Remembers the bounds of the profiles in each data file between runs
+"""
+import os
+import json
+import sqlite3
+import hashlib
+import numpy as np
+import profiles.utils as utils
+from profiles.conf import bounds_info
+
+
+class Bounds_Store():
+    """ Stores the (start, peak, end) times of the profiles found in a data \
+    file in an SQLite database, keyed by a hash of the file's contents and \
+    the profile start height. Reprocessing the same file can then skip \
+    segmentation and, for confirmed bounds, confirmation.
+
+    :var str db_path: the SQLite database file
+    """
+
+    def __init__(self, db_path=None):
+        """ Creates a Bounds_Store object. The database is only opened, and \
+        created if needed, when bounds are first looked up or stored.
+
+        :param str db_path: the SQLite database file. If None, \
+           bounds_info.DB_PATH from conf.py is used.
+        """
+        if db_path is None:
+            db_path = bounds_info.DB_PATH
+        self.db_path = os.path.abspath(os.path.expanduser(db_path))
+        # None until the database is first used, then whether it can be
+        self._usable = None
+
+    def _execute(self, sql, parameters):
+        """ Runs one statement on the database, creating it on first use. \
+        If the database can't be created or written, e.g. on a read-only \
+        file system, a message is printed and the store does nothing for \
+        the rest of the session.
+
+        :param str sql: the statement
+        :param tuple parameters: values for the statement's placeholders
+        :rtype: tuple
+        :return: the first row of the result, or None if there is none or \
+           the store can't be used
+        """
+        if self._usable is False:
+            return None
+        try:
+            if self._usable is None:
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            with sqlite3.connect(self.db_path) as conn:
+                if self._usable is None:
+                    conn.execute("CREATE TABLE IF NOT EXISTS bounds ("
+                                 "file_hash TEXT NOT NULL, "
+                                 "start_height TEXT NOT NULL, "
+                                 "bounds TEXT NOT NULL, "
+                                 "confirmed INTEGER NOT NULL, "
+                                 "PRIMARY KEY (file_hash, start_height))")
+                    self._usable = True
+                return conn.execute(sql, parameters).fetchone()
+        except (OSError, sqlite3.Error) as e:
+            print("Profile bounds will not be remembered, as the bounds "
+                  "store " + self.db_path + " can't be used:", e)
+            self._usable = False
+            return None
+
+    def get(self, file_path, profile_start_height, alt_times,
+            confirmed=True):
+        """ Looks up the bounds of the profiles in a file.
+
+        :param str file_path: the data file
+        :param int profile_start_height: the start height the bounds were \
+           found with, or None if it was detected or entered by the user
+        :param np.Array<Datetime> alt_times: times of the file's altitude \
+           data, to which the stored times are matched
+        :param bool confirmed: True to only return bounds a user confirmed
+        :rtype: list<tuple>
+        :return: the (time_start, time_max_height, time_end) of each \
+           profile, or None if the file has no stored bounds
+        """
+        row = self._execute("SELECT bounds, confirmed FROM bounds WHERE "
+                            "file_hash = ? AND start_height = ?",
+                            (file_hash(file_path),
+                             _height_key(profile_start_height)))
+        if row is None or (confirmed and not row[1]):
+            return None
+
+        times = utils._as_datetime64(alt_times)
+        to_return = []
+        for profile in json.loads(row[0]):
+            inds = np.searchsorted(times,
+                                   np.array(profile, dtype="datetime64[us]"))
+            to_return.append(tuple(alt_times[min(i, len(alt_times) - 1)]
+                                   for i in inds))
+        print(len(to_return), "profile(s) read from the bounds store for",
+              file_path)
+        return to_return
+
+    def put(self, file_path, profile_start_height, index_list, confirmed):
+        """ Stores the bounds of the profiles in a file, replacing any \
+        bounds stored for it before.
+
+        :param str file_path: the data file
+        :param int profile_start_height: the start height the bounds were \
+           found with, or None if it was detected or entered by the user
+        :param list<tuple> index_list: the (time_start, time_max_height, \
+           time_end) of each profile, as returned by utils.identify_profile
+        :param bool confirmed: True if a user confirmed the bounds
+        """
+        bounds = [[str(t) for t in utils._as_datetime64(profile)]
+                  for profile in index_list]
+        self._execute("INSERT OR REPLACE INTO bounds VALUES (?, ?, ?, ?)",
+                      (file_hash(file_path),
+                       _height_key(profile_start_height),
+                       json.dumps(bounds), int(bool(confirmed))))
+
+    def forget(self, file_path):
+        """ Removes all stored bounds for a file, so that it is segmented \
+        again the next time it is processed.
+
+        :param str file_path: the data file
+        """
+        self._execute("DELETE FROM bounds WHERE file_hash = ?",
+                      (file_hash(file_path),))
+
+
+def file_hash(file_path):
+    """ Calculates the SHA-256 hash of a file's contents, so renamed or moved \
+    copies of a file share their stored bounds.
+
+    :param str file_path: the file
+    :rtype: str
+    :return: the hex digest
+    """
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _height_key(profile_start_height):
+    """ Converts a profile start height to the text stored in the database.
+
+    :param int profile_start_height: the start height or None
+    :rtype: str
+    :return: the key
+    """
+    if profile_start_height is None:
+        return "auto"
+    return repr(float(getattr(profile_start_height, "magnitude",
+                              profile_start_height)))
@@ -1,7 +1,11 @@
 import os
+import time
 import contextlib
 import pandas as pd
+from copy import copy
+from collections import OrderedDict
 from profiles.conf import coef_info
+from profiles.calibration import Calibrator
 from abc import abstractmethod
 from azure.data.tables import TableServiceClient
 from azure.core.exceptions import ResourceNotFoundError
@@ -47,13 +51,39 @@ class Coef_Manager(Coef_Manager_Base):
        This object can then be queried by scoop number (to get sensor numbers), \
        by sensor numbers (to get coefs), or by copter number (to get tail \
        number).
+
+       Answers are cached, so each sensor, scoop, and copter is only looked \
+       up once per cache_ttl seconds. Unknown ones are cached too.
+
+    :var int cache_size: the most answers kept. The least recently used are \
+       dropped first.
+    :var float cache_ttl: seconds an answer is kept before it is looked up \
+       again
+    :var int hits: number of lookups answered from the cache
+    :var int misses: number of lookups passed to the sub_manager
     """
 
-    def __init__(self):
+    def __init__(self, cache_size=None, cache_ttl=None):
         """ Create Coef_Manager
+
+        :param int cache_size: the most answers cached. If None, \
+           coef_info.CACHE_SIZE from conf.py is used.
+        :param float cache_ttl: seconds an answer is cached. If None, \
+           coef_info.CACHE_TTL from conf.py is used.
         """
         # The sub_manager will implement all abstract methods
         self.sub_manager = None
+        if cache_size is None:
+            cache_size = getattr(coef_info, "CACHE_SIZE", 1024)
+        if cache_ttl is None:
+            cache_ttl = getattr(coef_info, "CACHE_TTL", 3600)
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.hits = 0
+        self.misses = 0
+        # (expiry time, answer, error) by (method, arguments), least recently
+        # used first
+        self._cache = OrderedDict()
         if coef_info.USE_AZURE.upper() in "YES":
             try:
                 with open(os.devnull, "w") as f, contextlib.redirect_stdout(f):
@@ -81,7 +111,8 @@ class Coef_Manager(Coef_Manager_Base):
         :rtype: str
         :return: the tail number
         """
-        return self.sub_manager.get_tail_n(copterID)
+        return self._cached("get_tail_n", self.sub_manager.get_tail_n,
+                            copterID)
 
     def get_sensors(self, scoopID):
         """ Get the sensor serial numbers for the given scoop.
@@ -91,7 +122,8 @@ class Coef_Manager(Coef_Manager_Base):
         :return: sensor numbers as {"imet1":"", "imet2":"", "imet3":"", "imet4":"",\
                                     "rh1":"", "rh2":"", "rh3":"", "rh4":""}
         """
-        return self.sub_manager.get_sensors(scoopID)
+        return self._cached("get_sensors", self.sub_manager.get_sensors,
+                            scoopID)
 
     def get_coefs(self, type, serial_number):
         """ Get the coefs for the sensor with the given type and serial number.
@@ -101,7 +133,61 @@ class Coef_Manager(Coef_Manager_Base):
         :rtype: dict
         :return: information about the sensor, including offset OR coefs and calibration equation
         """
-        return self.sub_manager.get_coefs(type, str(serial_number))
+        return self._cached("get_coefs", self.sub_manager.get_coefs, type,
+                            str(serial_number))
+
+    def get_calibrator(self, type, serial_number):
+        """ Get a calibrator which applies the sensor's calibration equation \
+        with its coefs. Each sensor's calibrator is only built once.
+
+        :param str type: "Imet" or "RH" or "Wind"
+        :param [str or int] serial_number: the sensor's serial number
+        :rtype: Calibrator
+        :return: the calibrator, see profiles.calibration
+        """
+        return self._cached("get_calibrator", lambda type, serial_number:
+                            Calibrator.from_coefs(type, self.get_coefs(
+                                type, serial_number)),
+                            type, str(serial_number))
+
+    def invalidate(self):
+        """ Forgets all cached answers, e.g. after coefficients were \
+        changed, so the next lookups go to the sub_manager again.
+        """
+        self._cache.clear()
+
+    def _cached(self, name, function, *args):
+        """ Returns the cached answer to a lookup, or looks it up and \
+        caches it. Lookups of unknown sensors, scoops, or copters raise the \
+        same error again until their entry expires.
+
+        :param str name: the lookup's method name
+        :param function function: does the lookup
+        :param args: the lookup's arguments
+        :return: a copy of the answer
+        """
+        key = (name,) + tuple(str(arg) for arg in args)
+        now = time.monotonic()
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] > now:
+            self.hits += 1
+            self._cache.move_to_end(key)
+        else:
+            self.misses += 1
+            try:
+                entry = (now + self.cache_ttl, function(*args), None)
+            except (KeyError, ResourceNotFoundError) as e:
+                entry = (now + self.cache_ttl, None, e)
+            self._cache[key] = entry
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        if entry[2] is not None:
+            # A new error each time, as raising the cached one again would
+            # add to its traceback
+            raise type(entry[2])(*entry[2].args) from None
+        return copy(entry[1])
 
 
 class Azure_Coef_Manager:
@@ -188,11 +274,49 @@ class Azure_Coef_Manager:
 
 
 class CSV_Coef_Manager(Coef_Manager_Base):
+    """ Reads the CSV files in the coefs folder once and indexes them, so \
+    that lookups are dict accesses.
+    """
 
     def __init__(self, file_path):
+        """ Create CSV_Coef_Manager
+
+        :param str file_path: the coefs folder
+        """
         self.file_path = file_path
-        self.coefs = pd.read_csv(os.path.join(file_path, 'MasterCoefList.csv'))
-        self.copternums = pd.read_csv(os.path.join(file_path, 'copterID.csv'), names=['id', 'tail'])
+        coefs = pd.read_csv(os.path.join(file_path, 'MasterCoefList.csv'))
+        copternums = pd.read_csv(os.path.join(file_path, 'copterID.csv'),
+                                 names=['id', 'tail'])
+
+        # Coefs by (SensorType, SerialNumber). Like the table filters this
+        # replaces, the first row for a sensor is used.
+        self._coefs = {}
+        for row in coefs.itertuples(index=False):
+            self._coefs.setdefault((row.SensorType, int(row.SerialNumber)),
+                                   {"A": row.A, "B": row.B, "C": row.C,
+                                    "D": row.D, "Equation": row.Equation,
+                                    "Offset": row.Offset})
+
+        # Tail numbers by copterID
+        self._tails = {}
+        for row in copternums.itertuples(index=False):
+            self._tails.setdefault(int(row.id), row.tail)
+
+        # Sensor numbers of the most recent entry of each scoop, by scoopID
+        self._sensors = {}
+        for file_name in os.listdir(file_path):
+            if file_name.startswith('scoop') and file_name.endswith('.csv'):
+                scoop_info = pd.read_csv(os.path.join(file_path, file_name))
+                if len(scoop_info) == 0:
+                    continue
+                dates = [str(date) for date in scoop_info.validFrom]
+                most_recent = scoop_info.iloc[dates.index(max(dates))]
+                self._sensors[file_name[len('scoop'):-len('.csv')]] = \
+                    {"imet1": str(most_recent.imet1),
+                     "imet2": str(most_recent.imet2),
+                     "imet3": str(most_recent.imet3), "imet4": None,
+                     "rh1": str(most_recent.rh1), "rh2": str(most_recent.rh2),
+                     "rh3": str(most_recent.rh3), "rh4": None}
 
     def get_tail_n(self, copterID):
         """ Get the tail number corresponding to a short ID number.
@@ -201,8 +325,11 @@ class CSV_Coef_Manager(Coef_Manager_Base):
         :rtype: str
         :return: the tail number
         """
-
-        return self.copternums['tail'][self.copternums['id'] == (copterID)].values[0]
+        try:
+            return self._tails[int(copterID)]
+        except KeyError:
+            raise KeyError("No tail number for copter " + str(copterID)
+                           + " in copterID.csv")
 
     def get_sensors(self, scoopID):
         """ Get the sensor serial numbers for the given scoop.
@@ -212,17 +339,11 @@ class CSV_Coef_Manager(Coef_Manager_Base):
         :return: sensor numbers as {"imet1":"", "imet2":"", "imet3":"", "imet4":"",\
                                     "rh1":"", "rh2":"", "rh3":"", "rh4":""}
         """
-        scoop_info = pd.read_csv(os.path.join(self.file_path, 'scoop'+str(scoopID)+'.csv'))
-        max_date="0000-00-00"
-        dates = scoop_info.validFrom
-        for date in dates:
-            if date > max_date:
-                max_date = date
-
-        most_recent = scoop_info[scoop_info.validFrom == max_date]
-        return {"imet1":str(most_recent.imet1.values[0]), "imet2":str(most_recent.imet2.values[0]),
-                "imet3":str(most_recent.imet3.values[0]), "imet4":None, "rh1":str(most_recent.rh1.values[0]),
-                "rh2":str(most_recent.rh2.values[0]),  "rh3":str(most_recent.rh3.values[0]), "rh4":None}
+        try:
+            return dict(self._sensors[str(scoopID)])
+        except KeyError:
+            raise KeyError("No file scoop" + str(scoopID) + ".csv in "
+                           + self.file_path)
 
     def get_coefs(self, type, serial_number):
         """ Get the coefs for the sensor with the given type and serial number.
@@ -232,13 +353,8 @@ class CSV_Coef_Manager(Coef_Manager_Base):
         :rtype: dict
         :return: information about the sensor, including offset OR coefs and calibration equation
         """
-        serial_number = int(serial_number)
-        coefs = self.coefs
-        a = coefs.A[coefs.SerialNumber == serial_number][coefs.SensorType == type].values[0]
-        b = coefs.B[coefs.SerialNumber == serial_number][coefs.SensorType == type].values[0]
-        c = coefs.C[coefs.SerialNumber == serial_number][coefs.SensorType == type].values[0]
-        d = coefs.D[coefs.SerialNumber == serial_number][coefs.SensorType == type].values[0]
-        eq = coefs.Equation[coefs.SerialNumber == serial_number][coefs.SensorType == type].values[0]
-        offset = coefs.Offset[coefs.SerialNumber == serial_number][coefs.SensorType == type].values[0]
-
-        return {"A":a, "B":b, "C":c, "D":d, "Equation":eq, "Offset":offset}
+        try:
+            return dict(self._coefs[(type, int(serial_number))])
+        except KeyError:
+            raise KeyError("No coefficients for " + type + " sensor "
+                           + str(serial_number) + " in MasterCoefList.csv")
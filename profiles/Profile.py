@@ -18,12 +18,21 @@ class Profile():
     of time)
 
     :var bool dev: True if data is from developmental flights
-    :var Quantity resolution: resolution of the data in units of altitude or \
-       pressure
+    :var Quantity resolution: resolution of the data in units of altitude, \
+       pressure, or time
     :var tuple indices: the bounds of the profile to be processed as\
-       (start_time, end_time)
+       (start_time, end_time). When the resolution is in units of time, \
+       this covers both legs of the flight.
     :var bool ascent: True if data from the ascending leg should be processed,\
        otherwise the descending leg will be processed instead
+    :var dict despike_counts: number of raw samples removed as spikes from \
+       each thermodynamic channel, once the Thermo_Profile has been created \
+       with despiking enabled
+    :var tuple bounds: the (start_time, peak_time, end_time) of the whole \
+       profile
+    :var Profile descent: the descending leg of the same profile, sharing \
+       this Profile's raw data and bounds, if legs='both' was requested. \
+       Otherwise None.
     :var String file_path: the path to you .bin, .json, or .nc data file
     :var np.Array<Datetime> gridded_times: the times at which data points are \
        generated
@@ -39,12 +48,14 @@ class Profile():
                ascent=True, dev=False, confirm_bounds=True,
                index_list=None, scoop_id=None, raw_profile=None,
                profile_start_height=None, nc_level='low', base_start=None,
-               meta_flight_path=None, meta_header_path=None):
+               meta_flight_path=None, meta_header_path=None,
+               reducer='mean', legs=None, headless=False, qc_window=None,
+               despike=False, moving_platform=False):
         """ Creates a Profile object.
 
         :param string file_path: data file
         :param int resolution: resolution to which data should be
-           calculated in units of altitude or pressure
+           calculated in units of altitude, pressure, or time
         :param str res_units: units of resolution in a format which can \
            be parsed by pint
         :param int profile_num: 1 or greater. Identifies profile when file \
@@ -68,13 +79,35 @@ class Profile():
            of NetCDF files will be generated. For individual files for each \
            Raw, Thermo, \
            and Wind Profile, specify 'low'. For no NetCDF files, specify \
-           'none'.
+           'none'. 'low' also caches each gridded Thermo and Wind Profile \
+           next to the data file (see utils.product_cache_path), which is \
+           read instead of gridding again when the same data is processed \
+           with the same settings. Nothing is cached with 'none'.
         :param Quantity base_start: lowest altitude value of the base after gridding
         :param str meta_flight_path: path to "flight" file generated by oucass-checklist
         :param str meta_header_path: path to "header" file generated by oucass-checklist
+        :param str reducer: how raw samples are combined into each gridded \
+           point - 'mean', 'median', 'trimmed_mean', or 'interp'. See \
+           utils.regrid_data.
+        :param str legs: 'ascent', 'descent', or 'both'. Overrides ascent if \
+           given. With 'both', this Profile holds the ascending leg and \
+           descent holds the descending leg, both gridded from the same \
+           loaded file and profile bounds. Ignored when the resolution is in \
+           units of time.
+        :param bool headless: True to never show figures or prompt the user.\
+           Profile bounds are then confirmed through a review file next to \
+           the data file (see utils.identify_profile).
+        :param int qc_window: if given, thermodynamic sensors are checked \
+           over moving windows of this many seconds instead of over the \
+           whole profile. See utils.qc_windowed.
+        :param despike: True to remove spikes from the raw temperature, \
+           resistance, and RH channels before processing them, or a dict of \
+           per-channel settings (see utils.despike_channels). False to use \
+           the raw data as is.
+        :param bool moving_platform: True to correct winds for the \
+           vehicle's ground velocity. See Wind_Profile._calc_winds.
         """
 
-        self.coefs_path = coefs_path
         if raw_profile is not None:
             self._raw_profile = raw_profile
         else:
@@ -86,6 +119,11 @@ class Profile():
         self._pos = self._raw_profile.pos_data()
         self._pres = (self._raw_profile.pres[0], self._raw_profile.pres[-1])
         self._nc_level = nc_level
+        self._reducer = reducer
+        self._qc_window = qc_window
+        self._despike = despike
+        self._moving_platform = moving_platform
+        self.despike_counts = {}
         self.meta = self._raw_profile.meta
         file_path = self._raw_profile.file_path
 
@@ -97,9 +135,14 @@ class Profile():
                  utils.identify_profile(self._pos["alt_MSL"].magnitude,
                                         self._pos["time"], confirm_bounds,
                                         profile_start_height=\
-                                        profile_start_height)
+                                        profile_start_height,
+                                        headless=headless,
+                                        review_path=\
+                                        utils.review_path_for(file_path))
             indices = index_list[profile_num - 1]
         except IndexError:
+            if headless:
+                raise
             print("Analysis shows that the given file has fewer than " +
                   str(profile_num) + " profiles. If you are certain the file "
                   + "does contain more profiles than we have found, try again "
@@ -107,15 +150,18 @@ class Profile():
             return self.__init__(file_path, resolution, res_units, profile_num,
                                  ascent=True, dev=False, confirm_bounds=True)
 
-        if ascent:
-            self.indices = (indices[0], indices[1])
-        else:
-            self.indices = (indices[1], indices[2])
+        if legs is not None:
+            if legs not in ('ascent', 'descent', 'both'):
+                raise ValueError("legs must be 'ascent', 'descent', or "
+                                 "'both', not " + str(legs))
+            ascent = legs != 'descent'
+
         self._wind_profile = None
         self._thermo_profile = None
+        self.descent = None
         self.dev = dev  # TODO this is not used
         self.resolution = resolution * self._units.parse_expression(res_units)
-        self.ascent = ascent
+        self.bounds = tuple(indices)
         if ".nc" in file_path or ".NC" in file_path:
             self.file_path = file_path[:-3]
         elif ".json" in file_path or ".JSON" in file_path:
@@ -126,6 +172,47 @@ class Profile():
             print("File type not recognized")
             sys.exit(0)
 
+        if not (self.resolution.dimensionality ==
+                self._units.get_dimensionality('m')
+                or self.resolution.dimensionality ==
+                self._units.get_dimensionality('Pa')
+                or self.resolution.dimensionality ==
+                self._units.get_dimensionality('s')):
+            raise ValueError("res_units must be a unit of length, pressure, "
+                             "or time, not " + str(res_units))
+
+        self._set_leg(ascent, base_start)
+        # Times always increase, so a descending leg ends at its lowest point
+        if self.ascent:
+            self._base_start = self.gridded_base[0]
+        else:
+            self._base_start = self.gridded_base[-1]
+
+        if legs == 'both' and self.resolution.dimensionality != \
+                self._units.get_dimensionality('s'):
+            # The descending leg reuses the loaded file and bounds, so only
+            # the gridding of the base is repeated
+            self.descent = copy(self)
+            self.descent._set_leg(False, self._base_start)
+
+    def _set_leg(self, ascent, base_start=None):
+        """ Selects the leg of the profile to be processed and calculates \
+        the times at which data points are generated for it.
+
+        :param bool ascent: True for the ascending leg, False for the \
+           descending leg
+        :param Quantity base_start: lowest value of the base after gridding
+        """
+        self.ascent = ascent
+        if self.resolution.dimensionality == \
+                self._units.get_dimensionality('s'):
+            # Time resolution: use the whole flight, not just one leg
+            self.indices = (self.bounds[0], self.bounds[2])
+        elif ascent:
+            self.indices = (self.bounds[0], self.bounds[1])
+        else:
+            self.indices = (self.bounds[1], self.bounds[2])
+
         if(self.resolution.dimensionality ==
            self._units.get_dimensionality('m')):
             base = self._pos['alt_MSL']
@@ -134,12 +221,21 @@ class Profile():
              self._units.get_dimensionality('Pa')):
             base = self._pres[0]
             base_time = self._pres[1]
-        self.gridded_times, self.gridded_base \
+        else:
+            base = None
+            base_time = self._pos['time']
+
+        if base is None:
+            self.gridded_times, self.gridded_base \
+                = utils.regrid_time(base_times=base_time,
+                                    new_res=self.resolution,
+                                    indices=self.indices)
+        else:
+            self.gridded_times, self.gridded_base \
                 = utils.regrid_base(base=base, base_times=base_time,
                                     new_res=self.resolution, ascent=ascent,
                                     units=self._units, indices=self.indices,
                                     base_start=base_start)
-        self._base_start = self.gridded_base[0]
 
     def get(self, varname):
         """
@@ -187,10 +283,12 @@ class Profile():
                              indices=self.indices, ascent=self.ascent,
                              units=self._units, file_path=self.file_path,
                              meta=self.meta,
-                             nc_level=self._nc_level)
+                             nc_level=self._nc_level,
+                             reducer=self._reducer,
+                             moving_platform=self._moving_platform)
             if len(self._wind_profile.gridded_times) > len(self.gridded_times):
                 new_len = len(self.gridded_times)
-                self._wind_profile.trucate_to(new_len)
+                self._wind_profile.truncate_to(new_len)
             elif len(self._wind_profile.gridded_times) < \
                     len(self.gridded_times):
                 new_len = len(self._wind_profile.gridded_times)
@@ -210,6 +308,11 @@ class Profile():
         """
         if self._thermo_profile is None:
             thermo_data = self._raw_profile.thermo_data()
+            if self._despike is not False and self._despike is not None:
+                config = None if self._despike is True else self._despike
+                thermo_data, self.despike_counts = \
+                    utils.despike_channels(thermo_data, config)
+                print("Spikes removed:", self.despike_counts)
             self._thermo_profile = \
                 Thermo_Profile(thermo_data, self.resolution,
                                gridded_times=self.gridded_times,
@@ -217,11 +320,13 @@ class Profile():
                                indices=self.indices, ascent=self.ascent,
                                units=self._units, file_path=self.file_path,
                                meta=self.meta,
-                               nc_level=self._nc_level)
+                               nc_level=self._nc_level,
+                               reducer=self._reducer,
+                               qc_window=self._qc_window)
             if len(self._thermo_profile.gridded_times) > \
                     len(self.gridded_times):
                 new_len = len(self.gridded_times)
-                self._thermo_profile.trucate_to(new_len)
+                self._thermo_profile.truncate_to(new_len)
             elif len(self._thermo_profile.gridded_times) < \
                     len(self.gridded_times):
                 new_len = len(self._thermo_profile.gridded_times)
@@ -232,6 +337,48 @@ class Profile():
                 self._wind_profile.truncate_to(new_len)
         return self._thermo_profile
 
+    def coarsen(self, resolution):
+        """ Creates a Profile at a coarser resolution from this one. Thermo \
+        and wind data which have already been processed are combined exactly \
+        from their per-point sums and counts, so the raw data is not \
+        segmented or gridded again. Only complete groups of points are kept.
+
+        :param int resolution: the new resolution in the same units as this \
+           Profile's resolution. It must be a whole multiple of the current \
+           resolution.
+        :rtype: Profile
+        :return: the coarser Profile
+        """
+        factor = (resolution * self.resolution.units /
+                  self.resolution).to('dimensionless').magnitude
+        if factor < 1 or abs(factor - round(factor)) > 1e-9:
+            raise ValueError("The new resolution must be a whole multiple of "
+                             + str(self.resolution))
+        factor = int(round(factor))
+
+        result = copy(self)
+        result.resolution = self.resolution * factor
+        result.gridded_times = self.gridded_times[::factor]
+        result.gridded_base = self.gridded_base[::factor]
+        if self._thermo_profile is not None:
+            result._thermo_profile = self._thermo_profile.coarsen(factor)
+        if self._wind_profile is not None:
+            result._wind_profile = self._wind_profile.coarsen(factor)
+
+        new_len = len(result.gridded_times)
+        for product in [result._thermo_profile, result._wind_profile]:
+            if product is not None:
+                new_len = min(new_len, len(product.gridded_times))
+        result.gridded_times = result.gridded_times[:new_len]
+        result.gridded_base = result.gridded_base[:new_len]
+        for product in [result._thermo_profile, result._wind_profile]:
+            if product is not None:
+                product.truncate_to(new_len)
+        if self.descent is not None:
+            result.descent = self.descent.coarsen(resolution)
+
+        return result
+
     def __deepcopy__(self, memo):
         cls = self.__class__
         result = cls.__new__(cls)
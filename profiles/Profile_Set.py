@@ -10,8 +10,9 @@ from profiles.Profile import Profile
 from profiles.Raw_Profile import Raw_Profile
 from profiles.Thermo_Profile import Thermo_Profile
 from profiles.Wind_Profile import Wind_Profile
+from profiles.Bounds_Store import Bounds_Store
 import profiles.utils as utils
-from copy import deepcopy
+from copy import deepcopy, copy
 
 
 class Profile_Set():
@@ -29,15 +30,30 @@ class Profile_Set():
     :var int profile_start_height: either passed to the constructor or \
        provided by the user during processing
     :var Meta meta: reads and processes metadata from oucass-checklist
+    :var str reducer: how raw samples are combined into each gridded point
+    :var bool headless: True if figures and prompts are never used
+    :var Bounds_Store bounds_store: remembers the profile bounds of files \
+       which have been processed before, or None
+    :var int qc_window: width in seconds of the windows over which \
+       thermodynamic sensors are checked, or None to check whole profiles
+    :var despike: True, False, or per-channel settings for removing spikes \
+       from raw thermodynamic channels
+    :var str legs: which legs of each profile are processed - 'ascent', \
+       'descent', 'both', or None to follow ascent
+    :var bool moving_platform: True if winds are corrected for the vehicle's \
+       ground velocity
     """
 
     def __init__(self, resolution=10, res_units='m', ascent=True,
                  dev=False, confirm_bounds=True, profile_start_height=None,
-                 nc_level='none'):
+                 nc_level='none', reducer='mean', legs=None,
+                 headless=False, use_bounds_store=False, qc_window=None,
+                 despike=False, moving_platform=False):
         """ Creates a Profiles object.
 
         :param int resolution: resolution to which data should be
-           calculated in units of altitude or pressure
+           calculated in units of altitude, pressure, or time (for \
+           example, res_units='s' for hovering or horizontal flights)
         :param str res_units: units of resolution in a format which can \
            be parsed by pint
         :param bool ascent: True to use ascending leg of flight, False to use \
@@ -55,8 +71,40 @@ class Profile_Set():
            of NetCDF files will be generated. For individual files for each \
            Raw, Thermo, \
            and Wind Profile, specify 'low'. For no NetCDF files, specify \
-           'none'. To generate a single, Profile_Set-level file, call \
+           'none'. 'low' also caches each gridded Thermo and Wind Profile \
+           next to the data file (see utils.product_cache_path), which is \
+           read instead of gridding again when the same data is processed \
+           with the same settings. Nothing is cached with 'none'. To generate a single, Profile_Set-level file, call \
            Profile_Set.save_netCDF where you are done adding data.
+        :param str reducer: how raw samples are combined into each gridded \
+           point - 'mean', 'median', 'trimmed_mean', or 'interp'. See \
+           utils.regrid_data.
+        :param str legs: 'ascent', 'descent', or 'both'. Overrides ascent if \
+           given. With 'both', each file is read and split into profiles \
+           once, profiles holds the ascending legs, and each Profile's \
+           descent holds its descending leg (see get_descent_profiles).
+        :param bool headless: True to never show figures or prompt the user,\
+           e.g. on machines without a display. If confirm_bounds is also \
+           True, the bounds of each file's profiles are written to \
+           <file>_bounds.json (and .png) for review and only approved \
+           profiles are processed when the file is added again.
+        :param bool use_bounds_store: True to remember the bounds of each \
+           file's profiles in the database set in conf.py, so adding the \
+           same file again skips segmentation and confirmation. The \
+           database is only opened when a file is added, and processing \
+           continues without it if it can't be used. Off by default, so \
+           nothing is written outside the data folder unless asked for.
+        :param int qc_window: if given, thermodynamic sensors are checked \
+           over moving windows of this many seconds, so a sensor which fails \
+           part of the way through a profile is only removed where it fails.\
+           See utils.qc_windowed.
+        :param despike: True to remove single-sample spikes and dropouts \
+           from the raw temperature, resistance, and RH channels, or a dict \
+           of per-channel settings (see utils.despike_channels). The number \
+           of samples removed is kept in each Profile's despike_counts.
+        :param bool moving_platform: True to correct winds for the \
+           vehicle's ground velocity, e.g. for transects or drifting hovers.\
+           See Wind_Profile._calc_winds.
         """
         self.resolution = resolution
         self.res_units = res_units
@@ -69,6 +117,25 @@ class Profile_Set():
         self._nc_level = nc_level
         self._root_dir = ""
         self._base_start = None
+        self.reducer = reducer
+        self.legs = legs
+        self.headless = headless
+        self.qc_window = qc_window
+        self.despike = despike
+        self.moving_platform = moving_platform
+        # Settings passed on to every Profile
+        self._profile_kwargs = {"reducer": reducer,
+                                "legs": legs,
+                                "headless": headless,
+                                "qc_window": qc_window,
+                                "despike": despike,
+                                "moving_platform": moving_platform}
+        if use_bounds_store:
+            self.bounds_store = Bounds_Store()
+        else:
+            self.bounds_store = None
+        if legs is not None:
+            self.ascent = legs != 'descent'
 
     def add_all_profiles(self, file_path, scoop_id=None,
                          meta_flight_path=None, meta_header_path=None):
@@ -105,11 +172,7 @@ class Profile_Set():
         pos = raw_profile_set.pos_data()
 
         # Identify the start, peak, and end indices of each profile
-        index_list = utils.identify_profile(pos["alt_MSL"],
-                                            pos["time"], self.confirm_bounds,
-                                            to_return=[],
-                                            profile_start_height=self
-                                            .profile_start_height)
+        index_list = self._identify_profiles(file_path, pos)
 
         # Create a Profile object for each profile identified
         for profile_num in np.add(range(len(index_list)), 1):
@@ -119,7 +182,8 @@ class Profile_Set():
                            raw_profile=raw_profile_set,
                            profile_start_height=self.profile_start_height,
                            nc_level=self._nc_level,
-                           base_start=self._base_start)
+                           base_start=self._base_start,
+                           **self._profile_kwargs)
             self.profiles.append(prof)
 
             if self._base_start is None:
@@ -135,7 +199,8 @@ class Profile_Set():
                                              profile_start_height=self
                                              .profile_start_height,
                                              nc_level=self._nc_level,
-                                             base_start=self._base_start))
+                                             base_start=self._base_start,
+                                             **self._profile_kwargs))
 
         self.profiles.sort()
         print(len(self.profiles), "profile(s) including those added from file",
@@ -184,9 +249,7 @@ class Profile_Set():
         pos = raw_profile.pos_data()
 
         # Identify the start, peak, and end indices of each profile
-        index_list = utils.identify_profile(pos["alt_MSL"].magnitude,
-                                            pos["time"], self.confirm_bounds,
-                                            to_return=[])
+        index_list = self._identify_profiles(file_path, pos)
 
         if(profile_num is None):
             self.profiles.append(Profile(file_path, self.resolution,
@@ -197,7 +260,8 @@ class Profile_Set():
                                          raw_profile=raw_profile,
                                          profile_start_height=self
                                          .profile_start_height,
-                                         nc_level=self._nc_level))
+                                         nc_level=self._nc_level,
+                                         **self._profile_kwargs))
         else:
             for profile_num_guess in range(len(index_list)):
                 # Check if this profile is the first to start after time
@@ -211,7 +275,8 @@ class Profile_Set():
                                          raw_profile=raw_profile,
                                          profile_start_height=self
                                          .profile_start_height,
-                                         nc_level=self._nc_level))
+                                         nc_level=self._nc_level,
+                                         **self._profile_kwargs))
 
                 # No need to add any more profiles from this file
                 break
@@ -219,6 +284,87 @@ class Profile_Set():
         print(len(self.profiles), "profiles including profile number ",
               str(profile_num), " added from file", file_path)
 
+    def _identify_profiles(self, file_path, pos):
+        """ Finds the bounds of the profiles in a file, using the bounds \
+        store when the file has been processed before.
+
+        :param str file_path: the data file
+        :param dict pos: the file's position data from Raw_Profile.pos_data
+        :rtype: list<tuple>
+        :return: the (time_start, time_max_height, time_end) of each profile
+        """
+        if self.bounds_store is not None:
+            index_list = self.bounds_store.get(file_path,
+                                               self.profile_start_height,
+                                               pos["time"],
+                                               confirmed=self.confirm_bounds)
+            if index_list is not None:
+                return index_list
+
+        index_list = utils.identify_profile(pos["alt_MSL"].magnitude,
+                                            pos["time"], self.confirm_bounds,
+                                            profile_start_height=self
+                                            .profile_start_height,
+                                            headless=self.headless,
+                                            review_path=utils
+                                            .review_path_for(file_path))
+
+        if self.bounds_store is not None and len(index_list) > 0:
+            self.bounds_store.put(file_path, self.profile_start_height,
+                                  index_list, self.confirm_bounds)
+        return index_list
+
+    def get_descent_profiles(self):
+        """ Returns the descending legs of the Profiles in profiles when \
+        legs='both' was requested.
+
+        :rtype: list<Profile>
+        :return: the descending leg of each Profile which has one
+        """
+        return [profile.descent for profile in self.profiles
+                if getattr(profile, "descent", None) is not None]
+
+    def calc_derived(self, names=("mixing_ratio", "theta", "T_d", "q")):
+        """ Calculates derived thermodynamic variables for all Profiles with \
+        one vectorized call per variable instead of one per Profile. Only \
+        Profiles which have already processed their thermo data (see \
+        Profile.get_thermo_profile) are included; the others calculate \
+        their derived variables when they are first read.
+
+        :param tuple<str> names: the derived variables to calculate. See \
+           Thermo_Profile.register_derived.
+        """
+        profiles = self.profiles + self.get_descent_profiles()
+        Thermo_Profile.derive_together([profile._thermo_profile
+                                        for profile in profiles
+                                        if profile._thermo_profile
+                                        is not None], names)
+
+    def coarsen(self, resolution):
+        """ Creates a Profile_Set at a coarser resolution from this one \
+        without re-reading, re-segmenting, or re-gridding any files. For \
+        products at several resolutions, process the finest once and coarsen \
+        it, i.e.
+
+        ``fine = Profile_Set(resolution=5)``
+        ``fine.add_all_profiles(file_path)``
+        ``by_res = {res: fine.coarsen(res) for res in [10, 25, 50]}``
+
+        Thermo and wind data are only combined for Profiles which have \
+        already processed them (see Profile.get_thermo_profile and \
+        Profile.get_wind_profile) and require the 'mean' reducer.
+
+        :param int resolution: the new resolution in units of res_units. It \
+           must be a whole multiple of this Profile_Set's resolution.
+        :rtype: Profile_Set
+        :return: the coarser Profile_Set
+        """
+        result = copy(self)
+        result.resolution = resolution
+        result.profiles = [profile.coarsen(resolution)
+                           for profile in self.profiles]
+        return result
+
     def merge(self, to_add):
         """ Loads all Profile objects from a pre-existing Profiles into this
         Profiles. All flights must be from the same location.
@@ -159,7 +159,8 @@ class Raw_Profile():
 
         rtype: list
         return: {"speed_east":, "speed_north":, "speed_down":, \
-                 "roll":, "pitch":, "yaw":, "time":}
+                 "roll":, "pitch":, "yaw":, "time":, \
+                 "alt":, "pres":, "time_pres":}
         """
         to_return = {}
 
@@ -173,6 +174,8 @@ class Raw_Profile():
         to_return["alt"] = self.pres[3]
         to_return["pres"] = self.pres[0]
         to_return["time"] = self.rotation[6]
+        # alt and pres are on the barometer's time axis, not the rotation's
+        to_return["time_pres"] = self.pres[-1]
 
         to_return["serial_numbers"] = self.serial_numbers
 
@@ -3,6 +3,8 @@ Calculates and stores basic thermodynamic parameters
 """
 from metpy import calc
 import profiles.utils as utils
+import profiles.thermo_kernels as kernels
+from profiles.conf import thermo_info
 import numpy as np
 import netCDF4
 import os
@@ -10,29 +12,147 @@ import datetime as dt
 from copy import deepcopy, copy
 
 
+# Names of the QC flags in NetCDF files. See utils.qc
+_flag_names = {0: "good",
+               2: "bias",
+               3: "lag",
+               4: "empty"}
+
+# Names in NetCDF files of the variables not saved under their own name
+_nc_names = {"mixing_ratio": "mr",
+             "T_d": "Td"}
+
+
+def _native():
+    """ Checks whether derived variables are calculated with thermo_kernels \
+    rather than metpy. See thermo_info in conf.py.
+
+    :rtype: bool
+    :return: True to use thermo_kernels
+    """
+    return thermo_info.BACKEND == "numpy"
+
+
+def _magnitudes(profile, *names_and_units):
+    """ Reads gridded variables as plain arrays in fixed units.
+
+    :param Thermo_Profile profile: the profile
+    :param tuple names_and_units: pairs of variable name and unit name
+    :rtype: list<np.array<float>>
+    :return: the magnitudes, in the order requested
+    """
+    return [getattr(profile, name).m_as(getattr(profile._units, unit))
+            for name, unit in names_and_units]
+
+
+def _mixing_ratio(profile):
+    if _native():
+        rh, temp, pres = _magnitudes(profile, ("rh", "percent"),
+                                     ("temp", "kelvin"), ("pres", "hPa"))
+        return kernels.mixing_ratio_from_relative_humidity(rh, temp, pres) \
+            * profile._units.dimensionless
+    return calc.mixing_ratio_from_relative_humidity(
+        np.divide(profile.rh.magnitude, 100), profile.temp, profile.pres)
+
+
+def _theta(profile):
+    if _native():
+        pres, temp = _magnitudes(profile, ("pres", "hPa"), ("temp", "kelvin"))
+        return kernels.potential_temperature(pres, temp) \
+            * profile._units.kelvin
+    return calc.potential_temperature(profile.pres, profile.temp)
+
+
+def _T_d(profile):
+    if _native():
+        temp, rh = _magnitudes(profile, ("temp", "kelvin"), ("rh", "percent"))
+        return kernels.dewpoint_from_relative_humidity(temp, rh) \
+            * profile._units.degC
+    return calc.dewpoint_from_relative_humidity(profile.temp, profile.rh)
+
+
+def _q(profile):
+    if _native():
+        mixing_ratio, = _magnitudes(profile, ("mixing_ratio", "dimensionless"))
+        return kernels.specific_humidity_from_mixing_ratio(mixing_ratio) \
+            * profile._units.gPerKg
+    return calc.specific_humidity_from_mixing_ratio(profile.mixing_ratio) \
+        * profile._units.gPerKg
+
+
+def _theta_v(profile):
+    if _native():
+        pres, temp, mixing_ratio = _magnitudes(
+            profile, ("pres", "hPa"), ("temp", "kelvin"),
+            ("mixing_ratio", "dimensionless"))
+        return kernels.potential_temperature(
+            pres, kernels.virtual_temperature(temp, mixing_ratio)) \
+            * profile._units.kelvin
+    return calc.virtual_potential_temperature(profile.pres, profile.temp,
+                                              profile.mixing_ratio)
+
+
+def _theta_e(profile):
+    # There is no kernel for this; it is always calculated with metpy
+    return calc.equivalent_potential_temperature(profile.pres, profile.temp,
+                                                 profile.T_d)
+
+
 class Thermo_Profile():
-    """ Contains data from one file.
+    """ Contains data from one file. Derived variables are calculated from \
+    temp, rh, and pres the first time they are read.
 
     :var np.array<Quantity> temp: QC'd and averaged temperature
     :var np.array<Quantity> mixing_ratio: calculated mixing ratio
     :var np.array<Quantity> theta: calculated potential temperature
     :var np.array<Quantity> T_d: calculated dewpoint temperature
     :var np.array<Quantity> q: calculated mixing ratio
+    :var np.array<Quantity> theta_v: calculated virtual potential temperature
+    :var np.array<Quantity> theta_e: calculated equivalent potential \
+       temperature
     :var np.array<Quantity> rh: QC'd and averaged relative humidity
     :var np.array<Quantity> pres: QC'd pressure
     :var np.array<Quantity> alt: altitude
     :var np.array<Datetime> gridded_times: times at which processed data exists
+    :var list<int> rh_flags: QC flag of each RH sensor, see utils.qc
+    :var list<int> temp_flags: QC flag of each temperature sensor
+    :var np.array<int> rh_sample_flags: QC flag of each RH sample when \
+       windowed QC is used, see utils.qc_windowed. Otherwise None.
+    :var np.array<int> temp_sample_flags: QC flag of each temperature sample \
+       when windowed QC is used. Otherwise None.
     :var Quantity resolution: vertical resolution in units of time,
            altitude, or pressure to which the data is calculated
+    :var str cache_key: identifies the inputs and settings the gridded \
+       data was calculated from, see utils.product_key
     """
 
+    # Gridded variables are kept as plain arrays in _data, with their units
+    # in _data_units, and only become Quantities when read
+    temp = utils.channel("temp")
+    rh = utils.channel("rh")
+    pres = utils.channel("pres")
+    alt = utils.channel("alt")
+
+    # Derived variables and the gridded variables they are calculated from.
+    # See register_derived.
+    _derived = {}
+    _derived_from = ("temp", "rh", "pres")
+
     def __init__(self, *args, **kwargs):
+        self._data = {}
+        self._data_units = {}
+        # Per-point sums and counts of the gridded variables, used by coarsen
+        self._sums = {}
+        self._counts = {}
+        self.rh_sample_flags = None
+        self.temp_sample_flags = None
         if len([*args]) > 0:
             self._init2(*args, **kwargs)
 
     def _init2(self, temp_dict, resolution, file_path=None,
                gridded_times=None, gridded_base=None, indices=(None, None),
-               ascent=True, units=None, meta=None, nc_level='low'):
+               ascent=True, units=None, meta=None, nc_level='low',
+               reducer='mean', qc_window=None):
         """ Creates Thermo_Profile object from raw data at the specified
         resolution.
 
@@ -46,7 +166,8 @@ class Thermo_Profile():
             which is returned by \
             Raw_Profile.thermo_data
         :param Quantity resoltion: vertical resolution in units of altitude \
-           or pressure to which the data should be calculated
+           or pressure, or temporal resolution in units of time, to which \
+           the data should be calculated
         :param str file_path: the path to the original data file WITHOUT the \
            suffix .nc or .json
         :param np.Array<Datetime> gridded_times: times at which data points \
@@ -62,7 +183,16 @@ class Thermo_Profile():
            of NetCDF files will be generated. For individual files for each \
            Raw, Thermo, \
            and Wind Profile, specify 'low'. For no NetCDF files, specify \
-           'none'.
+           'none'. 'low' also caches each gridded Thermo and Wind Profile \
+           next to the data file (see utils.product_cache_path), which is \
+           read instead of gridding again when the same data is processed \
+           with the same settings. Nothing is cached with 'none'.
+        :param str reducer: how raw samples are combined into each gridded \
+           point. See utils.regrid_data.
+        :param int qc_window: if given, sensors are checked over moving \
+           windows of this many seconds and only the failing samples are \
+           removed (see utils.qc_windowed). Otherwise each sensor is kept or \
+           removed for the whole profile.
         """
         self._meta = meta
         self._units = units
@@ -71,56 +201,60 @@ class Thermo_Profile():
         else:
             self._ascent_filename_tag = "Descending"
 
-        try:
-            self._read_netCDF(file_path + "thermo_" +
-                            str(resolution.magnitude) +
-                            str(resolution.units) +
-                            self._ascent_filename_tag + ".nc")
+        self.resolution = resolution
+        self._datadir = os.path.dirname(file_path + ".json")
+
+        # Reuse the gridded product if nothing it depends on has changed
+        serial_numbers = temp_dict["serial_numbers"]
+        coefs = utils.coef_version(
+            [("Imet", sn) for key, sn in serial_numbers.items()
+             if "imet" in key]
+            + [("RH", sn) for key, sn in serial_numbers.items()
+               if "rh" in key])
+        self.cache_key = utils.product_key(
+            [temp_dict, gridded_times, gridded_base], resolution,
+            self._ascent_filename_tag, indices, coefs,
+            {"reducer": reducer, "qc_window": qc_window,
+             "backend": thermo_info.BACKEND})
+        cache_path = utils.product_cache_path(file_path, "thermo",
+                                              self.cache_key)
+        # Coarsening needs the sums and counts, and windowed QC the
+        # per-sample flags
+        required = []
+        if reducer == 'mean':
+            required.append("temp_sum")
+        if qc_window is not None:
+            required.append("temp_sample_flags")
+        if os.path.isfile(cache_path) and \
+                self._read_netCDF(cache_path, required):
             return
-        except Exception:
-            self.resolution = resolution
-            self.gridded_times = gridded_times
-            self.rh = None
-            self.pres = None
-            self.temp = None
-            self.alt = None
-            self.rh_flags = None
-            self.temp_flags = None
-            self._units = units
-            self._datadir = os.path.dirname(file_path + ".json")
-        
+
+        self.gridded_times = gridded_times
+        self.rh_flags = None
+        self.temp_flags = None
+
         if not indices[0] is None:
-            # trim profile
-            selection_temp = np.where(np.array(temp_dict["time_temp"]) > indices[0],
-                                      np.array(temp_dict["time_temp"]) < indices[1],
-                                      False)
-            selection_rh = np.where(np.array(temp_dict["time_rh"]) > indices[0],
-                                    np.array(temp_dict["time_rh"]) < indices[1],
-                                    False)
-            selection_pres = np.where(np.array(temp_dict["time_pres"]) > indices[0],
-                                      np.array(temp_dict["time_pres"]) < indices[1],
-                                      False)
+            # trim profile: one range per time axis, shared by its channels
+            selections = {axis: utils.trim_slice(temp_dict["time_" + axis],
+                                                 indices)
+                          for axis in ["temp", "rh", "pres"]}
 
             for key in temp_dict.keys():
                 if "time" not in key:
                     if ("temp" in key and "rh" not in key and "pres" not in key)\
                             or "resi" in key:
-                        temp_dict[key] = temp_dict[key].magnitude[np.where(selection_temp)] * temp_dict[key].units
+                        axis = "temp"
                     elif "pres" in key:
-                        temp_dict[key] = temp_dict[key].magnitude[np.where(selection_pres)] * temp_dict[key].units
+                        axis = "pres"
                     elif "rh" in key:
-                        temp_dict[key] = temp_dict[key].magnitude[np.where(selection_rh)] * temp_dict[key].units
+                        axis = "rh"
+                    else:
+                        continue
+                    temp_dict[key] = temp_dict[key][selections[axis]]
                 else:
-                     if ("temp" in key and "rh" not in key) \
-                             or "resi" in key:
-                         temp_dict[key] = np.array(temp_dict[key])[np.where(selection_temp)]
-                     elif "pres" in key:
-                         temp_dict[key] = np.array(temp_dict[key])[np.where(selection_pres)]
-                     elif "rh" in key:
-                        temp_dict[key] = np.array(temp_dict[key])[np.where(selection_rh)]
-
-        temp = []
-        rh = []
+                    axis = key[len("time_"):]
+                    temp_dict[key] = \
+                        np.asarray(temp_dict[key])[selections[axis]]
 
         temp_raw = []  # List of lists, each containing data from a sensor
 
@@ -141,9 +275,9 @@ class Thermo_Profile():
         # Process resistance if needed
         serial_numbers = temp_dict["serial_numbers"]
         if use_resistance:
-            for i in range(len(temp_raw)):
-                temp_raw[i] = utils.temp_calib(temp_raw[i],
-                                               serial_numbers["imet"+str(i+1)])
+            temp_raw = utils.temp_calib_all(
+                utils._stack_sensors(temp_raw),
+                [serial_numbers["imet"+str(i+1)] for i in range(len(temp_raw))])
         # End if-else blocks
 
         rh_raw = []
@@ -154,48 +288,51 @@ class Thermo_Profile():
                 rh_raw.append(temp_dict[key].magnitude)
         for i in range(len(rh_raw)):
             rh_raw[i] = utils.rh_calib(rh_raw[i], serial_numbers["rh"+str(i+1)])
-        alts = np.array(temp_dict["alt_pres"].magnitude)\
-            * temp_dict["alt_pres"].units
-        pres = np.array(temp_dict["pres"].magnitude)\
-            * temp_dict["pres"].units
-
-        time_rh = temp_dict["time_rh"]
-        time_pres = temp_dict["time_pres"]
-        time_temp = temp_dict["time_temp"]
-        # Determine bad sensors
-        self.rh_flags = utils.qc(rh_raw, 0.4, 0.2)  # TODO read these from file
-
-        # Remove bad sensors
-        for flags_ind in range(len(self.rh_flags)):
-            if self.rh_flags[flags_ind] != 0:
-                rh_raw[flags_ind] = np.full(len(rh_raw[flags_ind]), np.NaN)
-
-        # Average the sensors
-        for i in range(len(rh_raw[0])):
-            rh.append(np.nanmean([rh_raw[a][i] for a in
-                                  range(len(rh_raw))]))
-
-        rh = np.array(rh) * units.percent
-        # Determine which sensors are "bad"
-        self.temp_flags = utils.qc(temp_raw, 0.25, 0.1)
-
-        # Remove bad sensors
-        temp_ind = 0  # track index in temp_raw  after items are removed.
-        for flags_ind in range(len(self.temp_flags)):
-            if self.temp_flags[flags_ind] != 0:
-                print("Temperature sensor", temp_ind + 1, "removed")
-                temp_raw[temp_ind] = \
-                    [np.nan]*len(temp_raw[temp_ind])
-            else:
-                temp_ind += 1
-
-        # Average the sensors
-        for i in range(len(temp_raw[0])):
-
-            temp.append(np.nanmean([temp_raw[a][i] for a in
-                                   range(len(temp_raw))]))
+        alts = temp_dict["alt_pres"].magnitude
+        alt_units = temp_dict["alt_pres"].units
+        pres = temp_dict["pres"].magnitude
+        pres_units = temp_dict["pres"].units
+
+        # Convert each time axis once
+        time_rh = utils._as_datetime64(temp_dict["time_rh"])
+        time_pres = utils._as_datetime64(temp_dict["time_pres"])
+        time_temp = utils._as_datetime64(temp_dict["time_temp"])
+        # One row per sensor
+        rh_raw = utils._stack_sensors(rh_raw)
+        temp_raw = utils._stack_sensors(temp_raw)
+
+        if qc_window is not None:
+            # Determine bad samples
+            self.rh_sample_flags = utils.qc_windowed(rh_raw, time_rh, 0.4,
+                                                     0.2, qc_window)
+            rh_bad = self.rh_sample_flags != 0
+            # Sensors are only flagged if none of their samples are good
+            self.rh_flags = [int(flag) for flag in
+                             np.min(self.rh_sample_flags, axis=1)]
+        else:
+            # Determine bad sensors
+            self.rh_flags = utils.qc(rh_raw, 0.4, 0.2)  # TODO read these from file
+            rh_bad = (np.array(self.rh_flags) != 0)[:, None]
+
+        # Average the good sensors
+        rh = np.nanmean(np.where(rh_bad, np.nan, rh_raw), axis=0)
+
+        if qc_window is not None:
+            # Determine bad samples
+            self.temp_sample_flags = utils.qc_windowed(temp_raw, time_temp,
+                                                       0.25, 0.1, qc_window)
+            temp_bad = self.temp_sample_flags != 0
+            self.temp_flags = [int(flag) for flag in
+                               np.min(self.temp_sample_flags, axis=1)]
+        else:
+            # Determine which sensors are "bad"
+            self.temp_flags = utils.qc(temp_raw, 0.25, 0.1)
+            temp_bad = (np.array(self.temp_flags) != 0)[:, None]
+            for flags_ind in np.flatnonzero(temp_bad[:, 0]):
+                print("Temperature sensor", flags_ind + 1, "removed")
 
-        temp = np.array(temp) * units.kelvin
+        # Average the good sensors
+        temp = np.nanmean(np.where(temp_bad, np.nan, temp_raw), axis=0)
 
         #
         # Regrid to match times specified by Profile
@@ -205,47 +342,121 @@ class Thermo_Profile():
         if (self.resolution.dimensionality ==
                 self._units.get_dimensionality('m')):
             self.alt = gridded_base
-            self.pres = utils.regrid_data(data=pres, data_times=time_pres,
-                                          gridded_times=self.gridded_times,
-                                          units=self._units)
+            utils.regrid_channel(self, "pres", pres, pres_units, time_pres,
+                                 reducer)
         elif (self.resolution.dimensionality ==
               self._units.get_dimensionality('Pa')):
             self.pres = gridded_base
-            self.alt = utils.regrid_data(data=alts, data_times=time_pres,
-                                         gridded_times=self.gridded_times,
-                                         units=self._units)
+            utils.regrid_channel(self, "alt", alts, alt_units, time_pres,
+                                 reducer)
+        elif (self.resolution.dimensionality ==
+              self._units.get_dimensionality('s')):
+            utils.regrid_channel(self, "pres", pres, pres_units, time_pres,
+                                 reducer)
+            utils.regrid_channel(self, "alt", alts, alt_units, time_pres,
+                                 reducer)
 
         # grid RH
-        self.rh = utils.regrid_data(data=rh, data_times=time_rh,
-                                    gridded_times=self.gridded_times,
-                                    units=self._units)
+        utils.regrid_channel(self, "rh", rh, units.percent, time_rh, reducer)
 
         # grid temp
-        self.temp = utils.regrid_data(data=temp, data_times=time_temp,
-                                      gridded_times=self.gridded_times,
-                                      units=self._units)
-
-        minlen = min(len(self.alt), len(self.gridded_times), len(self.rh),
-                     len(self.pres), len(self.temp))
-        self.pres = self.pres[0:minlen]
-        self.temp = self.temp[0:minlen]
-        self.rh = self.rh[0:minlen]
-        self.alt = self.alt[0:minlen]
-        self.gridded_times = self.gridded_times[0:minlen]
-
-        # Calculate mixing ratio
-        self.mixing_ratio = calc.mixing_ratio_from_relative_humidity(
-                            np.divide(self.rh.magnitude, 100), self.temp,
-                            self.pres)
-
-        self.theta = calc.potential_temperature(self.pres, self.temp)
-        self.T_d = calc.dewpoint_from_relative_humidity(self.temp, self.rh)
-        self.q = calc.specific_humidity_from_mixing_ratio(self.mixing_ratio) * \
-                 units.gPerKg
+        utils.regrid_channel(self, "temp", temp, units.kelvin, time_temp,
+                             reducer)
+
+        minlen = min([len(self.gridded_times)]
+                     + [len(values) for values in self._data.values()])
+        self.truncate_to(minlen)
 
         if nc_level in 'low':
+            # The cache first, so it only holds derived variables which have
+            # been calculated
+            self._save_cache(cache_path)
             self._save_netCDF(file_path)
 
+    @classmethod
+    def derive_together(cls, thermo_profiles,
+                        names=("mixing_ratio", "theta", "T_d", "q")):
+        """ Calculates derived variables for several Thermo_Profiles at \
+        once. temp, rh, and pres of all profiles are stacked into 2D arrays \
+        padded with NaN, each variable is calculated with one call on the \
+        stack, and each profile receives its own row.
+
+        :param list<Thermo_Profile> thermo_profiles: the profiles
+        :param tuple<str> names: the derived variables to calculate. See \
+           register_derived.
+        """
+        if len(thermo_profiles) == 0:
+            return
+        first = thermo_profiles[0]
+        lengths = [len(thermo._data["temp"]) for thermo in thermo_profiles]
+
+        batch = cls()
+        batch._units = first._units
+        for name in cls._derived_from:
+            unit = first._data_units[name]
+            stacked = np.full((len(thermo_profiles), max(lengths)), np.nan)
+            for i, thermo in enumerate(thermo_profiles):
+                stacked[i, :lengths[i]] = getattr(thermo, name).m_as(unit)
+            batch._data[name] = stacked
+            batch._data_units[name] = unit
+
+        for name in names:
+            getattr(batch, name)
+            for i, thermo in enumerate(thermo_profiles):
+                thermo._data[name] = batch._data[name][i, :lengths[i]]
+                thermo._data_units[name] = batch._data_units[name]
+
+    @classmethod
+    def register_derived(cls, name, function, doc=None):
+        """ Adds a derived variable to every Thermo_Profile. It is \
+        calculated by function the first time it is read, and again after \
+        temp, rh, or pres change.
+
+        ``Thermo_Profile.register_derived("rho", lambda p: \
+        calc.density(p.pres, p.temp, p.mixing_ratio))``
+
+        :param str name: the attribute the variable is read from
+        :param function function: takes a Thermo_Profile and returns the \
+           variable as a Quantity
+        :param str doc: the attribute's docstring
+        """
+        cls._derived[name] = function
+        setattr(cls, name, utils.channel(name, doc=doc, derive=function))
+
+    def _channel_changed(self, name):
+        """ Forgets the derived variables when a variable they are \
+        calculated from changes. Called by the channel properties.
+
+        :param str name: the variable which changed
+        """
+        if name in self._derived_from:
+            self._clear_derived()
+
+    def _clear_derived(self):
+        """ Forgets the derived variables so they are calculated again \
+        when next read.
+        """
+        for name in self._derived.keys():
+            self._data.pop(name, None)
+            self._data_units.pop(name, None)
+
+    def coarsen(self, factor):
+        """ Creates a Thermo_Profile with factor times the resolution of this \
+        one from the per-point sums and counts of each group of factor \
+        points. See utils.coarsen_product.
+
+        :param int factor: number of points of this profile combined into \
+           each point of the new one
+        :rtype: Thermo_Profile
+        :return: the coarser Thermo_Profile
+        """
+        return utils.coarsen_product(self, factor,
+                                     ["pres", "alt", "rh", "temp"],
+                                     ["_meta", "_units",
+                                      "_ascent_filename_tag", "_datadir",
+                                      "rh_flags", "temp_flags",
+                                      "rh_sample_flags", "temp_sample_flags"])
+
     def truncate_to(self, new_len):
         """ Shortens arrays to have no more than new_len data points
 
@@ -253,46 +464,77 @@ class Thermo_Profile():
         :return: None
         """
 
-        self.pres = self.pres[:new_len]
-        self.temp = self.temp[:new_len]
-        self.rh = self.rh[:new_len]
-        self.alt = self.alt[:new_len]
-        self.T_d = self.T_d[:new_len]
-        self.theta = self.theta[:new_len]
-        self.mixing_ratio = self.mixing_ratio[:new_len]
-        self.q = self.q[:new_len]
-        self.gridded_times = self.gridded_times[:new_len]
+        self._clear_derived()
+        utils.truncate_product(self, new_len)
 
     def _save_netCDF(self, file_path):
         """ Save a NetCDF file to facilitate future processing if a .JSON was
-        read.
+        read. It is named from the flight's metadata as \
+        <location><resolution><platform_id>CMTthermo_<leg>.c1.<timestamp>.cdf \
+        and written next to the data file.
 
-        :param string file_path: file name
+        :param string file_path: the path to the original data file WITHOUT \
+           the suffix .nc or .json
         """
+        if self._meta is None:
+            # The file is named from the flight's metadata
+            return
         file_name = str(self._meta.get("location")) + str(self.resolution.magnitude) + \
                     str(self._meta.get("platform_id")) + "CMT" + \
                     "thermo_" + self._ascent_filename_tag + ".c1." + \
                     self._meta.get("timestamp").replace("_", ".") + ".cdf"
         file_name = os.path.join(os.path.dirname(file_path), file_name)
+        self._write_netCDF(file_name, ["pres", "rh", "alt", "temp",
+                                       "mixing_ratio", "theta", "T_d", "q"])
 
+    def _save_cache(self, cache_path):
+        """ Saves the gridded product so that it can be read instead of \
+        gridded again, with the per-point sums and counts coarsen needs and \
+        the per-sample QC flags. Derived variables are only written if they \
+        have already been calculated, so saving does not calculate them.
+
+        :param string cache_path: file name, see utils.product_cache_path
+        """
+        self._write_netCDF(cache_path,
+                           ["pres", "rh", "alt", "temp"]
+                           + [name for name in self._derived
+                              if name in self._data],
+                           cache=True)
+
+    def _write_netCDF(self, file_name, names, cache=False):
+        """ Writes the QC flags, times, and gridded variables to a NetCDF \
+        file.
+
+        :param string file_name: the file
+        :param list<str> names: the gridded and derived variables to write
+        :param bool cache: True to also write the cache key, per-sample QC \
+           flags, and per-point sums and counts
+        """
         main_file = netCDF4.Dataset(file_name, "w",
                                     format="NETCDF4", mmap=False)
         # File NC compliant to version 1.8
         main_file.setncattr("Conventions", "NC-1.8")
+        if cache:
+            main_file.setncattr("cache_key", self.cache_key)
 
         #
         # Get the flags in
         #
-        flag_dict = {0: "good",
-                     2: "bias",
-                     3: "lag",
-                     4: "empty"}
         rh_flags = main_file.createGroup("rh_flags")
         for i in range(len(self.rh_flags)):
-            rh_flags.setncattr("sensor" + str(i+1), flag_dict[self.rh_flags[i]])
+            rh_flags.setncattr("sensor" + str(i+1), _flag_names[self.rh_flags[i]])
         temp_flags = main_file.createGroup("temp_flags")
         for i in range(len(self.temp_flags)):
-            temp_flags.setncattr("sensor" + str(i+1), flag_dict[self.temp_flags[i]])
+            temp_flags.setncattr("sensor" + str(i+1), _flag_names[self.temp_flags[i]])
+        # Per-sample flags of windowed QC
+        for key in ["rh_sample_flags", "temp_sample_flags"]:
+            flags = getattr(self, key)
+            if cache and flags is not None:
+                main_file.createDimension(key + "_sensor", flags.shape[0])
+                main_file.createDimension(key + "_sample", flags.shape[1])
+                flags_var = main_file.createVariable(
+                    key, "i1", (key + "_sensor", key + "_sample"))
+                flags_var[:] = flags
 
         main_file.createDimension("time", None)
         # TIME
@@ -301,77 +543,56 @@ class Thermo_Profile():
                                        units='microseconds since \
                                        2010-01-01 00:00:00:00')
         time_var.units = 'microseconds since 2010-01-01 00:00:00:00'
-        # PRES
-        pres_var = main_file.createVariable("pres", "f8", ("time",))
-        pres_var[:] = self.pres.magnitude
-        pres_var.units = str(self.pres.units)
-        # RH
-        rh_var = main_file.createVariable("rh", "f8", ("time",))
-        rh_var[:] = self.rh.magnitude
-        rh_var.units = str(self.rh.units)
-        # ALT
-        alt_var = main_file.createVariable("alt", "f8", ("time",))
-        alt_var[:] = self.alt.magnitude
-        alt_var.units = str(self.alt.units)
-        # TEMP
-        temp_var = main_file.createVariable("temp", "f8", ("time",))
-        temp_var[:] = self.temp.magnitude
-        temp_var.units = str(self.temp.units)
-        # MIXING RATIO
-        mr_var = main_file.createVariable("mr", "f8", ("time",))
-        mr_var[:] = self.mixing_ratio.magnitude
-        mr_var.units = str(self.mixing_ratio.units)
-        # THETA
-        theta_var = main_file.createVariable("theta", "f8", ("time",))
-        theta_var[:] = self.theta.magnitude
-        theta_var.units = str(self.theta.units)
-        # T_D
-        Td_var = main_file.createVariable("Td", "f8", ("time",))
-        Td_var[:] = self.T_d.magnitude
-        Td_var.units = str(self.T_d.units)
-        # Q
-        q_var = main_file.createVariable("q", "f8", ("time",))
-        q_var[:] = self.q.magnitude
-        q_var.units = str(self.q.units)
+        # PRES, RH, ALT, TEMP, and derived variables
+        for name in names:
+            values = getattr(self, name)
+            var = main_file.createVariable(_nc_names.get(name, name), "f8",
+                                           ("time",))
+            var[:] = values.magnitude
+            var.units = str(values.units)
+        if cache:
+            # Sums and counts, used by coarsen
+            utils.write_sums(main_file, self)
 
         main_file.close()
 
-    def _read_netCDF(self, file_path):
+    def _read_netCDF(self, file_path, required=()):
         """ Reads data from a NetCDF file. Called by the constructor.
 
-        :param string file_path: file name
+        :param string file_path: file name, see utils.product_cache_path
+        :param list<str> required: variables the file must contain. If any \
+           is missing, e.g. in a file written by an earlier version, nothing \
+           is read.
+        :rtype: bool
+        :return: True if the file was read
         """
-        file_name = str(self._meta.get("location")) + str(self.resolution.magnitude) + \
-                    str(self._meta.get("platform_id")) + "CMT" + \
-                    "thermo_" + self._ascent_filename_tag + ".c1." + \
-                    self._meta.get("date_utc").replace("_", ".") + ".cdf"
-        file_name = os.path.join(os.path.dirname(file_path), file_name)
         main_file = netCDF4.Dataset(file_path, "r",
                                     format="NETCDF4", mmap=False)
-
-        self.temp_flags = [main_file["temp_flags"].getncattr("sensor"+str(i+1)) for i in 
-                           range(len(main_file["temp_flags"].ncattrs()))] 
-        self.rh_flags = [main_file["rh_flags"].getncattr("sensor"+str(i+1)) for i in 
+        if any([name not in main_file.variables for name in required]):
+            main_file.close()
+            return False
+
+        flag_values = {name: flag for flag, name in _flag_names.items()}
+        self.temp_flags = [flag_values[main_file["temp_flags"].getncattr("sensor"+str(i+1))] for i in
+                           range(len(main_file["temp_flags"].ncattrs()))]
+        self.rh_flags = [flag_values[main_file["rh_flags"].getncattr("sensor"+str(i+1))] for i in
                            range(len(main_file["rh_flags"].ncattrs()))]
+        for key in ["rh_sample_flags", "temp_sample_flags"]:
+            if key in main_file.variables:
+                setattr(self, key,
+                        np.array(main_file.variables[key]).astype(int))
         # Note: each data chunk is converted to an np array. This is not a
         # superfluous conversion; a Variable object is incompatible with pint.
 
-        self.alt = np.array(main_file.variables["alt"])* \
-            self._units.parse_expression(main_file.variables["alt"].units)
-        self.pres = np.array(main_file.variables["pres"]) * \
-            self._units.parse_expression(main_file.variables["pres"].units)
-        self.rh = np.array(main_file.variables["rh"]) * \
-            self._units.parse_expression(main_file.variables["rh"].units)
-        self.temp = np.array(main_file.variables["temp"]) * \
-            self._units.parse_expression(main_file.variables["temp"].units)
-        self.mixing_ratio = np.array(main_file.variables["mr"]) * \
-            self._units.parse_expression(main_file.variables["mr"].units)
-        self.theta = np.array(main_file.variables["theta"]) * \
-            self._units.parse_expression(main_file.variables["theta"].units)
-        self.T_d = np.array(main_file.variables["Td"]) * \
-            self._units.parse_expression(main_file.variables["Td"].units)
-        self.q = np.array(main_file.variables["q"]) * \
-            self._units.parse_expression(main_file.variables["q"].units)
+        # The variables derived ones are calculated from come first, as
+        # setting them forgets derived variables
+        for name in ["alt", "pres", "rh", "temp"] + list(self._derived):
+            nc_name = _nc_names.get(name, name)
+            if nc_name in main_file.variables:
+                setattr(self, name, np.array(main_file.variables[nc_name]) *
+                        self._units.parse_expression(
+                            main_file.variables[nc_name].units))
+        utils.read_sums(main_file, self)
         base_time = dt.datetime(2010, 1, 1, 0, 0, 0, 0)
         self.gridded_times = []
         for i in range(len(main_file.variables["time"][:])):
@@ -380,6 +601,7 @@ class Thermo_Profile():
                                                                    ["time"][i])))
             # Hardcoded to microseconds since 2010-1-1
         main_file.close()
+        return True
 
     def __deepcopy__(self, memo):
         cls = self.__class__
@@ -400,3 +622,11 @@ class Thermo_Profile():
                     + "\n\t\t\ttemp:         " + str(type(self.temp)) \
                     + "\n\t\t\tmixing_ratio: " + str(type(self.mixing_ratio))
         return to_return
+
+
+Thermo_Profile.register_derived("mixing_ratio", _mixing_ratio)
+Thermo_Profile.register_derived("theta", _theta)
+Thermo_Profile.register_derived("T_d", _T_d)
+Thermo_Profile.register_derived("q", _q)
+Thermo_Profile.register_derived("theta_v", _theta_v)
+Thermo_Profile.register_derived("theta_e", _theta_e)
@@ -6,11 +6,20 @@ import pandas as pd
 import datetime as dt
 import os
 import profiles.utils as utils
-import metpy.calc
 import netCDF4
 from copy import deepcopy, copy
 
 
+def _cos_sin(angle):
+    """ Calculates the cosine and sine of angles as plain arrays.
+
+    :param np.Array<Quantity> angle: angles in any units, or plain radians
+    :rtype: tuple(np.Array<float>, np.Array<float>)
+    :return: the cosines and sines
+    """
+    return (utils._strip(np.cos(angle))[0], utils._strip(np.sin(angle))[0])
+
+
 class Wind_Profile():
     """ Processes and holds wind data from one vertical profile
 
@@ -24,21 +33,39 @@ class Wind_Profile():
     :var Quantity resolution: the vertical resolution of the processed data
     :var bool ascent: is data from the ascending leg of the flight processed?\
        If not, False.
+    :var str cache_key: identifies the inputs and settings the gridded \
+       data was calculated from, see utils.product_key
     """
 
+    # Gridded variables are kept as plain arrays in _data, with their units
+    # in _data_units, and only become Quantities when read
+    u = utils.channel("u")
+    v = utils.channel("v")
+    dir = utils.channel("dir")
+    speed = utils.channel("speed")
+    pres = utils.channel("pres")
+    alt = utils.channel("alt")
+
     def __init__(self, *args, **kwargs):
+        self._data = {}
+        self._data_units = {}
+        # Per-point sums and counts of the gridded variables, used by coarsen
+        self._sums = {}
+        self._counts = {}
         if len([*args]) > 0:
             self._init2(*args, **kwargs)
 
     def _init2(self, wind_dict, resolution, file_path=None,
                gridded_times=None, gridded_base=None, indices=(None, None),
-               ascent=True, units=None, nc_level='low', meta=None):
+               ascent=True, units=None, nc_level='low', meta=None,
+               reducer='mean', moving_platform=False):
         """ Creates Wind_Profile object based on rotation data at the specified
         resolution
 
         :param dict wind_dict: the dictionary produced by \
            Raw_Profile.get_wind_data()
-        :param Quantity resolution: vertical resolution of the processed data
+        :param Quantity resolution: vertical (altitude or pressure) or \
+           temporal resolution of the processed data
         :param List<Datetime> gridded_times: times for which Profile has \
            requested wind data
         :param tuple<int> indices: if applicable, the user-defined bounds of \
@@ -53,7 +80,14 @@ class Wind_Profile():
            of NetCDF files will be generated. For individual files for each \
            Raw, Thermo, \
            and Wind Profile, specify 'low'. For no NetCDF files, specify \
-           'none'.
+           'none'. 'low' also caches each gridded Thermo and Wind Profile \
+           next to the data file (see utils.product_cache_path), which is \
+           read instead of gridding again when the same data is processed \
+           with the same settings. Nothing is cached with 'none'.
+        :param str reducer: how raw samples are combined into each gridded \
+           point. See utils.regrid_data.
+        :param bool moving_platform: True to correct the winds for the \
+           vehicle's ground velocity. See _calc_winds.
         """
 
         self._meta = meta
@@ -62,173 +96,218 @@ class Wind_Profile():
         else:
             self._ascent_filename_tag = "Descending"
 
-        try:
-            self._read_netCDF(file_path + "wind_" +
-                              str(resolution.magnitude) +
-                              str(resolution.units) +
-                              self._ascent_filename_tag + ".nc")
+        self.resolution = resolution
+        self.ascent = ascent
+        self._indices = indices
+        self._units = units
+        self._datadir = os.path.dirname(file_path + ".json")
+
+        # Reuse the gridded product if nothing it depends on has changed
+        tail_num = utils.coef_manager.get_tail_n(
+            wind_dict["serial_numbers"]["copterID"])
+        self.cache_key = utils.product_key(
+            [wind_dict, gridded_times, gridded_base], resolution,
+            self._ascent_filename_tag, indices,
+            utils.coef_version([("Wind", tail_num)]),
+            {"reducer": reducer, "moving_platform": moving_platform})
+        cache_path = utils.product_cache_path(file_path, "wind",
+                                              self.cache_key)
+        # Coarsening needs the sums and counts
+        required = ["u_sum"] if reducer == 'mean' else []
+        if os.path.isfile(cache_path) and \
+                self._read_netCDF(cache_path, required):
             return
 
-        except Exception:
-            self.resolution = resolution
-            self.gridded_times = gridded_times
-            self.ascent = ascent
-            self.pres = wind_dict["pres"]
-            self.alt = wind_dict["alt"]
-            self._indices = indices
-            self._units = units
-            self._datadir = os.path.dirname(file_path + ".json")
+        self.gridded_times = gridded_times
 
-        
         # If no indices given, use entire file
         if not indices[0] is None:
-            # trim profile
-            selection = np.where(np.array(wind_dict["time"]) > indices[0],
-                                 np.array(wind_dict["time"]) < indices[1],
-                                 False)
-
-            wind_dict["roll"] = \
-                np.array(wind_dict["roll"].magnitude)[selection] * \
-                wind_dict["roll"].units
-            wind_dict["pitch"] = \
-                np.array(wind_dict["pitch"].magnitude)[selection] * \
-                wind_dict["pitch"].units
-            wind_dict["yaw"] = \
-                np.array(wind_dict["yaw"].magnitude)[selection] * \
-                wind_dict["yaw"].units
-            wind_dict["speed_east"] = \
-                np.array(wind_dict["speed_east"].magnitude)[selection] * \
-                wind_dict["speed_east"].units
-            wind_dict["speed_north"] = \
-                np.array(wind_dict["speed_north"].magnitude)[selection] \
-                * wind_dict["speed_north"].units
-            wind_dict["speed_down"] = \
-                np.array(wind_dict["speed_down"].magnitude)[selection] * \
-                wind_dict["speed_down"].units
-            wind_dict["time"] = np.array(wind_dict["time"])[selection]
-
-        direction, speed, time = self._calc_winds(wind_dict)
-
-        direction = direction % (2*np.pi)
+            # trim profile: one range per time axis, shared by its channels
+            selection = utils.trim_slice(wind_dict["time"], indices)
+            for key in ["roll", "pitch", "yaw", "speed_east", "speed_north",
+                        "speed_down"]:
+                wind_dict[key] = wind_dict[key][selection]
+            wind_dict["time"] = np.asarray(wind_dict["time"])[selection]
+
+            selection = utils.trim_slice(wind_dict["time_pres"], indices)
+            for key in ["pres", "alt"]:
+                wind_dict[key] = wind_dict[key][selection]
+            wind_dict["time_pres"] = \
+                np.asarray(wind_dict["time_pres"])[selection]
+
+        direction, speed, time = self._calc_winds(wind_dict, moving_platform)
+
+        # Convert each time axis once
+        time = utils._as_datetime64(time)
+        time_pres = utils._as_datetime64(wind_dict["time_pres"])
 
         #
         # Regrid to res
 
         # grid alt and pres
+        pres, pres_units = utils._strip(wind_dict["pres"])
+        alts, alt_units = utils._strip(wind_dict["alt"])
         if (self.resolution.dimensionality ==
                 self._units.get_dimensionality('m')):
+            utils.regrid_channel(self, "pres", pres, pres_units, time_pres,
+                                 reducer)
             self.alt = gridded_base
-            self.pres = utils.regrid_data(data=self.pres, data_times=time,
-                                          gridded_times=self.gridded_times,
-                                          units=self._units)
         elif (self.resolution.dimensionality ==
               self._units.get_dimensionality('Pa')):
+            utils.regrid_channel(self, "alt", alts, alt_units, time_pres,
+                                 reducer)
             self.pres = gridded_base
-            self.alt = utils.regrid_data(data=self.alt, data_times=time,
-                                         gridded_times=self.gridded_times,
-                                         units=self._units)
-
-        self.dir = utils.regrid_data(data=direction, data_times=time,
-                                     gridded_times=self.gridded_times,
-                                     units=self._units)
-        self.speed = utils.regrid_data(data=speed, data_times=time,
-                                       gridded_times=self.gridded_times,
-                                       units=self._units)
-        self.u, self.v = metpy.calc.wind_components(self.speed, self.dir)
-
-        minlen = min([len(self.u), len(self.v), len(self.dir),
-                      len(self.speed), len(self.alt), len(self.pres),
-                      len(self.gridded_times)])
-        self.u = self.u[0:minlen]
-        self.v = self.v[0:minlen]
-        self.dir = self.dir[0:minlen]
-        self.speed = self.speed[0:minlen]
-        self.alt = self.alt[0:minlen]
-        self.pres = self.pres[0:minlen]
-        self.gridded_times = self.gridded_times[0:minlen]
+        elif (self.resolution.dimensionality ==
+              self._units.get_dimensionality('s')):
+            utils.regrid_channel(self, "pres", pres, pres_units, time_pres,
+                                 reducer)
+            utils.regrid_channel(self, "alt", alts, alt_units, time_pres,
+                                 reducer)
+
+        # Grid the components rather than direction and speed, so that
+        # directions on either side of north average correctly
+        speed = speed.m_as(self._units.m / self._units.s)
+        direction = direction.m_as(self._units.rad)
+        self._regrid_components(-speed * np.sin(direction),
+                                -speed * np.cos(direction), time, reducer)
+        self._calc_speed_dir()
+
+        minlen = min([len(self.gridded_times)]
+                     + [len(values) for values in self._data.values()])
+        self.truncate_to(minlen)
         #
         # save NC
         #
         if nc_level in 'low':
+            self._save_cache(cache_path)
             self._save_netCDF(file_path)
 
+    def _regrid_components(self, u, v, data_times, reducer):
+        """ Grids the wind components to self.gridded_times together, as \
+        they share times and units, and stores them as u and v.
+
+        :param np.Array<float> u: U-component of each sample in m/s
+        :param np.Array<float> v: V-component of each sample in m/s
+        :param np.Array<Datetime> data_times: times corresponding to u and v
+        :param str reducer: see utils.regrid_data
+        """
+        if reducer == 'mean':
+            sums, counts = utils.regrid_sums(data=np.column_stack((u, v)),
+                                             data_times=data_times,
+                                             gridded_times=self.gridded_times)
+            for i, name in enumerate(["u", "v"]):
+                self._sums[name] = sums[:, i]
+                self._counts[name] = counts[:, i]
+                self._data[name] = sums[:, i] / counts[:, i]
+                self._data_units[name] = self._units.m / self._units.s
+        else:
+            for name, values in [("u", u), ("v", v)]:
+                utils.regrid_channel(self, name, values,
+                                     self._units.m / self._units.s,
+                                     data_times, reducer)
+
+    def _calc_speed_dir(self):
+        """ Calculates speed and direction from the gridded u and v. """
+        u = self._data["u"]
+        v = self._data["v"]
+        self._data["speed"] = np.hypot(u, v)
+        self._data_units["speed"] = self._data_units["u"]
+        self._data["dir"] = np.degrees(np.arctan2(-u, -v)) % 360.
+        self._data_units["dir"] = self._units.deg
+
+    def coarsen(self, factor):
+        """ Creates a Wind_Profile with factor times the resolution of this \
+        one from the per-point sums and counts of each group of factor \
+        points. See utils.coarsen_product.
+
+        :param int factor: number of points of this profile combined into \
+           each point of the new one
+        :rtype: Wind_Profile
+        :return: the coarser Wind_Profile
+        """
+        result = utils.coarsen_product(self, factor, ["pres", "alt", "u", "v"],
+                                       ["_meta", "_units",
+                                        "_ascent_filename_tag", "_datadir",
+                                        "_indices", "ascent"])
+        result._calc_speed_dir()
+        return result
+
     def truncate_to(self, new_len):
         """ Shortens arrays to have no more than new_len data points
 
         :param new_len: The new, shorter length
         :return: None
         """
+        utils.truncate_product(self, new_len)
+
+    def _calc_winds(self, wind_data, moving_platform=False):
+        """ Calculate wind direction and speed. The copter's tilt gives the \
+        wind relative to the copter, which is only the true wind when the \
+        craft is HORIZONTALLY STATIONARY. With moving_platform, the ground \
+        velocity (speed_east, speed_north) is added to the relative wind's \
+        components, so moving craft are handled too.
 
-        self.u = self.u[:new_len]
-        self.v = self.v[:new_len]
-        self.dir = self.dir[:new_len]
-        self.speed = self.speed[:new_len]
-        self.alt = self.alt[:new_len]
-        self.pres = self.pres[:new_len]
-        self.gridded_times = self.gridded_times[:new_len]
-
-    def _calc_winds(self, wind_data):
-        """ Calculate wind direction, speed, u, and v. Currently, this only
-        works when the craft is HORIZONTALLY STATIONARY.
         :param dict wind_data: dictionary from Raw_Profile.get_wind_data()
-        :param bool isCopter: True if rotor-wing, false if fixed-wing
+        :param bool moving_platform: True to correct for the ground velocity
         :rtype: tuple<list>
-        :return: (direction, speed)
+        :return: (direction, speed, time)
         """
-
-        # TODO account for moving platform
         tail_num = utils.coef_manager.get_tail_n(wind_data['serial_numbers']['copterID'])
 
-        # psi and az represent the copter's direction in spherical coordinates
-        psi = np.zeros(len(wind_data["roll"])) * self._units.rad
-        az = np.zeros(len(wind_data["roll"])) * self._units.rad
-
-        for i in range(len(wind_data["roll"])):
-            # croll is cos(roll), sroll is sin(roll)...
-            croll = np.cos(wind_data["roll"][i])
-            sroll = np.sin(wind_data["roll"][i])
-            cpitch = np.cos(wind_data["pitch"][i])
-            spitch = np.sin(wind_data["pitch"][i])
-            cyaw = np.cos(wind_data["yaw"][i])
-            syaw = np.sin(wind_data["yaw"][i])
-
-            Rx = np.matrix([[1, 0, 0],
-                            [0, croll, sroll],
-                            [0, -sroll, croll]])
-            Ry = np.matrix([[cpitch, 0, -spitch],
-                            [0, 1, 0],
-                            [spitch, 0, cpitch]])
-            Rz = np.matrix([[cyaw, -syaw, 0],
-                            [syaw, cyaw, 0],
-                            [0, 0, 1]])
-            R = Rz * Ry * Rx
-
-            psi[i] = np.arccos(R[2, 2])
-            az[i] = np.arctan2(R[1, 2], R[0, 2])
-
-
-        coefs = utils.coef_manager.get_coefs('Wind', tail_num)
-        speed = float(coefs['A']) * np.sqrt(np.tan(psi)).magnitude + float(coefs['B'])
+        # psi and az represent the copter's direction in spherical coordinates.
+        # They only depend on the last column of R = Rz * Ry * Rx, which is
+        # calculated for all samples at once.
+        croll, sroll = _cos_sin(wind_data["roll"])
+        cpitch, spitch = _cos_sin(wind_data["pitch"])
+        cyaw, syaw = _cos_sin(wind_data["yaw"])
+
+        R02 = -cyaw * spitch * croll - syaw * sroll
+        R12 = -syaw * spitch * croll + cyaw * sroll
+        R22 = cpitch * croll
+
+        psi = np.arccos(R22) * self._units.rad
+        az = np.arctan2(R12, R02) * self._units.rad
+
+        calibrator = utils.coef_manager.get_calibrator('Wind', tail_num)
+        speed = calibrator(np.sqrt(np.tan(psi)).magnitude)
 
         speed = speed * self._units.m / self._units.s
         # Throw out negative speeds
         speed[speed.magnitude < 0.] = np.nan
 
+        if moving_platform:
+            # The tilt responds to the air moving past the copter, i.e. the
+            # wind minus the ground velocity, so the ground velocity is added
+            # back. Components point where the wind blows to.
+            u_rel = -speed.magnitude * np.sin(az.magnitude)
+            v_rel = -speed.magnitude * np.cos(az.magnitude)
+            u = u_rel + wind_data["speed_east"].m_as(self._units.m
+                                                     / self._units.s)
+            v = v_rel + wind_data["speed_north"].m_as(self._units.m
+                                                      / self._units.s)
+            speed = np.hypot(u, v) * self._units.m / self._units.s
+            az = np.arctan2(-u, -v) * self._units.rad
+
         # Fix negative angles
         az = az.to(self._units.deg)
-        iNeg = np.squeeze(np.where(az.magnitude < 0.))
-        az[iNeg] = az[iNeg] + 360. * self._units.deg
+        az = np.where(az.magnitude < 0., az.magnitude + 360.,
+                      az.magnitude) * self._units.deg
 
         # az is the wind direction, speed is the wind speed
         return (az, speed, wind_data["time"])
 
     def _save_netCDF(self, file_path):
         """ Save a NetCDF file to facilitate future processing if a .JSON was
-        read.
+        read. It is named from the flight's metadata as \
+        <location><resolution><platform_id>CMTwind_<leg>.c1.<timestamp>.cdf \
+        and written next to the data file, unless it already exists.
 
-        :param string file_path: file name
+        :param string file_path: the path to the original data file WITHOUT \
+           the suffix .nc or .json
         """
-
+        if self._meta is None:
+            # The file is named from the flight's metadata
+            return
         file_name = str(self._meta.get("location")) + str(self.resolution.magnitude) + \
                     str(self._meta.get("platform_id")) + "CMT" + \
                     "wind_" + self._ascent_filename_tag + ".c1." + \
@@ -236,11 +315,30 @@ class Wind_Profile():
         file_name = os.path.join(os.path.dirname(file_path), file_name)
         if os.path.isfile(file_name):
             return
+        self._write_netCDF(file_name)
 
+    def _save_cache(self, cache_path):
+        """ Saves the gridded product so that it can be read instead of \
+        gridded again, with the per-point sums and counts coarsen needs.
+
+        :param string cache_path: file name, see utils.product_cache_path
+        """
+        self._write_netCDF(cache_path, cache=True)
+
+    def _write_netCDF(self, file_name, cache=False):
+        """ Writes the gridded winds, altitude, pressure, and times to a \
+        NetCDF file.
+
+        :param string file_name: the file
+        :param bool cache: True to also write the cache key and per-point \
+           sums and counts
+        """
         main_file = netCDF4.Dataset(file_name, "w",
                                     format="NETCDF4", mmap=False)
         # File NC compliant to version 1.8
         main_file.setncattr("Conventions", "NC-1.8")
+        if cache:
+            main_file.setncattr("cache_key", self.cache_key)
         
         main_file.createDimension("time", None)
         # DIRECTION
@@ -274,16 +372,27 @@ class Wind_Profile():
                                        units='microseconds since \
                                        2010-01-01 00:00:00:00')
         time_var.units = 'microseconds since 2010-01-01 00:00:00:00'
+        if cache:
+            # Sums and counts, used by coarsen
+            utils.write_sums(main_file, self)
 
         main_file.close()
 
-    def _read_netCDF(self, file_path):
+    def _read_netCDF(self, file_path, required=()):
         """ Reads data from a NetCDF file. Called by the constructor.
 
-        :param string file_path: file name
+        :param string file_path: file name, see utils.product_cache_path
+        :param list<str> required: variables the file must contain. If any \
+           is missing, e.g. in a file written by an earlier version, nothing \
+           is read.
+        :rtype: bool
+        :return: True if the file was read
         """
         main_file = netCDF4.Dataset(file_path, "r",
                                     format="NETCDF4", mmap=False)
+        if any([name not in main_file.variables for name in required]):
+            main_file.close()
+            return False
         # Note: each data chunk is converted to an np array. This is not a
         # superfluous conversion; a Variable object is incompatible with pint.
 
@@ -305,8 +414,10 @@ class Wind_Profile():
             self.gridded_times.append(base_time + dt.timedelta(microseconds=
                                                                int(main_file.variables
                                                                    ["time"][i])))
+        utils.read_sums(main_file, self)
 
         main_file.close()
+        return True
 
     def __deepcopy__(self, memo):
         cls = self.__class__
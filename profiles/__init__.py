@@ -1,3 +1,5 @@
+__version__ = "1.3.1"
+
 from .Raw_Profile import Raw_Profile
 from .Profile import Profile
 
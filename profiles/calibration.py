@@ -0,0 +1,130 @@
+"""
+Calibration equations, keyed by the Equation id of the coefficient table
+"""
+import numpy as np
+
+
+def _equation_e1(x, A, B):
+    """ Linear calibration, A x + B """
+    return A * x + B
+
+
+def _equation_e2(x, A, B, C):
+    """ Steinhart-Hart calibration, 1 / (A + B ln(x) + C ln(x)^3) """
+    log_x = np.log(x)
+    return 1. / (A + B * log_x + C * log_x ** 3)
+
+
+def _offset(x, A):
+    """ Offset of A / 1000, or none if A is not given """
+    return x + np.nan_to_num(A / 1000.)
+
+
+# Calibration equations by id: the kernel and the names of the coefficients
+# it takes, in order. Each kernel takes the raw values and one value (or
+# column of per-row values) for each coefficient. See register_equation.
+EQUATIONS = {"E1": (_equation_e1, ("A", "B")),
+             "E2": (_equation_e2, ("A", "B", "C")),
+             "offset": (_offset, ("A",))}
+
+# Equation used for each sensor type when its coefficients do not name a
+# known one
+DEFAULT_EQUATIONS = {"Imet": "E2",
+                     "RH": "offset",
+                     "Wind": "E1"}
+
+
+def register_equation(equation_id, kernel, coef_names):
+    """ Adds a calibration equation, so sensors whose coefficients name \
+    equation_id can be calibrated.
+
+    :param str equation_id: the id used in the Equation column
+    :param function kernel: takes the raw values followed by the \
+       coefficients named in coef_names and returns the calibrated values. \
+       It must broadcast, as several sensors are calibrated at once.
+    :param tuple<str> coef_names: the coefficient columns the kernel takes
+    """
+    EQUATIONS[equation_id] = (kernel, tuple(coef_names))
+
+
+class Calibrator():
+    """ Applies the calibration of one sensor. Created by \
+    Coef_Manager.get_calibrator.
+
+    :var str equation: the id of the calibration equation
+    :var np.array<float> values: the coefficients, in the order the \
+       equation takes them. Missing coefficients are NaN.
+    """
+
+    def __init__(self, equation, values):
+        """ Creates a Calibrator.
+
+        :param str equation: the id of the calibration equation
+        :param list<float> values: the coefficients, in the order the \
+           equation takes them
+        """
+        if equation not in EQUATIONS:
+            raise ValueError("Calibration equation " + str(equation) +
+                             " is not one of " + str(list(EQUATIONS)))
+        self.equation = equation
+        self.values = np.array(values, dtype=float)
+
+    @classmethod
+    def from_coefs(cls, type, coefs):
+        """ Creates a Calibrator from a row of the coefficient table.
+
+        :param str type: "Imet" or "RH" or "Wind"
+        :param dict coefs: the sensor's coefficients, as returned by \
+           Coef_Manager.get_coefs
+        :rtype: Calibrator
+        :return: the Calibrator
+        """
+        equation = str(coefs.get("Equation"))
+        if equation not in EQUATIONS:
+            equation = DEFAULT_EQUATIONS.get(type, equation)
+        names = EQUATIONS[equation][1] if equation in EQUATIONS else ()
+        return cls(equation, [_coef_value(coefs.get(name))
+                              for name in names])
+
+    def __call__(self, raw):
+        """ Calibrates raw values.
+
+        :param np.array<float> raw: the sensor's raw values
+        :rtype: np.array<float>
+        :return: the calibrated values
+        """
+        return EQUATIONS[self.equation][0](np.asarray(raw, dtype=float),
+                                           *self.values)
+
+
+def calibrate(raw, calibrators):
+    """ Calibrates several sensors at once. The sensors are grouped by \
+    equation, and each group is calibrated with one broadcast expression.
+
+    :param np.array<float> raw: 2D array of raw values, one row per sensor
+    :param list<Calibrator> calibrators: the calibrator of each row's sensor
+    :rtype: np.array<float>
+    :return: the calibrated values, with the shape of raw
+    """
+    raw = np.asarray(raw, dtype=float)
+    to_return = np.full(raw.shape, np.nan)
+    equations = np.array([calibrator.equation for calibrator in calibrators])
+    for equation in np.unique(equations):
+        rows = np.flatnonzero(equations == equation)
+        matrix = np.array([calibrators[i].values for i in rows])
+        columns = [matrix[:, i, np.newaxis] for i in range(matrix.shape[1])]
+        to_return[rows] = EQUATIONS[equation][0](raw[rows], *columns)
+    return to_return
+
+
+def _coef_value(value):
+    """ Reads a coefficient, which is NaN if it is missing or "na".
+
+    :param value: the coefficient as read from the coefficient table
+    :rtype: float
+    :return: the coefficient
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
@@ -1,3 +1,4 @@
+import os
 from types import SimpleNamespace
 
 ### Set up coef_info for Coef_Manager
@@ -9,4 +10,20 @@ coef_info.USE_AZURE="YES"
 coef_info.AZURE_CONNECTION_STRING="***REMOVED***"
 # If you are NOT using Azure, put the path to the coefs folder here
 coef_info.FILE_PATH="/home/jessicablunt/Profiles/coefs/"
+# Coef_Manager keeps up to CACHE_SIZE answers for CACHE_TTL seconds
+coef_info.CACHE_SIZE=1024
+coef_info.CACHE_TTL=3600
 
+
+### Set up bounds_info for Bounds_Store
+
+bounds_info = SimpleNamespace(DB_PATH=None)
+# Confirmed profile bounds are remembered here so files are not segmented twice
+bounds_info.DB_PATH=os.path.join(os.path.expanduser("~"), ".profiles", "bounds.sqlite")
+
+
+### Set up thermo_info for Thermo_Profile
+
+thermo_info = SimpleNamespace(BACKEND=None)
+# "numpy" calculates derived variables with profiles.thermo_kernels, "metpy" with metpy.calc
+thermo_info.BACKEND="numpy"
@@ -0,0 +1,97 @@
+"""
+Plain-numpy versions of the metpy calculations used for derived thermodynamic
+variables. They work on magnitudes in fixed units (temperature in K, relative
+humidity in percent, pressure in hPa), so they skip metpy's unit checking. The
+formulas and constants are those of metpy 0.12, the version setup.py requires;
+results agree with it to within 1e-4 relative error, with temperatures in K.
+tests/test_thermo_kernels.py checks this. Later versions of metpy changed some
+of these calculations.
+"""
+import numpy as np
+
+# metpy 0.12 constants
+R = 8.314462618  # J / mol / K
+Mw = 18.01528  # g / mol
+Md = 28.9644  # g / mol
+epsilon = Mw / Md
+Rd = R / Md * 1000  # J / kg / K
+Cp_d = 1005.  # J / kg / K
+kappa = Rd / Cp_d
+P0 = 1000.  # hPa
+sat_pressure_0c = 6.112  # hPa
+zero_degc = 273.15  # K
+
+
+def saturation_vapor_pressure(temp):
+    """ Calculates saturation vapor pressure with Bolton (1980).
+
+    :param np.array<float> temp: temperature in K
+    :rtype: np.array<float>
+    :return: saturation vapor pressure in hPa
+    """
+    return sat_pressure_0c * np.exp(17.67 * (temp - zero_degc)
+                                    / (temp - 29.65))
+
+
+def mixing_ratio_from_relative_humidity(rh, temp, pres):
+    """ Calculates mixing ratio. Matches \
+    metpy.calc.mixing_ratio_from_relative_humidity.
+
+    :param np.array<float> rh: relative humidity in percent
+    :param np.array<float> temp: temperature in K
+    :param np.array<float> pres: pressure in hPa
+    :rtype: np.array<float>
+    :return: mixing ratio in kg/kg
+    """
+    e_s = saturation_vapor_pressure(temp)
+    return rh / 100. * epsilon * e_s / (pres - e_s)
+
+
+def potential_temperature(pres, temp):
+    """ Calculates potential temperature. Matches \
+    metpy.calc.potential_temperature.
+
+    :param np.array<float> pres: pressure in hPa
+    :param np.array<float> temp: temperature in K
+    :rtype: np.array<float>
+    :return: potential temperature in K
+    """
+    return temp * (P0 / pres) ** kappa
+
+
+def dewpoint_from_relative_humidity(temp, rh):
+    """ Calculates dewpoint. Matches \
+    metpy.calc.dewpoint_from_relative_humidity.
+
+    :param np.array<float> temp: temperature in K
+    :param np.array<float> rh: relative humidity in percent
+    :rtype: np.array<float>
+    :return: dewpoint in degrees C
+    """
+    val = np.log(rh / 100. * saturation_vapor_pressure(temp)
+                 / sat_pressure_0c)
+    return 243.5 * val / (17.67 - val)
+
+
+def specific_humidity_from_mixing_ratio(mixing_ratio):
+    """ Calculates specific humidity. Matches \
+    metpy.calc.specific_humidity_from_mixing_ratio.
+
+    :param np.array<float> mixing_ratio: mixing ratio in kg/kg
+    :rtype: np.array<float>
+    :return: specific humidity in kg/kg
+    """
+    return mixing_ratio / (1 + mixing_ratio)
+
+
+def virtual_temperature(temp, mixing_ratio):
+    """ Calculates virtual temperature. Matches \
+    metpy.calc.virtual_temperature.
+
+    :param np.array<float> temp: temperature in K
+    :param np.array<float> mixing_ratio: mixing ratio in kg/kg
+    :rtype: np.array<float>
+    :return: virtual temperature in K
+    """
+    return temp * (mixing_ratio + epsilon) / (epsilon * (1 + mixing_ratio))
+
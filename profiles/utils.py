@@ -3,16 +3,17 @@ Utils contains misc. functions to aid in data analysis.
 """
 import sys
 import os
+import json
+import hashlib
 import warnings
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
 from datetime import timedelta
-from pandas.plotting import register_matplotlib_converters
 from pint import UnitStrippedWarning
 from metpy.units import units as u
 
+from . import __version__
 from .Coef_Manager import Coef_Manager
+from . import calibration
 
 
 package_path = os.path.dirname(os.path.abspath(__file__))
@@ -20,7 +21,6 @@ coef_manager = Coef_Manager()  # All required input is given in __init__.py
 
 warnings.filterwarnings("ignore", category=RuntimeWarning)
 warnings.filterwarnings("error", category=UnitStrippedWarning)
-register_matplotlib_converters()
 
 
 def regrid_base(base=None, base_times=None, new_res=None, ascent=True,
@@ -36,63 +36,128 @@ def regrid_base(base=None, base_times=None, new_res=None, ascent=True,
     :param bool ascent: True if data from ascending leg of profile is to be \
        analyzed, false if descending
     :param pint.UnitRegistry units: The unit registry defined in Profile
-    :param tuple indices: start and end times
+    :param tuple indices: start and end times of the leg, or the \
+       (start, peak, end) times of the whole profile
     :param Quantity base_start: lowest altitude value of gridded_base
     :rtype: tuple(np.Array<Datetime>, np.Array<Quantity>)
     :return: times at which the craft is at vertical points n*res above \
-       the profile starting height and the corrosponding base values
+       the profile starting height and the corrosponding base values. \
+       Times are always increasing, so for a descending leg the base values \
+       decrease.
     """
-    # Use negative pressure so that the max of the data list is the peak
-
     # Change indices to a 2-tuple with indices instead of times, start and end
     if indices[0] is None:
-        indices = (0, len(base))
-    else:
-        a = list(base_times).index(indices[0])
+        indices = (0, len(base) - 1)
+    elif len(indices) > 2:
         if ascent:
-            b = list(base_times).index(indices[1])
+            indices = (list(base_times).index(indices[0]),
+                       list(base_times).index(indices[1]))
         else:
-            b = list(base_times).index(indices[2])
-        indices = (a, b)
+            indices = (list(base_times).index(indices[1]),
+                       list(base_times).index(indices[2]))
+    else:
+        indices = (list(base_times).index(indices[0]),
+                   list(base_times).index(indices[1]))
+
+    base_units = base.units
+    res = new_res.to(base_units).magnitude
+    base = np.asarray(base.magnitude, dtype=float)
+    if base_start is not None:
+        base_start = base_start.to(base_units).magnitude
 
+    # Use negative pressure so that the max of the data list is the peak.
+    # The resolution stays positive, as the negated levels still increase.
     if new_res.dimensionality == units.Pa.dimensionality:
         base = -1*base
         if base_start is not None:
             base_start = -1*base_start
 
+    # The leg runs from its bottom to the peak; a descending leg is searched
+    # backwards in time
+    if ascent:
+        bottom, top = indices
+    else:
+        top, bottom = indices
+
     # Regrid base
     if base_start is None:
-        new_base = np.arange((base[indices[0]] + 0.5*new_res).magnitude,
-                             (base[indices[1]] - 0.5*new_res).magnitude,
-                             new_res.magnitude)
+        base_start = base[bottom] + 0.5*res
+    new_base = np.arange(base_start, base[top] - 0.5*res, res)
+
+    if ascent:
+        ind_in_grid = _crossing_indices(base, new_base, bottom, top)
     else:
-        new_base = np.arange(base_start.magnitude,
-                             (base[indices[1]] - 0.5 * new_res).magnitude,
-                             new_res.magnitude)
+        # Search the time-reversed leg, then put the times back in order
+        last = len(base) - 1
+        ind_in_grid = [last - i for i in
+                       _crossing_indices(base[::-1], new_base, last - bottom,
+                                         last - top)][::-1]
+        new_base = new_base[::-1]
 
-    new_base = np.array(new_base) * base.units
+    new_times = [base_times[i] for i in ind_in_grid]
+
+    if new_res.dimensionality == units.Pa.dimensionality:
+        new_base = -1*new_base
 
+    # Remove duplicates:
+    # new_times, indices = np.unique(new_times, return_index=True)
+    # new_base = new_base[indices]
+    return (new_times, new_base * base_units)
+
+
+def _crossing_indices(base, levels, first, last):
+    """ Finds the first index at which base reaches each level, searching \
+    forward from first and never beyond last for the search itself.
+
+    :param np.Array<float> base: vertical coordinate, increasing upwards
+    :param np.Array<float> levels: increasing levels to find
+    :param int first: index at which to start searching
+    :param int last: index at which to stop searching
+    :rtype: list<int>
+    :return: one index per level
+    """
     ind_in_grid = []
-    i = indices[0]
-    for elem in new_base:
-        while base[i] < elem and i < indices[1]:
+    i = first
+    for elem in levels:
+        while i < last and base[i] < elem:
             i += 1
         ind_in_grid.append(i)
         i += 1
+    return ind_in_grid
 
-    new_times = [base_times[i] for i in ind_in_grid]
 
+def regrid_time(base_times=None, new_res=None, indices=(None, None)):
+    """ Calculates evenly spaced times at which data means should be \
+    calculated when the resolution is given in units of time. Unlike \
+    regrid_base, no search for the times at which the craft crosses each \
+    level is needed, so this works for hovering and horizontal flights.
 
-    if new_res.dimensionality == units.Pa.dimensionality:
-        new_base = -1*new_base
+    :param np.Array<Datetime> base_times: times at which the position of the \
+       craft was recorded
+    :param Quantity new_res: the time between gridded points
+    :param tuple indices: start and end times. If not given, all of \
+       base_times is used.
+    :rtype: tuple(np.Array<Datetime>, np.Array<Quantity>)
+    :return: the gridded times and the time elapsed since the first of them
+    """
+    if indices[0] is None:
+        indices = (base_times[0], base_times[-1])
 
-    # Remove duplicates:
-    # new_times, indices = np.unique(new_times, return_index=True)
-    # new_base = new_base[indices]
-    return (new_times, new_base)
+    start, end = _as_datetime64([indices[0], indices[-1]])
+    step = np.timedelta64(int(round(new_res.to('microsecond').magnitude)),
+                          'us')
+    if step <= np.timedelta64(0, 'us'):
+        raise ValueError("The time resolution must be at least 1 microsecond")
+
+    new_times = np.arange(start, end, step)
+    new_base = np.arange(len(new_times)) * new_res
+
+    # datetime objects, like the times returned by regrid_base
+    return (list(new_times.astype(object)), new_base)
 
 
-def regrid_data(data=None, data_times=None, gridded_times=None, units=None):
+def regrid_data(data=None, data_times=None, gridded_times=None, units=None,
+                reducer='mean', trim=0.1):
     """ Returns data interpolated to an evenly spaced array based on
     gridded_times.
 
@@ -101,46 +166,417 @@ def regrid_data(data=None, data_times=None, gridded_times=None, units=None):
     :param np.Array<Datetime> data_times: Times coresponding to data
     :param pint.UnitRegistry units: The unit registry defined in Profile
     :param np.Array<Datetime> gridded_times: The times returned by regrid_base
+    :param str or function reducer: how the samples between two consecutive \
+       gridded_times are combined. One of 'mean' (default), 'median', \
+       'trimmed_mean', or 'interp' (linear interpolation at each gridded \
+       time), or a function with the signature of the kernels in REDUCERS.
+    :param float trim: fraction of the samples dropped from EACH end of a \
+       segment when reducer is 'trimmed_mean'
     :rtype: np.Array<Quantity>
-    :return: gridded_data
-    """
-
-    #
-    # Average around selected points
-    #
-    data_index = 0  # This tracks the most recent data element processed
-
-    gridded_data = []
-    for i in range(len(gridded_times)-1):
-        #
-        # Find the data indices in the specified time range
-        #
-        start_time = gridded_times[i]
-        end_time = gridded_times[i+1]
-        data_seg_start_ind = None
-        data_seg_end_ind = None
-
-        while data_index < len(data):
-            if data_times[data_index] >= start_time:
-                data_seg_start_ind = data_index
-                break
-            data_index += 1
+    :return: gridded_data, with the units of data. If data is a plain \
+       array, so is gridded_data.
+    """
+    if callable(reducer):
+        kernel = reducer
+    else:
+        try:
+            kernel = REDUCERS[reducer]
+        except KeyError:
+            raise ValueError("reducer must be one of " + str(list(REDUCERS))
+                             + " or a function, not " + str(reducer))
+
+    values, data_units = _strip(data)
+    times = _as_datetime64(data_times).astype(np.int64)
+    grid = _as_datetime64(gridded_times).astype(np.int64)
+
+    # Each segment holds the samples with
+    # gridded_times[i] <= data_times < gridded_times[i+1]. Only segments
+    # followed by at least one more sample are complete.
+    starts, ends = _segment_bounds(times, grid)
+
+    gridded_data = kernel(values, times, starts, ends, grid[:len(starts)],
+                          trim=trim)
+
+    return _attach(gridded_data, data_units)
+
+
+def regrid_sums(data=None, data_times=None, gridded_times=None):
+    """ Returns the sum and number of the non-NaN samples between consecutive \
+    gridded_times. sums / counts is what regrid_data returns with the \
+    default 'mean' reducer, but unlike means, sums and counts can be \
+    combined exactly to coarser resolutions with coarsen.
+
+    :param np.Array<Quantity> data: a non-base variable, or several with \
+       the same units and times as the columns of a 2D array, which are \
+       gridded together
+    :param np.Array<Datetime> data_times: Times coresponding to data
+    :param np.Array<Datetime> gridded_times: The times returned by regrid_base
+    :rtype: tuple(np.Array<Quantity>, np.Array<int>)
+    :return: (sums, counts), with one column per column of data. sums has \
+       the units of data, or is a plain array if data is.
+    """
+    values, data_units = _strip(data)
+    times = _as_datetime64(data_times).astype(np.int64)
+    grid = _as_datetime64(gridded_times).astype(np.int64)
+    starts, ends = _segment_bounds(times, grid)
+    sums, counts = _segment_sums(values, starts, ends)
+    return (_attach(sums, data_units), counts)
+
+
+def coarsen(sums, counts, factor):
+    """ Combines each group of factor consecutive gridded points into one. \
+    Only complete groups are kept.
+
+    :param np.Array<Quantity> sums: per-point sums from regrid_sums
+    :param np.Array<int> counts: per-point counts from regrid_sums
+    :param int factor: number of fine points in each coarse point
+    :rtype: tuple(np.Array<Quantity>, np.Array<int>)
+    :return: (sums, counts) at the coarser resolution
+    """
+    n = len(counts) // factor * factor
+    sums, sum_units = _strip(sums)
+    coarse_sums = sums[:n].reshape(-1, factor).sum(axis=1)
+    coarse_counts = np.asarray(counts)[:n].reshape(-1, factor).sum(axis=1)
+    return (_attach(coarse_sums, sum_units), coarse_counts)
+
+
+def regrid_channel(product, name, data, data_units, data_times, reducer):
+    """ Grids data to the gridded_times of a Thermo_Profile or Wind_Profile \
+    and stores it as the variable name. With the 'mean' reducer, the \
+    per-point sums and counts are kept so that coarsen_product can combine \
+    them.
+
+    :param product: the Thermo_Profile or Wind_Profile
+    :param str name: the variable the gridded data will be stored as
+    :param np.Array<float> data: the raw data's magnitudes
+    :param pint.Unit data_units: the raw data's units
+    :param np.Array<Datetime> data_times: times corresponding to data
+    :param str reducer: see regrid_data
+    """
+    if reducer == 'mean':
+        sums, counts = regrid_sums(data=data, data_times=data_times,
+                                   gridded_times=product.gridded_times)
+        product._sums[name] = sums
+        product._counts[name] = counts
+        product._data[name] = sums / counts
+    else:
+        product._data[name] = \
+            regrid_data(data=data, data_times=data_times,
+                        gridded_times=product.gridded_times,
+                        units=product._units, reducer=reducer)
+    product._data_units[name] = data_units
+
+
+def coarsen_product(product, factor, names, attributes):
+    """ Creates a Thermo_Profile or Wind_Profile with factor times the \
+    resolution of product by combining the per-point sums and counts of \
+    each group of factor points. The raw data is not used again.
+
+    The points of the result are every factor-th point of product, so its \
+    levels still start half of product's resolution above the bottom of \
+    the profile. Gridding the raw data directly at the coarser resolution \
+    starts half of the coarser resolution above it instead; pass \
+    product's first level as base_start to regrid_base to get the same \
+    levels.
+
+    :param product: the Thermo_Profile or Wind_Profile
+    :param int factor: number of points of product combined into each \
+       point of the result
+    :param list<str> names: the gridded variables to combine. A variable \
+       without sums, i.e. the base, keeps every factor-th value.
+    :param list<str> attributes: attributes copied to the result unchanged
+    :rtype: Thermo_Profile or Wind_Profile
+    :return: the coarser profile, of the same class as product
+    """
+    if not product._sums:
+        raise ValueError("Only a " + type(product).__name__ + " gridded "
+                         "with the 'mean' reducer can be coarsened")
+
+    result = type(product)()
+    for key in attributes:
+        setattr(result, key, getattr(product, key))
+    result.resolution = product.resolution * factor
+
+    new_len = len(product.gridded_times) // factor
+    result.gridded_times = product.gridded_times[::factor][:new_len]
+    for key in names:
+        if key in product._sums.keys():
+            sums, counts = coarsen(product._sums[key], product._counts[key],
+                                   factor)
+            result._sums[key] = sums
+            result._counts[key] = counts
+            result._data[key] = sums / counts
+        else:
+            # This is the base; keep every factor-th level
+            result._data[key] = product._data[key][::factor][:new_len]
+        result._data_units[key] = product._data_units[key]
+    return result
+
+
+def truncate_product(product, new_len):
+    """ Shortens the gridded variables, times, and per-point sums and \
+    counts of a Thermo_Profile or Wind_Profile to no more than new_len \
+    points.
+
+    :param product: the Thermo_Profile or Wind_Profile
+    :param int new_len: the new, shorter length
+    """
+    for key in product._data.keys():
+        product._data[key] = product._data[key][:new_len]
+    product.gridded_times = product.gridded_times[:new_len]
+    for key in product._sums.keys():
+        product._sums[key] = product._sums[key][:new_len]
+        product._counts[key] = product._counts[key][:new_len]
+
+
+def write_sums(dataset, product):
+    """ Writes the per-point sums and counts of a Thermo_Profile or \
+    Wind_Profile to an open NetCDF file as <name>_sum and <name>_count, so \
+    that the product can still be coarsened after it is read back.
+
+    :param netCDF4.Dataset dataset: the file, with a time dimension
+    :param product: the Thermo_Profile or Wind_Profile
+    """
+    for name in product._sums.keys():
+        sum_var = dataset.createVariable(name + "_sum", "f8", ("time",))
+        sum_var[:] = product._sums[name]
+        sum_var.units = str(product._data_units[name])
+        count_var = dataset.createVariable(name + "_count", "i8", ("time",))
+        count_var[:] = product._counts[name]
+
+
+def read_sums(dataset, product):
+    """ Reads the per-point sums and counts written by write_sums. The sums \
+    are in the units of the product's variables, which are read unchanged \
+    from the same file.
+
+    :param netCDF4.Dataset dataset: the file
+    :param product: the Thermo_Profile or Wind_Profile
+    """
+    for key in dataset.variables.keys():
+        if key.endswith("_sum"):
+            name = key[:-len("_sum")]
+            product._sums[name] = np.array(dataset.variables[key])
+            product._counts[name] = \
+                np.array(dataset.variables[name + "_count"])
+
+
+def _strip(data):
+    """ Separates data into a plain float array and its units.
+
+    :param np.Array<Quantity> data: a Quantity or plain array
+    :rtype: tuple(np.Array<float>, pint.Unit)
+    :return: the magnitudes and the units, which are None for plain arrays
+    """
+    if hasattr(data, "units"):
+        return np.asarray(data.magnitude, dtype=float), data.units
+    return np.asarray(data, dtype=float), None
+
+
+def _attach(values, units):
+    """ Reverses _strip.
+
+    :param np.Array<float> values: magnitudes
+    :param pint.Unit units: units, or None to leave values plain
+    :rtype: np.Array<Quantity>
+    :return: values with units attached
+    """
+    if units is None:
+        return values
+    return values * units
+
+
+def channel(name, doc=None, derive=None):
+    """ Creates a property for a gridded variable of a Thermo_Profile or \
+    Wind_Profile. The variable is kept as a plain array in the instance's \
+    _data dict with its unit in _data_units, so processing works on \
+    magnitudes, and the unit is only attached when the property is read. \
+    Assigning a Quantity stores its magnitude and unit; assigning None \
+    removes the variable. After either, the instance's _channel_changed \
+    method is called with name, if it has one.
+
+    :param str name: the variable's key in _data
+    :param str doc: the property's docstring
+    :param function derive: if given, the variable is calculated by \
+       derive(instance) the first time it is read and remembered until it \
+       is removed
+    :rtype: property
+    :return: the property
+    """
+    def get(self):
+        if name not in self._data and derive is not None:
+            self._data[name], self._data_units[name] = _strip(derive(self))
+        try:
+            return _attach(self._data[name], self._data_units[name])
+        except KeyError:
+            raise AttributeError(name)
+
+    def set(self, value):
+        if value is None:
+            self._data.pop(name, None)
+            self._data_units.pop(name, None)
+        else:
+            self._data[name], self._data_units[name] = _strip(value)
+        if hasattr(self, "_channel_changed"):
+            self._channel_changed(name)
+
+    return property(get, set, doc=doc)
+
+
+def trim_slice(times, indices):
+    """ Finds the samples strictly between the start and end of a profile \
+    as one contiguous range, so every channel sharing these times can be \
+    trimmed with a slice instead of a copy.
+
+    :param np.Array<Datetime> times: sorted sample times
+    :param tuple indices: the start and end times of the profile
+    :rtype: slice
+    :return: the range of samples in the profile
+    """
+    times = _as_datetime64(times)
+    bounds = _as_datetime64([indices[0], indices[-1]])
+    return slice(int(np.searchsorted(times, bounds[0], side='right')),
+                 int(np.searchsorted(times, bounds[1], side='left')))
+
+
+def _as_datetime64(times):
+    """ Converts a sequence of times to an array of datetime64[us]
+
+    :param list<Datetime> times: datetime, cftime, or datetime64 values
+    :rtype: np.Array<datetime64>
+    :return: the times with microsecond precision
+    """
+    times = np.asarray(times)
+    try:
+        return times.astype('datetime64[us]')
+    except (TypeError, ValueError):
+        # cftime objects (returned by netCDF4.num2date) can't be cast directly
+        return np.array([np.datetime64(t.isoformat()) for t in times],
+                        dtype='datetime64[us]')
+
+
+def _segment_bounds(times, grid):
+    """ Finds the samples that fall between consecutive gridded times.
+
+    :param np.Array<int> times: sorted sample times as integers
+    :param np.Array<int> grid: sorted gridded times as integers
+    :rtype: tuple(np.Array<int>, np.Array<int>)
+    :return: start (inclusive) and end (exclusive) sample index of each \
+       complete segment
+    """
+    steps = np.diff(grid)
+    if len(steps) > 0 and steps[0] > 0 and np.all(steps == steps[0]):
+        # Evenly spaced grid (time resolution): the segment of each sample
+        # follows directly from its time, so one counting pass is enough.
+        segment = np.clip(np.floor_divide(times - grid[0], steps[0]),
+                          -1, len(grid) - 1)
+        bounds = np.cumsum(np.bincount(segment + 1,
+                                       minlength=len(grid) + 1))[:len(grid)]
+    else:
+        bounds = np.searchsorted(times, grid, side='left')
+    n_complete = np.count_nonzero(bounds[1:] < len(times))
+    return bounds[:n_complete], bounds[1:n_complete + 1]
+
+
+def _sorted_segments(values, starts, ends):
+    """ Sorts the values within each segment, moving NaNs to the end.
+
+    :param np.Array<float> values: the samples
+    :param np.Array<int> starts: segment start indices
+    :param np.Array<int> ends: segment end indices; segments are adjacent, \
+       as returned by _segment_bounds
+    :rtype: tuple(np.Array<float>, np.Array<int>, np.Array<int>)
+    :return: the sorted values of all segments, concatenated, the number \
+       of non-NaN values in each segment, and the offset of each segment in \
+       the sorted values
+    """
+    if len(starts) == 0:
+        return np.array([]), np.array([], dtype=int), np.array([], dtype=int)
+    lengths = ends - starts
+    segment_id = np.repeat(np.arange(len(starts)), lengths)
+    picked = values[starts[0]:ends[-1]]
+    order = np.lexsort((picked, segment_id))  # NaN sorts last
+    valid = np.bincount(segment_id, weights=~np.isnan(picked),
+                        minlength=len(starts)).astype(int)
+    return picked[order], valid, starts - starts[0]
+
+
+def _reduce_mean(values, times, starts, ends, grid, **kwargs):
+    """ Mean of the non-NaN samples in each segment """
+    sums, counts = _segment_sums(values, starts, ends)
+    return sums / counts
+
+
+def _segment_sums(values, starts, ends):
+    """ Sum and number of the non-NaN samples in each segment, per column if \
+    values is 2D
+
+    :rtype: tuple(np.Array<float>, np.Array<int>)
+    """
+    good = ~np.isnan(values)
+    zeros = np.zeros((1,) + values.shape[1:])
+    cum_sum = np.concatenate((zeros, np.cumsum(np.where(good, values, 0.),
+                                               axis=0)))
+    cum_count = np.concatenate((zeros.astype(int), np.cumsum(good, axis=0)))
+    return cum_sum[ends] - cum_sum[starts], cum_count[ends] - cum_count[starts]
+
+
+def _reduce_median(values, times, starts, ends, grid, **kwargs):
+    """ Median of the non-NaN samples in each segment """
+    ordered, valid, offsets = _sorted_segments(values, starts, ends)
+    to_return = np.full(len(starts), np.nan)
+    has_data = valid > 0
+    low = (offsets + (valid - 1) // 2)[has_data]
+    high = (offsets + valid // 2)[has_data]
+    to_return[has_data] = 0.5 * (ordered[low] + ordered[high])
+    return to_return
+
+
+def _reduce_trimmed_mean(values, times, starts, ends, grid, trim=0.1,
+                         **kwargs):
+    """ Mean of the non-NaN samples in each segment after dropping the \
+    fraction trim of the samples from each end of the sorted segment """
+    if not 0 <= trim < 0.5:
+        raise ValueError("trim must be at least 0 and less than 0.5")
+    ordered, valid, offsets = _sorted_segments(values, starts, ends)
+    cut = np.floor(valid * trim).astype(int)
+    cum_sum = np.concatenate(([0.], np.cumsum(np.nan_to_num(ordered))))
+    first = offsets + cut
+    last = offsets + valid - cut
+    return (cum_sum[last] - cum_sum[first]) / (last - first)
+
+
+def _reduce_interp(values, times, starts, ends, grid, **kwargs):
+    """ Linear interpolation of the non-NaN samples to each gridded time """
+    good = ~np.isnan(values)
+    if not good.any():
+        return np.full(len(starts), np.nan)
+    return np.interp(grid.astype(float), times[good].astype(float),
+                     values[good])
 
-        while data_index < len(data):
-            if data_times[data_index] >= end_time:
-                data_seg_end_ind = data_index
-                break
-            data_index += 1
 
-        # Calculate and store the segment mean
-        if data_seg_start_ind is not None and data_seg_end_ind is not None:
-            gridded_data.append(np.nanmean(data.magnitude[data_seg_start_ind:
-                                           data_seg_end_ind]))
+# Kernels available to regrid_data. Each takes (values, times, starts, ends,
+# grid, **kwargs) as plain arrays and returns one value per segment.
+REDUCERS = {"mean": _reduce_mean,
+            "median": _reduce_median,
+            "trimmed_mean": _reduce_trimmed_mean,
+            "interp": _reduce_interp}
 
-    gridded_data = np.array(gridded_data) * data.units
 
-    return (gridded_data)
 
+def temp_calib_all(resistances, serial_numbers):
+    """ Converts the resistances of several temperature sensors to \
+    temperature at once, using each sensor's coefficients and equation.
+
+    :param np.Array<float> resistances: 2D array of resistances, one row \
+       per sensor
+    :param list<int> serial_numbers: the serial number of each row's sensor
+    :rtype: np.Array<float>
+    :return: temperatures in K, with the shape of resistances
+    """
+    return calibration.calibrate(resistances,
+                                 [coef_manager.get_calibrator("Imet", sn)
+                                  for sn in serial_numbers])
 
 
 def temp_calib(resistance, sn):
@@ -154,13 +590,7 @@ def temp_calib(resistance, sn):
     :rtype: list<Quantity>
     :return: list of temperatures in K
     """
-    coefs = coef_manager.get_coefs("Imet", sn)
-    a = float(coefs["A"])
-    b = float(coefs["B"])
-    c = float(coefs["C"])
-
-    return np.power(np.add(np.add(b * np.log(resistance), a),
-                    c * np.power(np.log(resistance), 3)), -1)
+    return temp_calib_all([resistance], [sn])[0]
 
 
 def rh_calib(raw, sn):
@@ -171,13 +601,94 @@ def rh_calib(raw, sn):
     :rtype: list<Quantity>
     :return: list of calibrated rh
     """
-    offset = coef_manager.get_coefs('RH', sn)['A']
-    try:
-        offset = float(coef_manager.get_coefs('RH', sn)['A']) / 1000
-    except Exception:
-        offset = 0
+    return coef_manager.get_calibrator('RH', sn)(raw)
 
-    return np.add(raw, offset)
+
+def coef_version(sensors):
+    """ Collects the coefficients used to calibrate sensors, so that \
+    product_key changes when they do.
+
+    :param list<tuple> sensors: the (type, serial number) of each sensor, \
+       where type is "Imet", "RH", or "Wind"
+    :rtype: dict
+    :return: the coefficients of each sensor, or None for sensors without \
+       coefficients
+    """
+    to_return = {}
+    for type, serial_number in sensors:
+        try:
+            to_return[type + str(serial_number)] = \
+                coef_manager.get_coefs(type, serial_number)
+        except Exception:
+            to_return[type + str(serial_number)] = None
+    return to_return
+
+
+def product_key(inputs, resolution, leg, bounds, coefs, options):
+    """ Identifies a gridded product by everything it is calculated from, \
+    so a cached product is only reused when none of it has changed.
+
+    :param inputs: the raw data, gridded times, and gridded base. Dicts, \
+       lists, arrays, and Quantities are hashed by value.
+    :param Quantity resolution: the resolution of the product
+    :param str leg: "Ascending" or "Descending"
+    :param tuple bounds: the (start, peak, end) times of the profile
+    :param dict coefs: the sensor coefficients, see coef_version
+    :param dict options: other settings the product depends on, e.g. the \
+       reducer
+    :rtype: str
+    :return: the key, which also includes the package version
+    """
+    sha = hashlib.sha256()
+    _hash_update(sha, [inputs, str(resolution), leg,
+                       [str(bound) for bound in bounds], coefs, options,
+                       __version__])
+    return sha.hexdigest()[:16]
+
+
+def product_cache_path(file_path, product, key):
+    """ Finds where a cached gridded product is stored.
+
+    :param str file_path: the path to the original data file WITHOUT the \
+       suffix .nc or .json
+    :param str product: "thermo" or "wind"
+    :param str key: the product's key, see product_key
+    :rtype: str
+    :return: <file_path>_<product>_<key>.nc
+    """
+    return file_path + "_" + product + "_" + key + ".nc"
+
+
+def _hash_update(sha, value):
+    """ Adds a value to a hash. Arrays are added by their bytes rather than \
+    their text, and dicts in key order.
+
+    :param hashlib.sha256 sha: the hash
+    :param value: a dict, list, tuple, array, Quantity, or other value with \
+       a repr that identifies it
+    """
+    if isinstance(value, dict):
+        for key in sorted(value.keys(), key=str):
+            sha.update(str(key).encode())
+            _hash_update(sha, value[key])
+        return
+    if hasattr(value, "units"):
+        sha.update(str(value.units).encode())
+        value = value.magnitude
+    if isinstance(value, (list, tuple)) and \
+            any(isinstance(item, (dict, list, tuple, np.ndarray))
+                or hasattr(item, "units") for item in value):
+        for item in value:
+            _hash_update(sha, item)
+        return
+    if isinstance(value, (list, tuple, np.ndarray)):
+        array = np.asarray(value)
+        if array.dtype == object:
+            array = _as_datetime64(array)
+        sha.update(str(array.dtype).encode())
+        sha.update(np.ascontiguousarray(array).tobytes())
+        return
+    sha.update(repr(value).encode())
 
 
 def qc(data, max_bias, max_variance):
@@ -185,6 +696,11 @@ def qc(data, max_bias, max_variance):
        to only include like sensors (not both temperature inside and outside
                                      the CO2 sensor) in Data.
 
+    As in earlier versions, only the first sensor is ever flagged: it is \
+    flagged when its statistic is farther than the limit from that of any \
+    other sensor, even if the other sensor is the one which failed. \
+    qc_windowed eliminates the sensor farthest from the ensemble instead.
+
     :param list<Quantity> data: a list containing one list for each sensor
        in the ensemble, i.e. all external RH sensors
     :param Quantity max_bias: the maximum absolute difference between the \
@@ -202,27 +718,41 @@ def qc(data, max_bias, max_variance):
 
     if isinstance(data, u.Quantity):
         data = data.magnitude
+    data = _stack_sensors(data)
 
-    good_nonempty = [1] * len(data)
-    for i in range(len(data)):
-        if np.nanmean(data[i]) == 0:
-            good_nonempty[i] = 4
-        else:
-            good_nonempty[i] = 0
+    # Flag sensors which only recorded zeros as empty
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        good_nonempty = np.where(np.nanmean(data, axis=1) == 0, 4, 0)
 
     # _bias: returns list of length number of sensors; 0 means data is good
     good_means = _bias(data, max_bias)
     # _s_dev: returns list of length number of sensors; 0 means data is good
     good_sdevs = _s_dev(data, max_variance)
 
-    combined_sensor_flags = [1] * len(data)
-
     # Combine good_means and good_sdevs, leaving 0 only where the sensor
     # passed both tests.
-    for i in range(len(data)):
-        combined_sensor_flags[i] = max([good_means[i], good_sdevs[i], good_nonempty[i]])
+    return [int(flag) for flag in
+            np.maximum.reduce([good_means, good_sdevs, good_nonempty])]
 
-    return combined_sensor_flags
+
+def _stack_sensors(data):
+    """ Stacks the data from an ensemble of sensors into one array, padding \
+    shorter records with NaN.
+
+    :param list<np.Array> data: a list containing one list for each sensor
+    :rtype: np.Array
+    :return: a 2D array of shape (number of sensors, number of samples)
+    """
+    if isinstance(data, np.ndarray) and data.ndim == 2:
+        return data.astype(float)
+    data = [np.asarray(getattr(sensor, "magnitude", sensor), dtype=float)
+            for sensor in data]
+    n = max([len(sensor) for sensor in data], default=0)
+    stacked = np.full((len(data), n), np.nan)
+    for i in range(len(data)):
+        stacked[i, :len(data[i])] = data[i]
+    return stacked
 
 
 def _bias(data, max_abs_error):
@@ -237,35 +767,11 @@ def _bias(data, max_abs_error):
     :return: list containing 0s by default and 2 in the position of each sensor
        flagged for bias.
     """
-
-    to_return = np.zeros(len(data))
     # Calculate the mean of each sensor
-    means = np.zeros(len(data))
-    for i in range(len(data)):
-        means[i] = np.nanmean(data[i])
-
-    while(True):
-        # Identify the sensor with the mean farthest from the mean of means
-        max_diff = 0
-        furthest_from_mean = 0  # index of sensor furthest from mean
-
-        for j in range(len(data)):
-
-            if(np.abs(np.nanmean(means)-means[j]) >
-               np.abs(np.nanmean(means)-means[furthest_from_mean])):
-                furthest_from_mean = j
-
-            for k in range(len(data)):
-                if(np.abs(means[j]-means[k]) > max_diff):
-                    max_diff = np.abs(means[j]-means[k])
-
-            # If the furthest sensor is farther than max_abs_error from the
-            # mean of means, eliminate it and perform analysis again.
-            if(max_diff > max_abs_error):
-                to_return[furthest_from_mean] = 2
-                means[furthest_from_mean] = np.NaN
-            else:
-                return to_return
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        means = np.nanmean(_stack_sensors(data), axis=1)
+    return _flag_spread(means, max_abs_error, 2)
 
 
 def _s_dev(data, max_abs_error):
@@ -281,38 +787,303 @@ def _s_dev(data, max_abs_error):
     :return: list containing 0s by default and 3 in the position of each sensor
        flagged for variability.
     """
-    to_return = np.zeros(len(data))
-    # Calculate the mean of each sensor
-    sdevs = np.zeros(len(data))
-    for i in range(len(data)):
-        sdevs[i] = np.nanstd(data[i])
+    # Calculate the standard deviation of each sensor
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        sdevs = np.nanstd(_stack_sensors(data), axis=1)
+    return _flag_spread(sdevs, max_abs_error, 3)
+
+
+def _flag_spread(stats, max_abs_error, flag):
+    """ Helper function for _bias and _s_dev which flags sensors when the \
+    spread of a statistic across the ensemble is too large.
+
+    :param np.Array<float> stats: one statistic per sensor
+    :param float max_abs_error: the largest allowed spread
+    :param int flag: the flag given to eliminated sensors
+    :rtype: np.Array
+    :return: 0 for each sensor kept and flag for each sensor eliminated
+    """
+    to_return = np.zeros(len(stats))
+    stats = np.asarray(stats, dtype=float)
+    if len(stats) == 0 or np.isnan(stats[0]):
+        return to_return
+
+    # Pairwise spreads between sensors
+    spreads = np.abs(stats[:, None] - stats[None, :])
+
+    # The elimination has always tested the first sensor's spread before
+    # comparing any other sensor with the ensemble mean, so the first sensor
+    # is the one eliminated. Once its statistic is removed no spread is
+    # tested again, so elimination stops there.
+    if np.nanmax(spreads[0]) > max_abs_error:
+        to_return[0] = flag
+    return to_return
 
-    while(True):
-        # Identify the sensor with the mean farthest from the mean of means
-        max_diff = 0
-        furthest_from_mean = 0  # index of sensor furthest from mean
 
-        for j in range(len(data)):
+def qc_windowed(data, data_times, max_bias, max_variance, window):
+    """ Determines which samples from a set of sensors are not reliable, \
+    by checking the bias and standard deviation of each sensor over a \
+    moving time window around each sample instead of the whole profile. A \
+    sensor which fails part of the way through a profile is then only \
+    removed where it fails. Be sure to only include like sensors recorded \
+    at the same times.
 
-            if(np.abs(np.nanmean(sdevs)-sdevs[j]) >
-               np.abs(np.nanmean(sdevs)-sdevs[furthest_from_mean])):
-                furthest_from_mean = j
+    Within each window, the sensor whose mean (or standard deviation) is \
+    farthest from that of the ensemble is eliminated while the spread of the \
+    remaining sensors exceeds max_bias (or max_variance). This is NOT the \
+    rule qc uses: qc only ever flags the first sensor, so when another \
+    sensor fails, qc removes the first sensor while qc_windowed removes the \
+    failing one. The rolling statistics come from cumulative sums, so the \
+    cost is one pass over the data.
 
-            for k in range(len(data)):
-                if(np.abs(sdevs[j]-sdevs[k]) > max_diff):
-                    max_diff = np.abs(sdevs[j]-sdevs[k])
+    :param list<Quantity> data: a list containing one list for each sensor
+       in the ensemble, i.e. all external RH sensors
+    :param np.Array<Datetime> data_times: times of the samples, shared by \
+       all sensors
+    :param Quantity max_bias: see qc
+    :param Quantity max_variance: see qc
+    :param int window: width of the window in seconds
+    :rtype: np.Array<int>
+    :return: array of shape (number of sensors, number of samples) \
+       containing 0 for each good sample, 2 for each sample flagged for \
+       bias, 3 for each sample flagged for response time, and 4 for each \
+       sample in a window where the sensor recorded only zeros
+    """
+    if isinstance(data, u.Quantity):
+        data = data.magnitude
+    data = _stack_sensors(data)
+    times = _as_datetime64(data_times).astype(np.int64)
+    half = int(window * 1e6) // 2
+    lo = np.searchsorted(times, times - half, side='left')
+    hi = np.searchsorted(times, times + half, side='right')
+
+    # Rolling sums over each window; each sensor is centred on its own mean
+    # to keep the sums of squares accurate
+    valid = ~np.isnan(data)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        offsets = np.nan_to_num(np.nanmean(data, axis=1))[:, None]
+    centred = np.where(valid, data - offsets, 0.)
+
+    def window_sums(values):
+        sums = np.zeros((len(data), data.shape[1] + 1))
+        np.cumsum(values, axis=1, out=sums[:, 1:])
+        return sums[:, hi] - sums[:, lo]
+
+    counts = window_sums(valid)
+    nonzero = window_sums(valid & (data != 0))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        means = window_sums(centred) / counts
+        sdevs = np.sqrt(np.maximum(window_sums(centred ** 2) / counts
+                                   - means ** 2, 0.))
+    means = means + offsets
+
+    empty = np.where((counts > 0) & (nonzero == 0), 4, 0)
+    return np.maximum.reduce([_eliminate_spread(means, max_bias, 2),
+                              _eliminate_spread(sdevs, max_variance, 3),
+                              empty])
+
+
+def _eliminate_spread(stats, max_abs_error, flag):
+    """ Helper function for qc_windowed which, separately for each sample, \
+    eliminates the sensor farthest from the ensemble mean while the spread \
+    of the remaining sensors exceeds max_abs_error.
+
+    :param np.Array<float> stats: statistics of shape (number of sensors, \
+       number of samples)
+    :param float max_abs_error: the largest allowed spread
+    :param int flag: the flag given to eliminated sensors
+    :rtype: np.Array<int>
+    :return: 0 for each sensor and sample kept and flag for each eliminated
+    """
+    stats = np.array(stats, dtype=float)
+    to_return = np.zeros(stats.shape, dtype=int)
+    samples = np.arange(stats.shape[1])
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        for _ in range(len(stats) - 1):
+            spread = np.nanmax(stats, axis=0) - np.nanmin(stats, axis=0)
+            active = spread > max_abs_error
+            if not active.any():
+                break
+            dist = np.abs(stats - np.nanmean(stats, axis=0))
+            furthest = np.where(np.isnan(dist), -np.inf, dist).argmax(axis=0)
+            to_return[furthest[active], samples[active]] = flag
+            stats[furthest[active], samples[active]] = np.nan
+    return to_return
+
+
+# Despiking settings for each type of raw thermodynamic channel: rolling
+# window length in samples, threshold in scaled MADs, and the smallest
+# deviation (in the channel's units) which can count as a spike
+DESPIKE_DEFAULTS = {"temp": {"window": 11, "threshold": 5., "min_spike": 0.5},
+                    "resi": {"window": 11, "threshold": 5., "min_spike": 50.},
+                    "rh": {"window": 11, "threshold": 5., "min_spike": 2.}}
+
+
+def despike(data, window=11, threshold=5., min_spike=0.):
+    """ Finds single-sample spikes and dropouts in an ensemble of sensors \
+    with a rolling median and median absolute deviation (MAD), computed for \
+    all sensors at once over strided windows.
+
+    :param list<np.Array> data: a list containing one list for each sensor
+    :param int window: number of samples in the centred rolling window; \
+       even values are rounded up
+    :param float threshold: samples farther than threshold scaled MADs \
+       from the rolling median are spikes
+    :param float min_spike: samples closer than this to the rolling median \
+       are never spikes, which keeps flat windows (MAD of 0) from flagging \
+       every small step
+    :rtype: np.Array<bool>
+    :return: array of shape (number of sensors, number of samples) which is \
+       True for each spike
+    """
+    data = _stack_sensors(data)
+    half = int(window) // 2
+    padded = np.pad(data, ((0, 0), (half, half)), mode="constant",
+                    constant_values=np.nan)
+    windows = np.lib.stride_tricks.as_strided(
+        padded, shape=data.shape + (2 * half + 1,),
+        strides=padded.strides + (padded.strides[1],), writeable=False)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        median = np.nanmedian(windows, axis=2)
+        mad = np.nanmedian(np.abs(windows - median[..., None]), axis=2)
+    deviation = np.abs(data - median)
+    # 1.4826 scales the MAD to a standard deviation for normal data
+    return deviation > np.maximum(threshold * 1.4826 * mad, min_spike)
+
+
+def despike_channels(data_dict, config=None):
+    """ Despikes the raw sensor channels of a dictionary from \
+    Raw_Profile.thermo_data. Channels of the same type (temp1, temp2, ... or \
+    rh1, rh2, ...) are processed together, and spikes are replaced by NaN.
+
+    :param dict data_dict: the raw data, which is not modified
+    :param dict config: settings for each channel type in the format of \
+       DESPIKE_DEFAULTS; types which are left out use the defaults, and \
+       types set to None are not despiked
+    :rtype: tuple(dict, dict)
+    :return: a copy of data_dict with spikes removed, and the number of \
+       samples masked in each channel
+    """
+    settings = dict(DESPIKE_DEFAULTS)
+    if config is not None:
+        settings.update(config)
+
+    to_return = dict(data_dict)
+    masked = {}
+    for prefix in settings.keys():
+        if settings[prefix] is None:
+            continue
+        keys = sorted([key for key in data_dict.keys()
+                       if key.startswith(prefix)
+                       and key[len(prefix):].isdigit()],
+                      key=lambda key: int(key[len(prefix):]))
+        if len(keys) == 0:
+            continue
+        spikes = despike([data_dict[key].magnitude for key in keys],
+                         **settings[prefix])
+        for i, key in enumerate(keys):
+            values = np.array(data_dict[key].magnitude, dtype=float)
+            values[spikes[i, :len(values)]] = np.nan
+            to_return[key] = values * data_dict[key].units
+            masked[key] = int(np.count_nonzero(spikes[i]))
+    return to_return, masked
+
+
+def detect_start_height(alts, alt_times, window=300, smooth=5.,
+                        max_rate=0.5, min_duration=5., min_climb=20.,
+                        min_margin=5.):
+    """ Estimates the profile starting height from the beginning of the \
+    flight, where the craft sits on the ground and usually hovers before \
+    the first profile. The starting height is placed a margin above the \
+    highest of these plateaus.
+
+    Plateaus are found in the altitude smoothed with a rolling median, as \
+    stretches of at least min_duration seconds where the smoothed altitude \
+    changes by less than max_rate per second, so a noisy hover stays one \
+    plateau. Only plateaus before the first sustained climb, where the \
+    craft rises more than min_climb above the highest plateau so far, are \
+    used. The confidence is the fraction of the time before that climb \
+    spent on plateaus, so it does not depend on how long the ground and \
+    hover segments are.
 
-            # If the furthest sensor is farther than max_abs_error from the
-            # mean of means, eliminate it and perform analysis again.
-            if(max_diff > max_abs_error):
-                to_return[furthest_from_mean] = 3
-                sdevs[furthest_from_mean] = np.NaN
-            else:
-                return to_return
+    :param np.Array<Quantity> alts: recorded altitudes; units don't matter
+    :param np.Array<Datetime> alt_times: times coresponding to alts
+    :param int window: seconds from the start of the file to examine
+    :param float smooth: width in seconds of the rolling median
+    :param float max_rate: the fastest change of the smoothed altitude on a \
+       plateau, in the units of alts per second
+    :param float min_duration: the shortest plateau in seconds
+    :param float min_climb: the rise above the highest plateau, in the \
+       units of alts, which starts the first profile
+    :param float min_margin: the minimum distance above the plateau in the \
+       units of alts
+    :rtype: tuple(float, float)
+    :return: the starting height in the units of alts (None if it can't be \
+       estimated) and a confidence between 0 and 1
+    """
+    alts = np.asarray(getattr(alts, "magnitude", alts), dtype=float)
+    times = _as_datetime64(alt_times).astype(np.int64)
+    in_window = (times <= times[0] + int(window * 1e6)) & np.isfinite(alts)
+    early = alts[in_window]
+    seconds = (times[in_window] - times[0]) / 1e6
+    if len(early) < 10:
+        return None, 0.
+
+    # Rolling median, and the rate of change across each median's window
+    step = np.median(np.diff(seconds))
+    half = max(1, int(round(0.5 * smooth / step))) if step > 0 else 1
+    padded = np.pad(early, half, mode="edge")
+    smoothed = np.median(np.lib.stride_tricks.as_strided(
+        padded, shape=(len(early), 2 * half + 1),
+        strides=padded.strides * 2, writeable=False), axis=1)
+    later = np.minimum(np.arange(len(early)) + half, len(early) - 1)
+    earlier = np.maximum(np.arange(len(early)) - half, 0)
+    rate = (smoothed[later] - smoothed[earlier]) \
+        / np.maximum(seconds[later] - seconds[earlier], 1e-6)
+
+    # Runs of steady samples long enough to be plateaus
+    steady = np.concatenate(([False], np.abs(rate) < max_rate, [False]))
+    edges = np.flatnonzero(np.diff(steady.astype(int)))
+    runs = [(start, end) for start, end in zip(edges[::2], edges[1::2])
+            if seconds[end - 1] - seconds[start] >= min_duration]
+
+    # Keep the plateaus until the craft climbs well above all of them
+    plateaus = []
+    climb = len(early)
+    prev_end = 0
+    for start, end in runs + [(len(early), len(early))]:
+        if len(plateaus) > 0 and start > prev_end and \
+                smoothed[prev_end:start].max() > \
+                max([level for level, _, _ in plateaus]) + min_climb:
+            climb = prev_end
+            break
+        if end > start:
+            plateaus.append((np.median(early[start:end]), start, end))
+            prev_end = end
+    if len(plateaus) == 0:
+        return None, 0.
+
+    # Spread of the samples on the highest plateau
+    level, start, end = max(plateaus)
+    height = level + max(min_margin, 5 * np.std(early[start:end]))
+
+    # Confident when the craft spends most of the time before the first
+    # climb on plateaus, and the height separates at least one profile
+    confidence = sum([end - start for _, start, end in plateaus]) / climb
+    if np.nanmax(alts) <= height or len(_find_profiles(alts, height)) == 0:
+        confidence = 0.
+    return float(height), float(confidence)
 
 
 def identify_profile(alts, alt_times, confirm_bounds=True,
-                     profile_start_height=None, to_return=[], ind=0):
+                     profile_start_height=None, min_confidence=0.5,
+                     headless=False, review_path=None):
     """ Identifies the temporal bounds of all profiles in the data file. These
     assumptions must be valid:
     * The craft starts and ends each profile below profile_start_height
@@ -330,142 +1101,304 @@ def identify_profile(alts, alt_times, confirm_bounds=True,
        prompted to enter a start height for each profile. This is recommended \
        when processing many profiles from the same mission. At least one \
        profile should be processed without this option to determine the correct\
-       value.
-    :param int ind: used privately for recurrsion - leave this alone
-    :param list to_return: used privately for recurrsion - leave this alone
+       value. If None, it is detected automatically (see \
+       detect_start_height) and the user is only prompted when the \
+       detection is uncertain.
+    :param float min_confidence: the lowest confidence at which an \
+       automatically detected start height is used without prompting
+    :param bool headless: if True, no figures are shown and the user is \
+       never prompted. Bounds are confirmed through the file at review_path \
+       instead (see write_bounds_review and read_bounds_review).
+    :param str review_path: the bounds-review JSON file used when headless \
+       and confirm_bounds are both True
     :rtype: list<tuple>
     :return: a list of times defining the profiles in the format \
        (time_start, time_max_height, time_end)
     """
+    alt_units = getattr(alts, "units", None)
+    alts = np.asarray(getattr(alts, "magnitude", alts), dtype=float)
+    if hasattr(profile_start_height, "magnitude"):
+        if alt_units is not None:
+            profile_start_height = profile_start_height.to(alt_units)
+        profile_start_height = profile_start_height.magnitude
 
-    isDone = False
-    # Get the starting height from the user
     if profile_start_height is None:
-        fig1 = plt.figure()
-        plt.plot(alt_times, alts, figure=fig1)
-        plt.grid(axis="y", which="both", figure=fig1)
+        profile_start_height, confidence = detect_start_height(alts,
+                                                               alt_times)
+        if confidence >= min_confidence:
+            print("Using detected profile start height",
+                  round(profile_start_height, 1), "(confidence",
+                  str(round(confidence, 2)) + ")")
+        elif headless:
+            print("Could not detect the profile start height (confidence",
+                  str(round(confidence, 2)) + "). Provide "
+                  "profile_start_height to process this file headless.")
+            return []
+        else:
+            profile_start_height = None
+
+    if headless:
+        bounds = _find_profiles(alts, profile_start_height)
+        if not confirm_bounds:
+            return _bounds_to_times(bounds, alt_times)
+        if review_path is None:
+            raise ValueError("review_path is required to confirm bounds "
+                             "headless")
+        if os.path.exists(review_path):
+            return read_bounds_review(review_path, alt_times)
+        write_bounds_review(review_path, alts, alt_times, bounds,
+                            profile_start_height)
+        print("Profile bounds written to", review_path, "for review. Set "
+              "\"approved\" to true for each correct profile and process "
+              "the file again.")
+        return []
 
-        myFmt = mdates.DateFormatter('%M')
-        fig1.gca().xaxis.set_major_formatter(myFmt)
+    while True:
+        # Get the starting height from the user
+        if profile_start_height is None:
+            profile_start_height = _ask_start_height(alts, alt_times)
 
-        plt.show(block=False)
+        bounds = _find_profiles(alts, profile_start_height)
 
-        try:
-            profile_start_height = int(input('Wrong file? Enter "q" to quit. '
-                                             + '\nProfile start height: ')) * \
-                                             alts.units
-        except ValueError:
-            sys.exit(0)
-        plt.close()
+        rejected = False
+        if confirm_bounds:
+            for start_ind_asc, peak_ind, end_ind_des in bounds:
+                if not _confirm_profile(alts, start_ind_asc, peak_ind,
+                                        end_ind_des):
+                    rejected = True
+                    break
 
-    # If no profiles exist after ind, return an empty index list.
-    if max(alts[ind:]) < profile_start_height:
-        return []
+        if not rejected:
+            return _bounds_to_times(bounds, alt_times)
+        # Start over with a new starting height
+        profile_start_height = None
 
-    # Declare variables used in loop
-    start_ind_asc = None
-    end_ind_des = None
-    peak_ind = None
-
-    # Check through valid alts for start_ind_asc, peak_ind, end_ind_des in
-    # that order
-    while ind < len(alts) - 10:
-            if(start_ind_asc is None):  # should be ascending
-                # finds at what time the altitude range is reached going up
-
-                # Error if starts on a descent
-                if(alts[ind] > profile_start_height and
-                   alts[ind + 10] < alts[ind]):
-                    print("Error separating profiles: start height is first \
-                          reached on a descent")
-                    break
 
-                # Set start_ind_asc when the craft is first above
-                # profile_start_height
-                if alts[ind] > profile_start_height:
-                    start_ind_asc = ind
-
-                ind += 1
-
-            elif(end_ind_des is None):  # should be descending
-
-                # Set end_ind_des when the craft is again below
-                # profile_start_height for the first time since start_ind_asc
-                if alts[ind] < profile_start_height:
-                    end_ind_des = ind
-
-                    # Now that the bounds of the profile have been found, we
-                    # find the index of the maximum altitude.
-                    peak_ind = list(alts).index(np.nanmax(alts[start_ind_asc:end_ind_des]),
-                                                start_ind_asc, end_ind_des)
-
-                ind += 1
-
-            # The current profile has been processed; we just need to check
-            # if there are more profiles in the file
-            else:
-                if confirm_bounds:
-                    # User verifies selection
-                    fig2 = plt.figure()
-                    plt.plot(range(len(alt_times)), alts, figure=fig2)
-                    plt.grid(axis="y", which="both", figure=fig2)
-                    plt.vlines([start_ind_asc, peak_ind, end_ind_des],
-                               min(alts).magnitude - 50, max(alts.magnitude) + 50)
-
-                    plt.show(block=False)
-
-                    # Get user opinion
-                    valid = input('Correct? (Y/n): ')
-                    # If good, wrap up the profile
-                    if valid in "yYyesYes" or valid is "":
-                        plt.close()
-                        if end_ind_des is None:
-                            print("Could not find end time des (LineTag B)")
-                            return
-                        isDone = True
-                        break
-                    elif valid in "nNnoNo":
-                        plt.close()
-                        to_return = identify_profile(alts, alt_times,
-                                                     to_return)
-                    else:
-                        print("Invalid choice. Re-selecting profile...")
-                        plt.close()
-                        to_return = identify_profile(alts, alt_times,
-                                                     to_return)
-                else:
-                    isDone = True
-                    break
+def review_path_for(file_path):
+    """ Returns the bounds-review file used for a data file when processing \
+    headless.
+
+    :param str file_path: the data file
+    :rtype: str
+    :return: the path of the JSON review file
+    """
+    return os.path.splitext(file_path)[0] + "_bounds.json"
 
-                ind += 1
 
-    if(isDone):
-        # Add the profile if it is not already in to_return
+def write_bounds_review(review_path, alts, alt_times, bounds,
+                        profile_start_height, png=True):
+    """ Writes the automatically identified bounds of each profile to a \
+    JSON file for review, and optionally a plot of them next to it. The plot \
+    is rendered without a GUI backend. To approve a profile, set its \
+    "approved" field to true.
+
+    :param str review_path: the JSON file to write
+    :param np.Array<float> alts: recorded altitudes
+    :param np.Array<Datetime> alt_times: times coresponding to alts
+    :param list<tuple> bounds: (start, peak, end) indices of each profile
+    :param float profile_start_height: the height used to find the bounds
+    :param bool png: True to also write review_path with the suffix .png
+    """
+    review = {"profile_start_height": float(profile_start_height),
+              "profiles": [{"start": str(_as_datetime64([alt_times[i]])[0]),
+                            "peak": str(_as_datetime64([alt_times[j]])[0]),
+                            "end": str(_as_datetime64([alt_times[k]])[0]),
+                            "approved": None}
+                           for i, j, k in bounds]}
+    with open(review_path, "w") as review_file:
+        json.dump(review, review_file, indent=2)
+
+    if png:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        fig = Figure(figsize=(12, 5))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
+        ax.plot(range(len(alts)), alts)
+        ax.grid(axis="y", which="both")
+        ax.axhline(profile_start_height, color="gray", linestyle="--")
+        for profile_n, (i, j, k) in enumerate(bounds):
+            ax.vlines([i, j, k], np.nanmin(alts) - 50, np.nanmax(alts) + 50,
+                      colors="k")
+            ax.text(j, np.nanmax(alts) + 50, str(profile_n + 1),
+                    ha="center", va="bottom")
+        fig.savefig(os.path.splitext(review_path)[0] + ".png")
+
+
+def read_bounds_review(review_path, alt_times):
+    """ Reads the approved profiles from a file written by \
+    write_bounds_review.
+
+    :param str review_path: the reviewed JSON file
+    :param np.Array<Datetime> alt_times: times coresponding to the \
+       altitudes the bounds were found in
+    :rtype: list<tuple>
+    :return: a list of times defining the approved profiles in the format \
+       (time_start, time_max_height, time_end)
+    """
+    with open(review_path, "r") as review_file:
+        review = json.load(review_file)
+
+    times = _as_datetime64(alt_times)
+    to_return = []
+    for profile in review["profiles"]:
+        if profile.get("approved") is not True:
+            continue
+        inds = np.searchsorted(times,
+                               np.array([profile["start"], profile["peak"],
+                                         profile["end"]],
+                                        dtype="datetime64[us]"))
+        to_return.append(tuple(alt_times[min(i, len(alt_times) - 1)]
+                               for i in inds))
+    print(len(to_return), "approved profile(s) read from", review_path)
+    return to_return
+
+
+def _bounds_to_times(bounds, alt_times):
+    """ Helper function for identify_profile which converts profile indices \
+    to times, dropping similar or overlapping profiles.
+
+    :param list<tuple> bounds: (start, peak, end) indices of each profile
+    :param np.Array<Datetime> alt_times: times coresponding to the altitudes
+    :rtype: list<tuple>
+    :return: (time_start, time_max_height, time_end) of each profile
+    """
+    to_return = []
+    for start_ind_asc, peak_ind, end_ind_des in bounds:
         pending_profile = (alt_times[start_ind_asc],
                            alt_times[peak_ind],
                            alt_times[end_ind_des])
         if not _profile_in(pending_profile, to_return):
-            to_return.append((alt_times[start_ind_asc],
-                              alt_times[peak_ind],
-                              alt_times[end_ind_des]))
+            to_return.append(pending_profile)
 
             print("Profile from ", alt_times[start_ind_asc],
                   "to", alt_times[end_ind_des], "added")
-        # Check if more profiles in file
-        if ind + 100 < len(alts) \
-           and max(alts[ind + 100::]) > profile_start_height:
-            # There is another profile before the end of the
-            # file - find it.
-            a = profile_start_height
-            to_return =\
-                identify_profile(alts, alt_times,
-                                 confirm_bounds=confirm_bounds,
-                                 profile_start_height=a,
-                                 to_return=to_return,
-                                 ind=ind+100)
     return to_return
 
 
+def _find_profiles(alts, profile_start_height):
+    """ Helper function for identify_profile which finds the start, peak, \
+    and end indices of every profile in one pass over the crossings of \
+    profile_start_height.
+
+    :param np.Array<float> alts: recorded altitudes
+    :param float profile_start_height: the height which starts and ends \
+       each profile, in the units of alts
+    :rtype: list<tuple>
+    :return: (start, peak, end) indices of each profile
+    """
+    n = len(alts)
+    up = np.flatnonzero(alts > profile_start_height)
+    down = np.flatnonzero(alts < profile_start_height)
+
+    starts = []
+    ends = []
+    ind = 0
+    while True:
+        # The craft is first above profile_start_height
+        k = np.searchsorted(up, ind)
+        if k == len(up) or up[k] >= n - 10:
+            break
+        start_ind_asc = up[k]
+
+        # Error if starts on a descent
+        if alts[start_ind_asc + 10] < alts[start_ind_asc]:
+            print("Error separating profiles: start height is first \
+                  reached on a descent")
+            break
+
+        # The craft is again below profile_start_height for the first time
+        # since start_ind_asc
+        k = np.searchsorted(down, start_ind_asc + 1)
+        if k == len(down) or down[k] >= n - 11:
+            break
+        end_ind_des = down[k]
+
+        starts.append(start_ind_asc)
+        ends.append(end_ind_des)
+        # Look for the next profile a little after this one ends
+        ind = end_ind_des + 101
+
+    if len(starts) == 0:
+        return []
+
+    # Maximum altitude of each profile, then the first index at which it
+    # is reached
+    edges = np.column_stack((starts, ends)).ravel()
+    peaks = np.fmax.reduceat(alts, edges)[::2]
+    return [(start_ind_asc,
+             start_ind_asc
+             + int(np.argmax(alts[start_ind_asc:end_ind_des] == peak)),
+             end_ind_des)
+            for start_ind_asc, end_ind_des, peak in zip(starts, ends, peaks)]
+
+
+def _ask_start_height(alts, alt_times):
+    """ Helper function for identify_profile which plots the altitudes and \
+    asks the user for the profile starting height.
+
+    :param np.Array<float> alts: recorded altitudes
+    :param np.Array<Datetime> alt_times: times coresponding to alts
+    :rtype: float
+    :return: the profile starting height in the units of alts
+    """
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as mdates
+    from pandas.plotting import register_matplotlib_converters
+
+    register_matplotlib_converters()
+    fig1 = plt.figure()
+    plt.plot(alt_times, alts, figure=fig1)
+    plt.grid(axis="y", which="both", figure=fig1)
+
+    myFmt = mdates.DateFormatter('%M')
+    fig1.gca().xaxis.set_major_formatter(myFmt)
+
+    plt.show(block=False)
+
+    try:
+        profile_start_height = int(input('Wrong file? Enter "q" to quit. '
+                                         + '\nProfile start height: '))
+    except ValueError:
+        sys.exit(0)
+    plt.close()
+    return profile_start_height
+
+
+def _confirm_profile(alts, start_ind_asc, peak_ind, end_ind_des):
+    """ Helper function for identify_profile which asks the user to verify \
+    the bounds of a profile.
+
+    :param np.Array<float> alts: recorded altitudes
+    :param int start_ind_asc: index at which the profile starts
+    :param int peak_ind: index of the maximum altitude
+    :param int end_ind_des: index at which the profile ends
+    :rtype: bool
+    :return: True if the user accepts the bounds
+    """
+    import matplotlib.pyplot as plt
+
+    while True:
+        fig2 = plt.figure()
+        plt.plot(range(len(alts)), alts, figure=fig2)
+        plt.grid(axis="y", which="both", figure=fig2)
+        plt.vlines([start_ind_asc, peak_ind, end_ind_des],
+                   np.nanmin(alts) - 50, np.nanmax(alts) + 50)
+
+        plt.show(block=False)
+
+        # Get user opinion
+        valid = input('Correct? (Y/n): ')
+        plt.close()
+        if valid in "yYyesYes" or valid == "":
+            return True
+        elif valid in "nNnoNo":
+            return False
+        else:
+            print("Invalid choice. Please enter y or n.")
+
+
 def _profile_in(indices, all_indices):
     """ Helper function for identify_profile to ensure similar or overlapping
     profiles not included
@@ -0,0 +1,91 @@
+"""
+Test configuration. Coefficients are read from the coefs folder of this
+repository rather than Azure, so the tests need no connection string.
+"""
+import os
+import sys
+import importlib.util
+
+package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, package_root)
+
+# profiles.utils creates its Coef_Manager on import, so conf.py is loaded and
+# adjusted before anything imports profiles
+_spec = importlib.util.spec_from_file_location(
+    "profiles.conf", os.path.join(package_root, "profiles", "conf.py"))
+conf = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(conf)
+sys.modules["profiles.conf"] = conf
+conf.coef_info.USE_AZURE = "NO"
+conf.coef_info.FILE_PATH = os.path.join(package_root, "coefs")
+
+import datetime as dt  # noqa: E402
+import numpy as np  # noqa: E402
+import pytest  # noqa: E402
+
+
+def stub_raw_profile(file_path, duration=300., climb=100.):
+    """ A Raw_Profile holding a synthetic flight instead of data read from \
+    a file: 10 s on the ground, a climb at 1 m/s to climb metres, a descent \
+    at the same rate, and the rest on the ground. Every sensor is sampled \
+    at 10 Hz at the same times.
+
+    :param str file_path: the .json file the data claims to come from
+    :param float duration: length of the flight in seconds
+    :param float climb: height of the profile in metres
+    :rtype: Raw_Profile
+    :return: the Raw_Profile, with bounds as the times of samples 100, \
+       100 + 10*climb, and 100 + 20*climb
+    """
+    from metpy.units import units
+    from profiles.Raw_Profile import Raw_Profile
+
+    rng = np.random.default_rng(0)
+    n = int(duration * 10)
+    seconds = np.arange(n) / 10.
+    time = [dt.datetime(2020, 1, 1, 12) + dt.timedelta(seconds=s)
+            for s in seconds]
+    height = np.clip(np.minimum(seconds - 10., 10. + 2. * climb - seconds),
+                     0., climb)
+    alt = 350. + height
+    pres = 97000. * np.exp(-height / 8000.)
+    # Warmer near the ground, and three sensors that agree
+    temp = 295. - 0.0065 * height
+    resistance = 10000. * np.exp(0.045 * (298.15 - temp))
+    rh = 50. + 0.1 * height
+
+    raw = Raw_Profile.__new__(Raw_Profile)
+    raw.meta = None
+    raw.dev = False
+    raw.baro = "BARO"
+    raw.file_path = file_path
+    raw.serial_numbers = {"imet1": 0, "imet2": 0, "imet3": 0, "rh1": 0,
+                          "rh2": 0, "rh3": 0, "wind": 0, "copterID": 1}
+    temp_list = []
+    for _ in range(3):
+        noise = rng.normal(0., 0.01, n)
+        temp_list += [(temp + noise) * units.K,
+                      resistance * (1. - 0.045 * noise) * units.ohm]
+    raw.temp = tuple(temp_list + [time])
+    rh_list = []
+    for _ in range(3):
+        rh_list += [(rh + rng.normal(0., 0.1, n)) * units.percent,
+                    temp * units.kelvin]
+    raw.rh = tuple(rh_list + [time])
+    raw.pos = (np.full(n, 35.) * units.deg, np.full(n, -97.) * units.deg,
+               alt * units.m, height * units.m, height * units.m, time)
+    raw.pres = (pres * units.Pa, np.full(n, 70.) * units.fahrenheit,
+                np.full(n, 70.) * units.fahrenheit, alt * units.m, time)
+    # A steady tilt towards the north-east
+    zeros = np.zeros(n)
+    raw.rotation = (zeros * units.m / units.s, zeros * units.m / units.s,
+                    zeros * units.m / units.s,
+                    np.full(n, 3.) * units.deg, np.full(n, -3.) * units.deg,
+                    zeros * units.deg, time)
+    return raw
+
+
+@pytest.fixture
+def raw_profile(tmp_path):
+    """ See stub_raw_profile """
+    return stub_raw_profile(str(tmp_path / "flight.json"))
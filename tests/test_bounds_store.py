@@ -0,0 +1,39 @@
+"""
+Tests for profiles.Bounds_Store
+"""
+import os
+import datetime as dt
+
+from profiles.Bounds_Store import Bounds_Store
+
+
+def _data_file(tmp_path):
+    data_file = tmp_path / "flight.json"
+    data_file.write_text("{}\n")
+    return str(data_file)
+
+
+def test_database_is_created_on_first_use(tmp_path):
+    db_path = tmp_path / "store" / "bounds.sqlite"
+    store = Bounds_Store(str(db_path))
+    assert not os.path.exists(str(db_path.parent))
+
+    times = [dt.datetime(2020, 1, 1, 0, 0, i) for i in range(10)]
+    store.put(_data_file(tmp_path), None, [(times[1], times[4], times[8])],
+              True)
+    assert os.path.exists(str(db_path))
+    assert store.get(_data_file(tmp_path), None, times) == \
+        [(times[1], times[4], times[8])]
+
+
+def test_unusable_database_disables_the_store(tmp_path):
+    # The database's folder can't be created under a regular file
+    blocker = tmp_path / "blocker"
+    blocker.write_text("")
+    store = Bounds_Store(str(blocker / "bounds.sqlite"))
+
+    times = [dt.datetime(2020, 1, 1, 0, 0, i) for i in range(10)]
+    assert store.get(_data_file(tmp_path), None, times) is None
+    store.put(_data_file(tmp_path), None, [(times[1], times[4], times[8])],
+              True)
+    assert store.get(_data_file(tmp_path), None, times) is None
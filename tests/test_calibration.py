@@ -0,0 +1,99 @@
+"""
+Tests for profiles.calibration
+"""
+import numpy as np
+import pytest
+
+import profiles.utils as utils
+from profiles.calibration import EQUATIONS, Calibrator, calibrate
+
+
+def _old_temp_calib(resistance, coefs):
+    """ The inline Steinhart-Hart formula of utils.temp_calib """
+    a = float(coefs["A"])
+    b = float(coefs["B"])
+    c = float(coefs["C"])
+    return np.power(np.add(np.add(b * np.log(resistance), a),
+                    c * np.power(np.log(resistance), 3)), -1)
+
+
+def _old_rh_calib(raw, coefs):
+    """ The inline offset of utils.rh_calib """
+    try:
+        offset = float(coefs['A']) / 1000
+    except Exception:
+        offset = 0
+    return np.add(raw, offset)
+
+
+def _old_wind_speed(tilt, coefs):
+    """ The inline linear formula of Wind_Profile._calc_winds """
+    return float(coefs['A']) * tilt + float(coefs['B'])
+
+
+def _raw(n_sensors, low, high, n=50):
+    rng = np.random.default_rng(47)
+    return rng.uniform(low, high, (n_sensors, n))
+
+
+def test_equations():
+    assert set(EQUATIONS) >= {"E1", "E2", "offset"}
+    for kernel, names in EQUATIONS.values():
+        assert callable(kernel)
+        assert all(isinstance(name, str) for name in names)
+
+
+@pytest.mark.parametrize("sn", [57549, 57551, 45363])
+def test_steinhart_hart_matches_the_inline_formula(sn):
+    coefs = utils.coef_manager.get_coefs("Imet", sn)
+    resistance = _raw(1, 5000., 40000.)[0]
+
+    calibrator = Calibrator.from_coefs("Imet", coefs)
+    assert calibrator.equation == "E2"
+    np.testing.assert_allclose(calibrator(resistance),
+                               _old_temp_calib(resistance, coefs))
+
+
+def test_linear_matches_the_inline_formula():
+    coefs = utils.coef_manager.get_coefs("Wind", 944)
+    tilt = _raw(1, 0., 1.)[0]
+
+    calibrator = Calibrator.from_coefs("Wind", coefs)
+    assert calibrator.equation == "E1"
+    np.testing.assert_allclose(calibrator(tilt), _old_wind_speed(tilt, coefs))
+
+
+@pytest.mark.parametrize("coefs", [{"A": "2827", "Equation": "na"},
+                                   {"A": "na", "Equation": "na"},
+                                   {"Equation": "na"}])
+def test_offset_matches_the_inline_formula(coefs):
+    raw = _raw(1, 0., 100.)[0]
+
+    calibrator = Calibrator.from_coefs("RH", coefs)
+    assert calibrator.equation == "offset"
+    np.testing.assert_allclose(calibrator(raw), _old_rh_calib(raw, coefs))
+
+
+def test_calibrate_matches_each_sensor():
+    coefs = [utils.coef_manager.get_coefs("Imet", sn)
+             for sn in [57549, 57551, 45363]]
+    calibrators = [Calibrator.from_coefs("Imet", row) for row in coefs]
+    # A sensor with another equation among them
+    calibrators.insert(1, Calibrator("offset", [2827.]))
+    raw = _raw(4, 5000., 40000.)
+
+    calibrated = calibrate(raw, calibrators)
+    assert calibrated.shape == raw.shape
+    for i, calibrator in enumerate(calibrators):
+        np.testing.assert_allclose(calibrated[i], calibrator(raw[i]))
+    np.testing.assert_allclose(calibrated[0], _old_temp_calib(raw[0],
+                                                              coefs[0]))
+    np.testing.assert_allclose(calibrated[1], raw[1] + 2.827)
+
+
+def test_unknown_equation_raises():
+    with pytest.raises(ValueError):
+        Calibrator("E9", [1., 2.])
+    # Types without a default equation can't fall back on one
+    with pytest.raises(ValueError):
+        Calibrator.from_coefs("CO2", {"Equation": "E9", "A": "1"})
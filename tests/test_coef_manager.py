@@ -0,0 +1,204 @@
+"""
+Tests for profiles.Coef_Manager
+"""
+import os
+import traceback
+import numpy as np
+import pandas as pd
+import pytest
+
+from profiles.conf import coef_info
+import profiles.Coef_Manager as Coef_Manager_module
+from profiles.Coef_Manager import Coef_Manager, CSV_Coef_Manager
+
+
+class _Linear_Scan:
+    """ The table filters CSV_Coef_Manager's indexes replaced """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.coefs = pd.read_csv(os.path.join(file_path, 'MasterCoefList.csv'))
+        self.copternums = pd.read_csv(os.path.join(file_path, 'copterID.csv'),
+                                      names=['id', 'tail'])
+
+    def get_tail_n(self, copterID):
+        return self.copternums['tail'][self.copternums['id'] == (copterID)].values[0]
+
+    def get_sensors(self, scoopID):
+        scoop_info = pd.read_csv(os.path.join(self.file_path,
+                                              'scoop' + str(scoopID) + '.csv'))
+        max_date = "0000-00-00"
+        for date in scoop_info.validFrom:
+            if date > max_date:
+                max_date = date
+        most_recent = scoop_info[scoop_info.validFrom == max_date]
+        return {"imet1": str(most_recent.imet1.values[0]),
+                "imet2": str(most_recent.imet2.values[0]),
+                "imet3": str(most_recent.imet3.values[0]), "imet4": None,
+                "rh1": str(most_recent.rh1.values[0]),
+                "rh2": str(most_recent.rh2.values[0]),
+                "rh3": str(most_recent.rh3.values[0]), "rh4": None}
+
+    def get_coefs(self, type, serial_number):
+        serial_number = int(serial_number)
+        coefs = self.coefs
+        selection = (coefs.SerialNumber == serial_number) & \
+            (coefs.SensorType == type)
+        return {name: coefs[name][selection].values[0]
+                for name in ["A", "B", "C", "D", "Equation", "Offset"]}
+
+
+@pytest.fixture
+def managers():
+    return (CSV_Coef_Manager(coef_info.FILE_PATH),
+            _Linear_Scan(coef_info.FILE_PATH))
+
+
+def _assert_same(row, expected):
+    assert row.keys() == expected.keys()
+    for name in expected:
+        if pd.isna(expected[name]):
+            assert pd.isna(row[name])
+        else:
+            assert row[name] == expected[name]
+
+
+def test_coefs_match_the_linear_scan(managers):
+    indexed, scan = managers
+    for type, serial_number in scan.coefs[["SensorType",
+                                           "SerialNumber"]].values:
+        for key in [serial_number, str(serial_number)]:
+            _assert_same(indexed.get_coefs(type, key),
+                         scan.get_coefs(type, key))
+
+
+def test_tails_and_sensors_match_the_linear_scan(managers):
+    indexed, scan = managers
+    for copterID in scan.copternums['id']:
+        assert indexed.get_tail_n(copterID) == scan.get_tail_n(copterID)
+    for scoopID in ["A", "B", "C", "D"]:
+        assert indexed.get_sensors(scoopID) == scan.get_sensors(scoopID)
+
+
+def test_missing_entries_raise(managers):
+    indexed, scan = managers
+    # The serial number of one type is not found for another
+    with pytest.raises(IndexError):
+        scan.get_coefs("Imet", 944)
+    with pytest.raises(KeyError):
+        indexed.get_coefs("Imet", 944)
+    with pytest.raises(KeyError):
+        indexed.get_coefs("Imet", 1)
+    # A serial number which is not in the table at all
+    with pytest.raises(IndexError):
+        scan.get_coefs("Imet", 123456)
+    with pytest.raises(KeyError):
+        indexed.get_coefs("Imet", 123456)
+    with pytest.raises(KeyError):
+        indexed.get_tail_n(256)
+    with pytest.raises(KeyError):
+        indexed.get_sensors("Z")
+
+
+def test_returned_rows_are_copies(managers):
+    indexed, _ = managers
+    row = indexed.get_coefs("Wind", 944)
+    row["A"] = np.nan
+    assert not pd.isna(indexed.get_coefs("Wind", 944)["A"])
+
+
+class _Clock:
+    """ A time.monotonic which only moves when told to """
+
+    def __init__(self):
+        self.now = 1000.
+
+    def __call__(self):
+        return self.now
+
+
+class _Counting_Manager:
+    """ A sub_manager which counts its lookups """
+
+    def __init__(self):
+        self.lookups = []
+
+    def get_tail_n(self, copterID):
+        self.lookups.append(copterID)
+        if int(copterID) > 100:
+            raise KeyError("No tail number for copter " + str(copterID))
+        return "tail" + str(copterID)
+
+
+@pytest.fixture
+def cached(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(Coef_Manager_module.time, "monotonic", clock)
+    manager = Coef_Manager(cache_size=2, cache_ttl=10.)
+    manager.sub_manager = _Counting_Manager()
+    return manager, clock
+
+
+def test_cache_hits(cached):
+    manager, _ = cached
+    assert manager.get_tail_n(1) == "tail1"
+    assert manager.get_tail_n(1) == "tail1"
+    assert manager.sub_manager.lookups == [1]
+    assert (manager.hits, manager.misses) == (1, 1)
+
+
+def test_least_recently_used_is_evicted(cached):
+    manager, _ = cached
+    manager.get_tail_n(1)
+    manager.get_tail_n(2)
+    manager.get_tail_n(1)
+    # 2 is now the least recently used, so it is dropped
+    manager.get_tail_n(3)
+    manager.get_tail_n(1)
+    assert manager.sub_manager.lookups == [1, 2, 3]
+    manager.get_tail_n(2)
+    assert manager.sub_manager.lookups == [1, 2, 3, 2]
+    assert len(manager._cache) == 2
+
+
+def test_entries_expire(cached):
+    manager, clock = cached
+    manager.get_tail_n(1)
+    clock.now += 9.
+    manager.get_tail_n(1)
+    assert manager.sub_manager.lookups == [1]
+    clock.now += 1.
+    manager.get_tail_n(1)
+    assert manager.sub_manager.lookups == [1, 1]
+
+
+def test_unknown_entries_are_cached(cached):
+    manager, clock = cached
+    errors = []
+    for i in range(3):
+        with pytest.raises(KeyError) as error:
+            manager.get_tail_n(256)
+        errors.append(error.value)
+    assert manager.sub_manager.lookups == [256]
+    # Each is a new error with the same message, so tracebacks don't grow
+    assert errors[0] is not errors[1]
+    assert errors[1].args == errors[2].args
+    assert len(traceback.extract_tb(errors[1].__traceback__)) == \
+        len(traceback.extract_tb(errors[2].__traceback__))
+
+    clock.now += 10.
+    with pytest.raises(KeyError):
+        manager.get_tail_n(256)
+    assert manager.sub_manager.lookups == [256, 256]
+
+
+def test_invalidate(cached):
+    manager, _ = cached
+    manager.get_tail_n(1)
+    with pytest.raises(KeyError):
+        manager.get_tail_n(256)
+    manager.invalidate()
+    manager.get_tail_n(1)
+    with pytest.raises(KeyError):
+        manager.get_tail_n(256)
+    assert manager.sub_manager.lookups == [1, 256, 1, 256]
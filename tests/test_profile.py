@@ -0,0 +1,153 @@
+"""
+Tests for profiles.Profile, with a synthetic flight in place of a data file
+"""
+import json
+import numpy as np
+import pytest
+
+import profiles.utils as utils
+from profiles.Profile import Profile
+
+
+def _profile(raw_profile, resolution, res_units, **kwargs):
+    times = raw_profile.pos[-1]
+    return Profile(raw_profile.file_path, resolution, res_units, 1,
+                   raw_profile=raw_profile,
+                   index_list=[(times[100], times[1100], times[2100])],
+                   nc_level='none', **kwargs)
+
+
+@pytest.mark.parametrize("resolution, res_units", [(5, 'm'), (0.5, 'hPa')])
+def test_both_legs(raw_profile, resolution, res_units):
+    profile = _profile(raw_profile, resolution, res_units, legs='both')
+    descent = profile.descent
+
+    assert profile.ascent and not descent.ascent
+    assert descent.descent is None
+    assert profile.indices == (profile.bounds[0], profile.bounds[1])
+    assert descent.indices == (profile.bounds[1], profile.bounds[2])
+    # The descent is gridded to the levels of the ascent, in reverse as its
+    # times increase
+    n = min(len(profile.gridded_base), len(descent.gridded_base))
+    assert n > 5
+    np.testing.assert_allclose(descent.gridded_base[::-1][:n].magnitude,
+                               profile.gridded_base[:n].magnitude)
+    assert all(later > earlier for earlier, later in
+               zip(descent.gridded_times, descent.gridded_times[1:]))
+
+    # Both legs are processed from the same raw data
+    ascent_thermo = profile.get_thermo_profile()
+    descent_thermo = descent.get_thermo_profile()
+    assert descent._raw_profile is profile._raw_profile
+    np.testing.assert_allclose(descent_thermo.temp[::-1][:n].magnitude,
+                               ascent_thermo.temp[:n].magnitude, atol=0.05)
+    assert len(descent.get_wind_profile().speed) > 0
+
+
+def test_single_leg(raw_profile):
+    profile = _profile(raw_profile, 5, 'm', legs='descent')
+    assert not profile.ascent
+    assert profile.descent is None
+    with pytest.raises(ValueError):
+        _profile(raw_profile, 5, 'm', legs='up')
+
+
+def test_time_resolution_covers_the_flight(raw_profile):
+    profile = _profile(raw_profile, 10, 's', legs='both')
+
+    assert profile.descent is None
+    assert profile.indices == (profile.bounds[0], profile.bounds[2])
+    # Every 10 s from the start to the end of the profile
+    assert len(profile.gridded_times) == 20
+    thermo = profile.get_thermo_profile()
+    assert len(thermo.temp) == len(profile.gridded_times)
+
+
+@pytest.mark.parametrize("resolution, res_units", [(5, 'm'), (0.5, 'hPa'),
+                                                   (10, 's')])
+def test_coarsen(raw_profile, resolution, res_units):
+    profile = _profile(raw_profile, resolution, res_units, legs='both')
+    thermo = profile.get_thermo_profile()
+    wind = profile.get_wind_profile()
+
+    coarse = profile.coarsen(2 * resolution)
+
+    assert coarse.resolution == 2 * profile.resolution
+    n = len(coarse.gridded_times)
+    assert n == len(profile.gridded_times) // 2
+    assert coarse.gridded_times == profile.gridded_times[::2][:n]
+    # Each point combines two points of the finer profile
+    coarse_temp = coarse.get_thermo_profile().temp.magnitude
+    np.testing.assert_allclose(coarse_temp,
+                               thermo.temp.magnitude[:2 * n]
+                               .reshape(-1, 2).mean(axis=1), rtol=1e-6)
+    assert len(coarse.get_wind_profile().u) == n
+    np.testing.assert_allclose(coarse.get_wind_profile().u.magnitude,
+                               wind.u.magnitude[:2 * n]
+                               .reshape(-1, 2).mean(axis=1), rtol=1e-6)
+    # The original is unchanged
+    assert profile.get_thermo_profile() is thermo
+    if profile.descent is not None:
+        assert coarse.descent.resolution == coarse.resolution
+    with pytest.raises(ValueError):
+        profile.coarsen(1.5 * resolution)
+
+
+@pytest.mark.parametrize("resolution, res_units", [(5, 'm'), (0.5, 'hPa')])
+def test_coarsen_matches_gridding_at_the_coarser_resolution(
+        raw_profile, resolution, res_units):
+    fine = _profile(raw_profile, resolution, res_units)
+    fine.get_thermo_profile()
+    fine.get_wind_profile()
+    coarse = fine.coarsen(2 * resolution)
+
+    # Gridded directly from the raw data, starting at the same level
+    direct = _profile(raw_profile, 2 * resolution, res_units,
+                      base_start=fine.gridded_base[0])
+    direct.get_thermo_profile()
+    direct.get_wind_profile()
+    # The direct grid may stop a level short, as it ends half of the coarser
+    # resolution below the peak
+    n = min(len(coarse.gridded_times), len(direct.gridded_times))
+    assert n >= len(coarse.gridded_times) - 1
+    assert direct.gridded_times[:n] == coarse.gridded_times[:n]
+    for name in ["temp", "rh", "pres", "alt"]:
+        np.testing.assert_allclose(
+            getattr(coarse.get_thermo_profile(), name).magnitude[:n],
+            getattr(direct.get_thermo_profile(), name).magnitude[:n])
+    for name in ["u", "v", "speed", "dir"]:
+        np.testing.assert_allclose(
+            getattr(coarse.get_wind_profile(), name).magnitude[:n],
+            getattr(direct.get_wind_profile(), name).magnitude[:n])
+
+
+def test_coarsen_needs_the_mean_reducer(raw_profile):
+    profile = _profile(raw_profile, 5, 'm', reducer='median')
+    profile.get_thermo_profile()
+    with pytest.raises(ValueError):
+        profile.coarsen(10)
+
+
+def test_headless_review(raw_profile, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("prompted the user")
+    monkeypatch.setattr("builtins.input", fail)
+    review_path = utils.review_path_for(raw_profile.file_path)
+
+    # Nothing is processed until the bounds written for review are approved
+    with pytest.raises(IndexError):
+        Profile(raw_profile.file_path, 5, 'm', 1, raw_profile=raw_profile,
+                profile_start_height=355, headless=True, nc_level='none')
+    with open(review_path) as review_file:
+        review = json.load(review_file)
+    review["profiles"][0]["approved"] = True
+    with open(review_path, "w") as review_file:
+        json.dump(review, review_file)
+
+    profile = Profile(raw_profile.file_path, 5, 'm', 1,
+                      raw_profile=raw_profile, profile_start_height=355,
+                      headless=True, nc_level='none')
+    times = raw_profile.pos[-1]
+    # The stub climbs from 350 m at 1 m/s from 10 s, so it is first above
+    # 355 m just after 15 s and below it again just after 205 s
+    assert profile.bounds == (times[151], times[1100], times[2051])
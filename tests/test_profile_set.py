@@ -0,0 +1,118 @@
+"""
+Tests for profiles.Profile_Set, with a synthetic flight in place of a data
+file
+"""
+import numpy as np
+import pytest
+
+import profiles.Profile_Set as Profile_Set_module
+from profiles.Profile_Set import Profile_Set
+from profiles.Bounds_Store import Bounds_Store
+import profiles.utils as utils
+from conftest import stub_raw_profile
+
+
+@pytest.fixture
+def file_path(tmp_path, monkeypatch):
+    """ A data file which Profile_Set reads as the stub flight """
+    file_path = str(tmp_path / "flight.json")
+    with open(file_path, "w") as data_file:
+        data_file.write("{}\n")
+    monkeypatch.setattr(Profile_Set_module, "Raw_Profile",
+                        lambda path, *args, **kwargs:
+                        stub_raw_profile(path))
+    return file_path
+
+
+def test_bounds_store_is_off_by_default(file_path, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("the bounds store was opened")
+    monkeypatch.setattr(Profile_Set_module, "Bounds_Store", fail)
+
+    profile_set = Profile_Set(resolution=5, confirm_bounds=False,
+                              profile_start_height=355)
+    profile_set.add_all_profiles(file_path)
+    assert profile_set.bounds_store is None
+    assert len(profile_set.profiles) == 1
+
+
+def test_bounds_store_when_asked_for(file_path, tmp_path, monkeypatch):
+    db_path = str(tmp_path / "store" / "bounds.sqlite")
+    monkeypatch.setattr(Profile_Set_module, "Bounds_Store",
+                        lambda: Bounds_Store(db_path))
+    profile_set = Profile_Set(resolution=5, confirm_bounds=False,
+                              profile_start_height=355,
+                              use_bounds_store=True)
+    profile_set.add_all_profiles(file_path)
+    bounds = profile_set.profiles[0].bounds
+
+    # The second time, the bounds come from the store
+    def fail(*args, **kwargs):
+        raise AssertionError("the profiles were identified again")
+    monkeypatch.setattr(utils, "identify_profile", fail)
+    profile_set = Profile_Set(resolution=5, confirm_bounds=False,
+                              profile_start_height=355,
+                              use_bounds_store=True)
+    profile_set.add_all_profiles(file_path)
+    assert profile_set.profiles[0].bounds == bounds
+
+
+def test_calc_derived_matches_each_profile(file_path):
+    profile_set = Profile_Set(resolution=5, confirm_bounds=False,
+                              profile_start_height=355, legs='both')
+    profile_set.add_all_profiles(file_path)
+    profiles = profile_set.profiles + profile_set.get_descent_profiles()
+    assert len(profiles) == 2
+    thermos = [profile.get_thermo_profile() for profile in profiles]
+    # With legs of different lengths, the batch is padded
+    thermos[1].truncate_to(len(thermos[1].temp) - 3)
+
+    names = ("mixing_ratio", "theta", "T_d", "q", "theta_v")
+    profile_set.calc_derived(names)
+
+    for thermo in thermos:
+        batched = {name: getattr(thermo, name) for name in names}
+        assert all(name in thermo._data for name in names)
+        # Calculated again for this profile alone
+        thermo._clear_derived()
+        for name in names:
+            alone = getattr(thermo, name)
+            assert batched[name].units == alone.units
+            np.testing.assert_allclose(batched[name].magnitude,
+                                       alone.magnitude, rtol=1e-12)
+            assert not np.any(np.isnan(alone.magnitude))
+
+
+def test_calc_derived_skips_unprocessed_profiles(file_path):
+    profile_set = Profile_Set(resolution=5, confirm_bounds=False,
+                              profile_start_height=355, legs='both')
+    profile_set.add_all_profiles(file_path)
+    thermo = profile_set.profiles[0].get_thermo_profile()
+
+    profile_set.calc_derived()
+    assert "theta" in thermo._data
+    assert profile_set.profiles[0].descent._thermo_profile is None
+
+
+def test_coarsen(file_path):
+    profile_set = Profile_Set(resolution=5, confirm_bounds=False,
+                              profile_start_height=355, legs='both')
+    profile_set.add_all_profiles(file_path)
+    fine = profile_set.profiles[0]
+    fine.get_thermo_profile()
+    fine.descent.get_thermo_profile()
+
+    coarse_set = profile_set.coarsen(10)
+
+    assert coarse_set.resolution == 10
+    assert profile_set.resolution == 5
+    coarse = coarse_set.profiles[0]
+    assert coarse.resolution == 2 * fine.resolution
+    assert coarse.descent.resolution == coarse.resolution
+    for coarse_leg, fine_leg in [(coarse, fine),
+                                 (coarse.descent, fine.descent)]:
+        n = len(coarse_leg.gridded_times)
+        np.testing.assert_allclose(
+            coarse_leg.get_thermo_profile().temp.magnitude,
+            fine_leg.get_thermo_profile().temp.magnitude[:2 * n]
+            .reshape(-1, 2).mean(axis=1))
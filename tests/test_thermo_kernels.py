@@ -0,0 +1,70 @@
+"""
+Tests that profiles.thermo_kernels agrees with metpy, which it replaces when
+thermo_info.BACKEND is "numpy"
+"""
+import numpy as np
+import pytest
+
+metpy_calc = pytest.importorskip("metpy.calc")
+from metpy.units import units  # noqa: E402
+
+import profiles.thermo_kernels as kernels  # noqa: E402
+
+# Relative tolerance stated in the thermo_kernels docstring
+RTOL = 1e-4
+
+# Every combination of temperature, relative humidity, and pressure found
+# in a profile of the troposphere
+_temp, _rh, _pres = np.meshgrid(np.linspace(230., 315., 18),
+                                np.linspace(2., 100., 15),
+                                np.linspace(200., 1050., 18))
+TEMP = _temp.ravel()
+RH = _rh.ravel()
+PRES = _pres.ravel()
+
+
+def _mixing_ratio():
+    return metpy_calc.mixing_ratio_from_relative_humidity(
+        RH / 100., TEMP * units.kelvin, PRES * units.hPa)
+
+
+def test_mixing_ratio():
+    np.testing.assert_allclose(
+        kernels.mixing_ratio_from_relative_humidity(RH, TEMP, PRES),
+        _mixing_ratio().m_as(units.dimensionless), rtol=RTOL)
+
+
+def test_potential_temperature():
+    np.testing.assert_allclose(
+        kernels.potential_temperature(PRES, TEMP),
+        metpy_calc.potential_temperature(PRES * units.hPa,
+                                         TEMP * units.kelvin)
+        .m_as(units.kelvin), rtol=RTOL)
+
+
+def test_specific_humidity():
+    mixing_ratio = _mixing_ratio()
+    np.testing.assert_allclose(
+        kernels.specific_humidity_from_mixing_ratio(
+            mixing_ratio.m_as(units.dimensionless)),
+        metpy_calc.specific_humidity_from_mixing_ratio(mixing_ratio)
+        .m_as(units.dimensionless), rtol=RTOL)
+
+
+def test_virtual_temperature():
+    mixing_ratio = _mixing_ratio()
+    np.testing.assert_allclose(
+        kernels.virtual_temperature(TEMP,
+                                    mixing_ratio.m_as(units.dimensionless)),
+        metpy_calc.virtual_temperature(TEMP * units.kelvin, mixing_ratio)
+        .m_as(units.kelvin), rtol=RTOL)
+
+
+def test_dewpoint():
+    # Compared in kelvin, as a relative error in degrees C is meaningless
+    # near 0 C
+    np.testing.assert_allclose(
+        kernels.dewpoint_from_relative_humidity(TEMP, RH) + 273.15,
+        metpy_calc.dewpoint_from_relative_humidity(TEMP * units.kelvin,
+                                                   RH * units.percent)
+        .m_as(units.kelvin), rtol=RTOL)
@@ -0,0 +1,130 @@
+"""
+Tests for profiles.Thermo_Profile
+"""
+import datetime as dt
+import netCDF4
+import numpy as np
+import pytest
+from metpy.units import units
+
+from profiles.conf import thermo_info
+from profiles.Meta import Meta
+from profiles.Thermo_Profile import Thermo_Profile
+
+
+def _empty():
+    """ A Thermo_Profile with the attributes _init2 sets before reading \
+    the cache """
+    thermo = Thermo_Profile()
+    thermo._units = units
+    thermo._meta = None
+    thermo._ascent_filename_tag = "Ascending"
+    thermo._datadir = ""
+    thermo.resolution = 1 * units.s
+    return thermo
+
+
+def _thermo():
+    """ A gridded Thermo_Profile, as _init2 leaves it with the 'mean' \
+    reducer and windowed QC """
+    thermo = _empty()
+    thermo.cache_key = "key"
+    thermo.gridded_times = [dt.datetime(2020, 1, 1, 0, 0, i)
+                            for i in range(6)]
+    counts = np.full(6, 4)
+    for name, values, unit in [("pres", np.linspace(1000., 990., 6), units.hPa),
+                               ("alt", np.linspace(350., 450., 6), units.m),
+                               ("rh", np.linspace(60., 50., 6), units.percent),
+                               ("temp", np.linspace(290., 289., 6),
+                                units.kelvin)]:
+        thermo._sums[name] = values * counts
+        thermo._counts[name] = counts
+        thermo._data[name] = values
+        thermo._data_units[name] = unit
+    thermo.rh_flags = [0, 0]
+    thermo.temp_flags = [0, 2, 0]
+    thermo.rh_sample_flags = np.zeros((2, 24), dtype=int)
+    thermo.temp_sample_flags = np.zeros((3, 24), dtype=int)
+    thermo.temp_sample_flags[1, 5:] = 2
+    return thermo
+
+
+def _read(cache_path, required=()):
+    thermo = _empty()
+    return thermo, thermo._read_netCDF(cache_path, required)
+
+
+def test_save_does_not_derive(tmp_path):
+    thermo = _thermo()
+    thermo.theta
+    cache_path = str(tmp_path / "f.nc")
+    thermo._save_cache(cache_path)
+
+    assert "q" not in thermo._data
+    main_file = netCDF4.Dataset(cache_path, "r")
+    assert "theta" in main_file.variables
+    assert "q" not in main_file.variables
+    main_file.close()
+
+
+def test_cache_hit_restores_sums_and_sample_flags(tmp_path):
+    thermo = _thermo()
+    cache_path = str(tmp_path / "f.nc")
+    thermo._save_cache(cache_path)
+
+    cached, read = _read(cache_path, ["temp_sum", "temp_sample_flags"])
+    assert read
+    np.testing.assert_array_equal(cached.temp_sample_flags,
+                                  thermo.temp_sample_flags)
+    np.testing.assert_array_equal(cached.rh_sample_flags,
+                                  thermo.rh_sample_flags)
+    expected = thermo.coarsen(2)
+    coarse = cached.coarsen(2)
+    for name in ["pres", "temp", "rh", "q"]:
+        np.testing.assert_allclose(getattr(coarse, name).magnitude,
+                                   getattr(expected, name).magnitude)
+
+
+def test_cache_file_without_sums_is_not_read(tmp_path):
+    thermo = _thermo()
+    thermo._sums = {}
+    thermo._counts = {}
+    cache_path = str(tmp_path / "f.nc")
+    thermo._save_cache(cache_path)
+
+    cached, read = _read(cache_path, ["temp_sum"])
+    assert not read
+    assert "temp" not in cached._data
+
+
+def test_product_file_keeps_its_name(tmp_path):
+    thermo = _thermo()
+    thermo._meta = Meta()
+    thermo._meta.all_fields.update(location="OUN", platform_id="CS",
+                                   timestamp="20200101_120000")
+    thermo._save_netCDF(str(tmp_path / "f"))
+
+    file_name = tmp_path / "OUN1CSCMTthermo_Ascending.c1.20200101.120000.cdf"
+    main_file = netCDF4.Dataset(str(file_name), "r")
+    assert "cache_key" not in main_file.ncattrs()
+    assert "temp_sum" not in main_file.variables
+    for name in ["pres", "rh", "alt", "temp", "mr", "theta", "Td", "q"]:
+        assert name in main_file.variables
+    np.testing.assert_allclose(main_file.variables["temp"][:],
+                               thermo.temp.magnitude)
+    main_file.close()
+
+
+@pytest.mark.parametrize("name, unit", [("mixing_ratio", "dimensionless"),
+                                        ("theta", "kelvin"),
+                                        ("T_d", "kelvin"),
+                                        ("q", "gPerKg"),
+                                        ("theta_v", "kelvin")])
+def test_numpy_backend_matches_metpy(monkeypatch, name, unit):
+    results = {}
+    for backend in ["numpy", "metpy"]:
+        monkeypatch.setattr(thermo_info, "BACKEND", backend)
+        # A fresh profile, so nothing derived is remembered
+        thermo = _thermo()
+        results[backend] = getattr(thermo, name).m_as(getattr(units, unit))
+    np.testing.assert_allclose(results["numpy"], results["metpy"], rtol=1e-4)
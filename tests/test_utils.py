@@ -0,0 +1,601 @@
+"""
+Tests for profiles.utils
+"""
+import os
+import json
+import datetime as dt
+import warnings
+import numpy as np
+import pytest
+from metpy.units import units
+
+import profiles.utils as utils
+
+
+def _times(n, step=1.):
+    """ n evenly spaced times, step seconds apart """
+    start = dt.datetime(2020, 1, 1)
+    return [start + dt.timedelta(seconds=step * i) for i in range(n)]
+
+
+def test_regrid_base_pressure_levels():
+    # Pressure falls from 1000 to 988 hPa in steps of 0.1 hPa
+    pres = (1000. - 0.1 * np.arange(121)) * units.hPa
+    times = _times(len(pres))
+
+    gridded_times, gridded_base = utils.regrid_base(
+        base=pres, base_times=times, new_res=1 * units.hPa, ascent=True,
+        units=units, indices=(times[0], times[-1]))
+
+    # Levels 0.5 hPa below the first pressure down to 0.5 hPa above the last,
+    # as before pressure grids were searched on magnitudes
+    expected = 999.5 - np.arange(11)
+    assert len(gridded_base) == 11
+    np.testing.assert_allclose(gridded_base.m_as(units.hPa), expected)
+    # Each level is first reached 5 samples after the previous whole hPa
+    assert gridded_times == [times[5 + 10 * i] for i in range(11)]
+
+
+def test_regrid_base_pressure_resolution_in_other_units():
+    pres = (1000. - 0.1 * np.arange(121)) * units.hPa
+    times = _times(len(pres))
+
+    hpa = utils.regrid_base(base=pres, base_times=times,
+                            new_res=1 * units.hPa, units=units,
+                            indices=(times[0], times[-1]))
+    pa = utils.regrid_base(base=pres, base_times=times,
+                           new_res=100 * units.Pa, units=units,
+                           indices=(times[0], times[-1]))
+
+    assert hpa[0] == pa[0]
+    np.testing.assert_allclose(hpa[1].m_as(units.hPa), pa[1].m_as(units.hPa))
+
+
+def test_regrid_base_pressure_descent():
+    # Up from 1000 to 988 hPa and back down again
+    pres = np.concatenate((1000. - 0.1 * np.arange(121),
+                           988. + 0.1 * np.arange(1, 121))) * units.hPa
+    times = _times(len(pres))
+
+    gridded_times, gridded_base = utils.regrid_base(
+        base=pres, base_times=times, new_res=1 * units.hPa, ascent=False,
+        units=units, indices=(times[0], times[120], times[-1]))
+
+    # Times increase, so the pressure of the descending leg does too
+    assert len(gridded_base) == 11
+    np.testing.assert_allclose(gridded_base.m_as(units.hPa),
+                               989.5 + np.arange(11))
+    assert all(np.diff(utils._as_datetime64(gridded_times)).astype(int) > 0)
+
+
+def _flight(ground, hover, hover_alt=10., hover_noise=1., peak=150.,
+            seed=0):
+    """ Altitudes at 10 Hz for a flight which sits on the ground, climbs \
+    to a noisy hover, then flies one profile and lands """
+    rng = np.random.default_rng(seed)
+    up = np.arange(hover_alt, peak, 0.3)
+    alts = np.concatenate((rng.uniform(-0.3, 0.3, int(ground * 10)),
+                           np.linspace(0., hover_alt, 50),
+                           hover_alt + rng.uniform(-hover_noise, hover_noise,
+                                                   int(hover * 10)),
+                           up, up[::-1],
+                           rng.uniform(-0.3, 0.3, 300))) + 350.
+    return alts, _times(len(alts), 0.1)
+
+
+def test_detect_start_height_short_ground_and_hover():
+    # 30 s on the ground, then a 20 s hover before the profile
+    alts, times = _flight(30, 20)
+    height, confidence = utils.detect_start_height(alts, times)
+    assert confidence >= 0.5
+    assert 361. < height < 370.
+
+
+def test_detect_start_height_very_short_segments():
+    alts, times = _flight(10, 10)
+    height, confidence = utils.detect_start_height(alts, times)
+    assert confidence >= 0.5
+    assert 361. < height < 370.
+
+
+def test_detect_start_height_noisy_hover_is_one_plateau():
+    # A hover spread over several metres must not be split and missed
+    alts, times = _flight(30, 20, hover_noise=1.5, seed=1)
+    height, confidence = utils.detect_start_height(alts, times)
+    assert confidence >= 0.5
+    assert height > 361.5
+
+
+def test_detect_start_height_used_headless():
+    alts, times = _flight(30, 20)
+    bounds = utils.identify_profile(alts, times, confirm_bounds=False,
+                                    headless=True)
+    assert len(bounds) == 1
+
+
+def _samples(seed=0, n=400):
+    """ Irregularly spaced samples with NaNs, and a grid with segments \
+    that hold no samples """
+    rng = np.random.default_rng(seed)
+    steps = rng.exponential(1., n)
+    # A gap of 10 s leaves several segments empty
+    steps[200] = 10.
+    seconds = np.cumsum(steps)
+    times = [dt.datetime(2020, 1, 1) + dt.timedelta(seconds=s)
+             for s in seconds]
+    values = rng.normal(20., 5., n)
+    values[rng.random(n) < 0.1] = np.nan
+    grid = [dt.datetime(2020, 1, 1) + dt.timedelta(seconds=s)
+            for s in np.arange(1., seconds[-1] + 5., 1.5)]
+    return values, times, grid
+
+
+def _naive_segments(times, grid):
+    """ The samples in each complete segment, found one segment at a time """
+    times = np.array(times)
+    segments = []
+    for i in range(len(grid) - 1):
+        if not np.any(times >= grid[i + 1]):
+            break
+        segments.append(np.nonzero((times >= grid[i]) &
+                                   (times < grid[i + 1]))[0])
+    return segments
+
+
+def _naive_trimmed_mean(segment, trim):
+    segment = np.sort(segment[~np.isnan(segment)])
+    cut = int(np.floor(len(segment) * trim))
+    if len(segment) - 2 * cut == 0:
+        return np.nan
+    return np.mean(segment[cut:len(segment) - cut])
+
+
+@pytest.mark.parametrize("reducer", ["mean", "median", "trimmed_mean"])
+def test_reducers_match_naive_segments(reducer):
+    values, times, grid = _samples()
+    gridded = utils.regrid_data(data=values * units.degC, data_times=times,
+                                gridded_times=grid, units=units,
+                                reducer=reducer, trim=0.2)
+
+    segments = _naive_segments(times, grid)
+    naive = {"mean": lambda s: np.nanmean(s),
+             "median": lambda s: np.nanmedian(s),
+             "trimmed_mean": lambda s: _naive_trimmed_mean(s, 0.2)}[reducer]
+    expected = [naive(values[segment]) for segment in segments]
+    assert any(len(segment) == 0 for segment in segments)
+    assert gridded.units == units.degC
+    np.testing.assert_allclose(gridded.magnitude, expected)
+
+
+def test_reducer_interp_matches_neighbouring_samples():
+    values, times, grid = _samples()
+    gridded = utils.regrid_data(data=values, data_times=times,
+                                gridded_times=grid, reducer="interp")
+
+    good = ~np.isnan(values)
+    good_times = np.array(times)[good]
+    good_values = values[good]
+    expected = []
+    for time in grid[:len(_naive_segments(times, grid))]:
+        after = np.searchsorted(good_times, time)
+        if after == 0:
+            expected.append(good_values[0])
+        elif after == len(good_times):
+            expected.append(good_values[-1])
+        else:
+            fraction = (time - good_times[after - 1]) / \
+                (good_times[after] - good_times[after - 1])
+            expected.append(good_values[after - 1] + fraction *
+                            (good_values[after] - good_values[after - 1]))
+    np.testing.assert_allclose(gridded, expected)
+
+
+def test_unknown_reducer():
+    values, times, grid = _samples()
+    with pytest.raises(ValueError):
+        utils.regrid_data(data=values, data_times=times, gridded_times=grid,
+                          reducer="mode")
+
+
+def test_regrid_time_even_grid():
+    times = _times(101, 0.5)
+    gridded_times, gridded_base = utils.regrid_time(
+        base_times=times, new_res=2 * units.s, indices=(times[4], times[-1]))
+
+    # From the start, every 2 s, up to but excluding the end
+    assert gridded_times == [times[4 + 4 * i] for i in range(24)]
+    np.testing.assert_allclose(gridded_base.m_as(units.s), 2. * np.arange(24))
+
+
+def test_regrid_time_whole_flight():
+    times = _times(11)
+    gridded_times, gridded_base = utils.regrid_time(
+        base_times=times, new_res=1 * units.minute)
+    assert gridded_times == [times[0]]
+    with pytest.raises(ValueError):
+        utils.regrid_time(base_times=times, new_res=0 * units.s)
+
+
+def _naive_bounds(times, grid):
+    """ The first sample at or after each gridded time, for complete \
+    segments only """
+    bounds = [int(np.sum(times < point)) for point in grid]
+    complete = [i for i in range(len(grid) - 1) if bounds[i + 1] < len(times)]
+    return ([bounds[i] for i in complete],
+            [bounds[i + 1] for i in complete])
+
+
+@pytest.mark.parametrize("even", [True, False])
+def test_segment_bounds(even):
+    rng = np.random.default_rng(2)
+    # Samples start before and end after the grid
+    times = np.sort(rng.integers(0, 1000, 300))
+    if even:
+        grid = np.arange(50, 950, 37)
+    else:
+        grid = np.sort(rng.choice(np.arange(50, 950), 25, replace=False))
+    starts, ends = utils._segment_bounds(times, grid)
+    expected_starts, expected_ends = _naive_bounds(times, grid)
+    np.testing.assert_array_equal(starts, expected_starts)
+    np.testing.assert_array_equal(ends, expected_ends)
+
+
+def test_segment_bounds_past_the_samples():
+    # The last segments of an even grid hold no samples and are not complete
+    times = np.arange(0, 100, 3)
+    grid = np.arange(10, 200, 10)
+    starts, ends = utils._segment_bounds(times, grid)
+    expected_starts, expected_ends = _naive_bounds(times, grid)
+    assert len(starts) == 8
+    np.testing.assert_array_equal(starts, expected_starts)
+    np.testing.assert_array_equal(ends, expected_ends)
+
+
+def _recursive_find_profiles(alts, profile_start_height, to_return=None,
+                             ind=0):
+    """ The recursive search of identify_profile before it was vectorized, \
+    without confirmation, returning indices instead of times """
+    if to_return is None:
+        to_return = []
+    isDone = False
+    if max(alts[ind:]) < profile_start_height:
+        return []
+
+    start_ind_asc = None
+    end_ind_des = None
+    peak_ind = None
+    while ind < len(alts) - 10:
+        if start_ind_asc is None:
+            if alts[ind] > profile_start_height and \
+                    alts[ind + 10] < alts[ind]:
+                break
+            if alts[ind] > profile_start_height:
+                start_ind_asc = ind
+            ind += 1
+        elif end_ind_des is None:
+            if alts[ind] < profile_start_height:
+                end_ind_des = ind
+                peak_ind = list(alts).index(
+                    np.nanmax(alts[start_ind_asc:end_ind_des]),
+                    start_ind_asc, end_ind_des)
+            ind += 1
+        else:
+            isDone = True
+            break
+
+    if isDone:
+        to_return.append((start_ind_asc, peak_ind, end_ind_des))
+        if ind + 100 < len(alts) \
+                and max(alts[ind + 100::]) > profile_start_height:
+            to_return = _recursive_find_profiles(alts, profile_start_height,
+                                                 to_return, ind + 100)
+    return to_return
+
+
+def _profiles_flight(n_profiles, seed, unfinished=False):
+    """ Altitudes of a flight with n_profiles profiles of random heights, \
+    separated by random times on the ground """
+    rng = np.random.default_rng(seed)
+    alts = [rng.uniform(-0.3, 0.3, rng.integers(150, 400))]
+    for i in range(n_profiles):
+        peak = rng.uniform(30., 200.)
+        up = np.arange(0., peak, rng.uniform(0.2, 1.))
+        down = np.arange(peak, 0., -rng.uniform(0.2, 1.))
+        if unfinished and i == n_profiles - 1:
+            alts += [up, np.full(50, peak)]
+            break
+        alts += [up, down, rng.uniform(-0.3, 0.3, rng.integers(150, 400))]
+    alts = np.concatenate(alts) + 350.
+    return alts + rng.normal(0., 0.05, len(alts))
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("unfinished", [False, True])
+def test_find_profiles_matches_the_recursive_search(seed, unfinished):
+    alts = _profiles_flight(4, seed, unfinished)
+    bounds = utils._find_profiles(alts, 360.)
+    assert bounds == _recursive_find_profiles(alts, 360.)
+    assert len(bounds) == (3 if unfinished else 4)
+    for start, peak, end in bounds:
+        assert start < peak < end
+
+
+def test_find_profiles_without_a_profile():
+    alts = _profiles_flight(0, 0)
+    assert utils._find_profiles(alts, 360.) == []
+
+
+@pytest.fixture
+def no_prompts(monkeypatch):
+    """ Fails the test if the user would be prompted or shown a figure """
+    def fail(*args, **kwargs):
+        raise AssertionError("prompted the user")
+    monkeypatch.setattr(utils, "_ask_start_height", fail)
+    monkeypatch.setattr(utils, "_confirm_profile", fail)
+    monkeypatch.setattr("builtins.input", fail)
+
+
+def test_headless_bounds_review(tmp_path, no_prompts):
+    alts = _profiles_flight(3, 0)
+    times = _times(len(alts), 0.1)
+    review_path = str(tmp_path / "flight_bounds.json")
+
+    # The first run only writes the bounds for review
+    assert utils.identify_profile(alts, times, profile_start_height=360.,
+                                  headless=True,
+                                  review_path=review_path) == []
+    with open(review_path) as review_file:
+        review = json.load(review_file)
+    assert review["profile_start_height"] == 360.
+    assert len(review["profiles"]) == 3
+    assert os.path.exists(str(tmp_path / "flight_bounds.png"))
+
+    # Only approved profiles are processed
+    review["profiles"][1]["approved"] = True
+    with open(review_path, "w") as review_file:
+        json.dump(review, review_file)
+    start, peak, end = utils._find_profiles(alts, 360.)[1]
+    assert utils.identify_profile(alts, times, profile_start_height=360.,
+                                  headless=True, review_path=review_path) \
+        == [(times[start], times[peak], times[end])]
+
+
+def test_headless_without_review(no_prompts):
+    alts = _profiles_flight(3, 0)
+    times = _times(len(alts), 0.1)
+    bounds = utils.identify_profile(alts, times, confirm_bounds=False,
+                                    profile_start_height=360., headless=True)
+    assert bounds == [tuple(times[i] for i in profile)
+                      for profile in utils._find_profiles(alts, 360.)]
+    with pytest.raises(ValueError):
+        utils.identify_profile(alts, times, profile_start_height=360.,
+                               headless=True)
+
+
+def test_headless_uncertain_start_height(no_prompts):
+    # Climbing the whole time, so there is nothing to detect a start from
+    alts = np.linspace(350., 500., 3000)
+    times = _times(len(alts), 0.1)
+    assert utils.identify_profile(alts, times, confirm_bounds=False,
+                                  headless=True) == []
+
+
+def _loop_flag_spread(data, stat, max_abs_error, flag):
+    """ The elimination loop of _bias and _s_dev before they were \
+    vectorized """
+    to_return = np.zeros(len(data))
+    stats = np.zeros(len(data))
+    for i in range(len(data)):
+        stats[i] = stat(data[i])
+
+    while(True):
+        max_diff = 0
+        furthest_from_mean = 0
+
+        for j in range(len(data)):
+
+            if(np.abs(np.nanmean(stats)-stats[j]) >
+               np.abs(np.nanmean(stats)-stats[furthest_from_mean])):
+                furthest_from_mean = j
+
+            for k in range(len(data)):
+                if(np.abs(stats[j]-stats[k]) > max_diff):
+                    max_diff = np.abs(stats[j]-stats[k])
+
+            if(max_diff > max_abs_error):
+                to_return[furthest_from_mean] = flag
+                stats[furthest_from_mean] = np.nan
+            else:
+                return to_return
+
+
+def _loop_qc(data, max_bias, max_variance):
+    """ qc before it was vectorized """
+    good_nonempty = [1] * len(data)
+    for i in range(len(data)):
+        if np.nanmean(data[i]) == 0:
+            good_nonempty[i] = 4
+        else:
+            good_nonempty[i] = 0
+    good_means = _loop_flag_spread(data, np.nanmean, max_bias, 2)
+    good_sdevs = _loop_flag_spread(data, np.nanstd, max_variance, 3)
+    return [max([good_means[i], good_sdevs[i], good_nonempty[i]])
+            for i in range(len(data))]
+
+
+def _ensemble(seed, n_sensors):
+    """ Sensors with random biases, noise, gaps, and sometimes no data """
+    rng = np.random.default_rng(seed)
+    data = 20. + rng.normal(0., rng.uniform(0.01, 0.3), (n_sensors, 200))
+    data += rng.normal(0., 0.2, (n_sensors, 1))
+    data[rng.random(data.shape) < 0.05] = np.nan
+    if rng.random() < 0.2:
+        data[rng.integers(n_sensors)] = 0.
+    return data
+
+
+@pytest.mark.parametrize("n_sensors", [2, 3, 4])
+def test_qc_matches_the_loop(n_sensors):
+    flagged = set()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        for seed in range(100):
+            data = _ensemble(seed, n_sensors)
+            flags = utils.qc(data, 0.25, 0.1)
+            assert flags == _loop_qc(data, 0.25, 0.1)
+            flagged.update(flags)
+    # Both tests have passed and failed
+    assert {0, 2, 3, 4} <= flagged
+
+
+def test_qc_flags_only_the_first_sensor():
+    # The third sensor is biased, but the first is the one flagged
+    data = np.array([[20., 20.1, 20.2], [20., 20.1, 20.2], [21., 21.1, 21.2]])
+    assert utils.qc(data, 0.25, 0.1) == _loop_qc(data, 0.25, 0.1) \
+        == [2, 0, 0]
+    # So is the first sensor itself
+    assert utils.qc(data[::-1], 0.25, 0.1) == [2, 0, 0]
+    # Nothing is flagged if the first sensor has no data
+    data[0] = np.nan
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        assert utils.qc(data, 0.25, 0.1) == _loop_qc(data, 0.25, 0.1) \
+            == [0, 0, 0]
+
+
+def _windowed_ensemble(seed=0):
+    """ Three temperature sensors at 10 Hz for 300 s which agree to within \
+    noise """
+    rng = np.random.default_rng(seed)
+    seconds = np.arange(3000) / 10.
+    data = 290. - 0.01 * seconds + rng.normal(0., 0.02, (3, len(seconds)))
+    return data, seconds, _times(len(seconds), 0.1)
+
+
+def test_qc_windowed_drift_in_one_window():
+    data, seconds, times = _windowed_ensemble()
+    # The second sensor reads 1 K high from 100 to 130 s
+    drift = (seconds >= 100.) & (seconds < 130.)
+    data[1, drift] += 1.
+
+    flags = utils.qc_windowed(data, times, 0.25, 0.1, 30)
+
+    # It is dropped while it drifts, and kept well before and after. Windows
+    # which hold the steps also flag its standard deviation.
+    assert np.all(flags[1, drift] != 0)
+    assert flags[1, 1150] == 2
+    far = (seconds < 80.) | (seconds > 150.)
+    assert np.all(flags[1, far] == 0)
+    # The other sensors are always kept
+    assert np.all(flags[[0, 2]] == 0)
+    # Over the whole profile the drift averages out, so qc keeps every sensor
+    assert utils.qc(data, 0.25, 0.1) == [0, 0, 0]
+
+
+def test_qc_windowed_noise_and_empty_windows():
+    data, seconds, times = _windowed_ensemble()
+    # The first sensor is noisy from 200 to 240 s, and the third records
+    # only zeros for the first 60 s
+    noisy = (seconds >= 200.) & (seconds < 240.)
+    data[0, noisy] += np.random.default_rng(1).normal(0., 1., noisy.sum())
+    data[2, seconds < 60.] = 0.
+
+    flags = utils.qc_windowed(data, times, 0.25, 0.1, 30)
+
+    assert np.all(flags[0, (seconds >= 210.) & (seconds < 230.)] == 3)
+    assert np.all(flags[0, seconds < 180.] == 0)
+    assert np.all(flags[2, seconds < 40.] == 4)
+    assert np.all(flags[2, seconds > 90.] == 0)
+    assert np.all(flags[1] == 0)
+
+
+def _naive_despike(values, window, threshold, min_spike):
+    """ despike for one sensor, one window at a time. Windows at the ends \
+    of the array only hold the samples which exist. """
+    half = window // 2
+    spikes = np.zeros(len(values), dtype=bool)
+    for i in range(len(values)):
+        around = values[max(i - half, 0):i + half + 1]
+        around = around[~np.isnan(around)]
+        median = np.median(around)
+        mad = np.median(np.abs(around - median))
+        spikes[i] = abs(values[i] - median) > \
+            max(threshold * 1.4826 * mad, min_spike)
+    return spikes
+
+
+def test_despike_matches_one_window_at_a_time():
+    rng = np.random.default_rng(0)
+    data = rng.normal(0., 1., (3, 500))
+    data[rng.random(data.shape) < 0.02] += 10.
+    data[rng.random(data.shape) < 0.02] = np.nan
+
+    spikes = utils.despike(data, window=11, threshold=5., min_spike=0.5)
+
+    for i in range(len(data)):
+        expected = _naive_despike(data[i], 11, 5., 0.5)
+        np.testing.assert_array_equal(spikes[i], expected)
+    assert spikes.sum() > 10
+
+
+def test_despike_threshold():
+    # Every window has a median of 0 and a MAD of 1
+    data = np.tile([-1., 0., 1.], 30)
+    # 4 scaled MADs from the median, then 6
+    data[19] = 4. * 1.4826
+    data[61] = 6. * 1.4826
+    spikes = utils.despike([data], window=11, threshold=5.)
+    assert list(np.flatnonzero(spikes[0])) == [61]
+    # A flat channel has a MAD of 0, so min_spike decides
+    flat = np.full(100, 20.)
+    flat[[30, 70]] = [20.2, 21.]
+    spikes = utils.despike([flat], window=11, threshold=5., min_spike=0.5)
+    assert list(np.flatnonzero(spikes[0])) == [70]
+
+
+def test_despike_edges():
+    data = np.linspace(0., 1., 100)
+    data[[0, 1, -1]] += [5., -5., 5.]
+    spikes = utils.despike([data], window=11, threshold=5., min_spike=0.5)
+    assert list(np.flatnonzero(spikes[0])) == [0, 1, 99]
+    # Windows wider than the data hold all of it
+    spikes = utils.despike([data[:5]], window=11, threshold=5.,
+                           min_spike=0.5)
+    np.testing.assert_array_equal(spikes[0],
+                                  _naive_despike(data[:5], 11, 5., 0.5))
+
+
+def test_despike_channels_settings():
+    rng = np.random.default_rng(0)
+    thermo_data = {"time_temp": np.arange(200)}
+    for i in range(1, 3):
+        thermo_data["temp" + str(i)] = \
+            (290. + rng.normal(0., 0.01, 200)) * units.K
+        thermo_data["resi" + str(i)] = \
+            (10000. + rng.normal(0., 1., 200)) * units.ohm
+        thermo_data["rh" + str(i)] = \
+            (50. + rng.normal(0., 0.1, 200)) * units.percent
+        thermo_data["temp_rh" + str(i)] = np.full(200, 290.) * units.K
+    for key, spike in [("temp1", 20.), ("resi2", 200.), ("rh1", 20.),
+                       ("temp_rh1", 20.)]:
+        thermo_data[key][100] += spike * thermo_data[key].units
+    # A 0.3 K spike is smaller than the default min_spike for temp
+    thermo_data["temp2"][50] += 0.3 * units.K
+
+    despiked, masked = utils.despike_channels(
+        thermo_data, {"temp": {"window": 5, "threshold": 5.,
+                               "min_spike": 0.2},
+                      "rh": None})
+
+    assert masked == {"temp1": 1, "temp2": 1, "resi1": 0, "resi2": 1}
+    assert np.isnan(despiked["temp1"][100].magnitude)
+    assert np.isnan(despiked["temp2"][50].magnitude)
+    assert np.isnan(despiked["resi2"][100].magnitude)
+    assert despiked["resi2"].units == units.ohm
+    # rh is not despiked, and channels which aren't sensors are left alone
+    assert despiked["rh1"] is thermo_data["rh1"]
+    assert despiked["temp_rh1"] is thermo_data["temp_rh1"]
+    # The input is not modified
+    assert not np.isnan(thermo_data["temp1"][100].magnitude)
+    # With the defaults, the small temp2 spike stays
+    assert utils.despike_channels(thermo_data)[1]["temp2"] == 0
@@ -0,0 +1,278 @@
+"""
+Tests for profiles.Wind_Profile
+"""
+import datetime as dt
+import netCDF4
+import numpy as np
+import pytest
+from metpy.units import units
+
+import profiles.utils as utils
+from profiles.Meta import Meta
+from profiles.Wind_Profile import Wind_Profile
+
+
+def _wind_dict(n_rotation=2000, n_pres=500, duration=100.):
+    """ Raw wind data with rotation sampled more often than pressure, as \
+    from Raw_Profile.wind_data """
+    start = dt.datetime(2020, 1, 1)
+    time = [start + dt.timedelta(seconds=duration * i / n_rotation)
+            for i in range(n_rotation)]
+    time_pres = [start + dt.timedelta(seconds=duration * i / n_pres)
+                 for i in range(n_pres)]
+    zeros = np.zeros(n_rotation)
+    return {"roll": np.full(n_rotation, 0.05) * units.rad,
+            "pitch": np.full(n_rotation, -0.05) * units.rad,
+            "yaw": zeros * units.rad,
+            "speed_east": zeros * units.m / units.s,
+            "speed_north": zeros * units.m / units.s,
+            "speed_down": zeros * units.m / units.s,
+            "time": time,
+            "alt": np.linspace(0., 100., n_pres) * units.m,
+            "pres": np.linspace(1000., 988., n_pres) * units.hPa,
+            "time_pres": time_pres,
+            "serial_numbers": {"copterID": 1}}
+
+
+@pytest.mark.parametrize("resolution", [10 * units.s, 10 * units.m,
+                                        1 * units.hPa])
+def test_pres_and_alt_use_their_own_time_axis(tmp_path, resolution):
+    wind_dict = _wind_dict()
+    if resolution.dimensionality == units.s.dimensionality:
+        gridded_times, gridded_base = utils.regrid_time(
+            base_times=wind_dict["time_pres"], new_res=resolution)
+    else:
+        base = wind_dict["pres"] if resolution.dimensionality == \
+            units.hPa.dimensionality else wind_dict["alt"]
+        gridded_times, gridded_base = utils.regrid_base(
+            base=base, base_times=wind_dict["time_pres"], new_res=resolution,
+            units=units)
+    indices = (wind_dict["time_pres"][1], wind_dict["time_pres"][-2])
+
+    wind = Wind_Profile(wind_dict, resolution, file_path=str(tmp_path / "f"),
+                        gridded_times=gridded_times,
+                        gridded_base=gridded_base, indices=indices,
+                        units=units, nc_level='none')
+
+    assert len(wind.pres) == len(wind.alt) == len(wind.speed) > 0
+    # The variable which is not the base is averaged on the pressure times
+    raw = _wind_dict()
+    selection = utils.trim_slice(raw["time_pres"], indices)
+    for name in ["pres", "alt"]:
+        if resolution.dimensionality == getattr(raw[name], "dimensionality"):
+            continue
+        expected = utils.regrid_data(data=raw[name][selection],
+                                     data_times=raw["time_pres"][selection],
+                                     gridded_times=gridded_times)
+        np.testing.assert_allclose(getattr(wind, name).magnitude,
+                                   expected.magnitude[:len(wind.pres)])
+
+
+def _cached_wind(tmp_path, meta=None):
+    wind_dict = _wind_dict()
+    gridded_times, gridded_base = utils.regrid_time(
+        base_times=wind_dict["time_pres"], new_res=10 * units.s)
+    return Wind_Profile(wind_dict, 10 * units.s,
+                        file_path=str(tmp_path / "f"),
+                        gridded_times=gridded_times,
+                        gridded_base=gridded_base,
+                        indices=(wind_dict["time_pres"][1],
+                                 wind_dict["time_pres"][-2]),
+                        units=units, nc_level='low', meta=meta)
+
+
+def _no_gridding(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("the cached profile was gridded again")
+    monkeypatch.setattr(Wind_Profile, "_calc_winds", fail)
+
+
+def test_cache_hit_can_be_coarsened(tmp_path, monkeypatch):
+    computed = _cached_wind(tmp_path)
+    _no_gridding(monkeypatch)
+    cached = _cached_wind(tmp_path)
+
+    expected = computed.coarsen(2)
+    coarse = cached.coarsen(2)
+    for name in ["u", "v", "speed", "pres"]:
+        np.testing.assert_allclose(getattr(coarse, name).magnitude,
+                                   getattr(expected, name).magnitude)
+
+
+def test_cache_file_without_sums_is_a_miss(tmp_path, monkeypatch):
+    wind = _cached_wind(tmp_path)
+    # A file written before sums and counts were cached
+    cache_path = utils.product_cache_path(str(tmp_path / "f"), "wind",
+                                          wind.cache_key)
+    main_file = netCDF4.Dataset(cache_path, "a")
+    main_file.renameVariable("u_sum", "old_u_sum")
+    main_file.close()
+    calls = []
+    calc_winds = Wind_Profile._calc_winds
+
+    def counted(self, *args, **kwargs):
+        calls.append(1)
+        return calc_winds(self, *args, **kwargs)
+    monkeypatch.setattr(Wind_Profile, "_calc_winds", counted)
+
+    wind = _cached_wind(tmp_path)
+    assert len(calls) == 1
+    assert len(wind.coarsen(2).u) > 0
+
+
+def test_product_file_keeps_its_name(tmp_path):
+    meta = Meta()
+    meta.all_fields.update(location="OUN", platform_id="CS",
+                           timestamp="20200101_120000")
+    wind = _cached_wind(tmp_path, meta=meta)
+
+    file_name = tmp_path / "OUN10CSCMTwind_Ascending.c1.20200101.120000.cdf"
+    main_file = netCDF4.Dataset(str(file_name), "r")
+    assert "cache_key" not in main_file.ncattrs()
+    np.testing.assert_allclose(main_file.variables["u"][:], wind.u.magnitude)
+    main_file.close()
+    # The cache is a separate file
+    assert (tmp_path / ("f_wind_" + wind.cache_key + ".nc")).is_file()
+
+
+def test_nothing_is_written_with_nc_level_none(tmp_path):
+    wind_dict = _wind_dict()
+    gridded_times, gridded_base = utils.regrid_time(
+        base_times=wind_dict["time_pres"], new_res=10 * units.s)
+    Wind_Profile(wind_dict, 10 * units.s, file_path=str(tmp_path / "f"),
+                 gridded_times=gridded_times, gridded_base=gridded_base,
+                 indices=(wind_dict["time_pres"][1],
+                          wind_dict["time_pres"][-2]),
+                 units=units, nc_level='none')
+    assert list(tmp_path.iterdir()) == []
+
+
+def _loop_calc_winds(wind_data):
+    """ The per-sample matrix product _calc_winds replaced """
+    tail_num = utils.coef_manager.get_tail_n(
+        wind_data['serial_numbers']['copterID'])
+    psi = np.zeros(len(wind_data["roll"])) * units.rad
+    az = np.zeros(len(wind_data["roll"])) * units.rad
+    for i in range(len(wind_data["roll"])):
+        croll = np.cos(wind_data["roll"][i])
+        sroll = np.sin(wind_data["roll"][i])
+        cpitch = np.cos(wind_data["pitch"][i])
+        spitch = np.sin(wind_data["pitch"][i])
+        cyaw = np.cos(wind_data["yaw"][i])
+        syaw = np.sin(wind_data["yaw"][i])
+        Rx = np.matrix([[1, 0, 0],
+                        [0, croll, sroll],
+                        [0, -sroll, croll]])
+        Ry = np.matrix([[cpitch, 0, -spitch],
+                        [0, 1, 0],
+                        [spitch, 0, cpitch]])
+        Rz = np.matrix([[cyaw, -syaw, 0],
+                        [syaw, cyaw, 0],
+                        [0, 0, 1]])
+        R = Rz * Ry * Rx
+        psi[i] = np.arccos(R[2, 2])
+        az[i] = np.arctan2(R[1, 2], R[0, 2])
+
+    coefs = utils.coef_manager.get_coefs('Wind', tail_num)
+    speed = float(coefs['A']) * np.sqrt(np.tan(psi)).magnitude \
+        + float(coefs['B'])
+    speed[speed < 0.] = np.nan
+    az = az.to(units.deg).magnitude
+    az[az < 0.] += 360.
+    return az, speed
+
+
+def _wind_profile():
+    wind = Wind_Profile()
+    wind._units = units
+    return wind
+
+
+@pytest.mark.filterwarnings("ignore::PendingDeprecationWarning")
+def test_calc_winds_matches_the_matrix_product():
+    rng = np.random.default_rng(44)
+    wind_dict = _wind_dict(n_rotation=500)
+    wind_dict["roll"] = rng.uniform(-0.3, 0.3, 500) * units.rad
+    wind_dict["pitch"] = rng.uniform(-0.3, 0.3, 500) * units.rad
+    wind_dict["yaw"] = rng.uniform(-np.pi, np.pi, 500) * units.rad
+    # Level samples, where the speed is negative and thrown out
+    wind_dict["roll"][:5] = 0. * units.rad
+    wind_dict["pitch"][:5] = 0. * units.rad
+
+    az, speed, _ = _wind_profile()._calc_winds(wind_dict)
+    expected_az, expected_speed = _loop_calc_winds(wind_dict)
+
+    np.testing.assert_allclose(speed.m_as(units.m / units.s), expected_speed)
+    assert np.isnan(speed.magnitude[:5]).all()
+    tilted = np.hypot(wind_dict["roll"].magnitude,
+                      wind_dict["pitch"].magnitude) > 1e-3
+    np.testing.assert_allclose(az.m_as(units.deg)[tilted],
+                               expected_az[tilted], atol=1e-9)
+
+
+def _tilted_north(ground_east, ground_north, n=10):
+    """ Wind data for a copter pitched nose down with yaw 0, i.e. tilted \
+    into a wind from the north, moving over the ground at the given \
+    velocity """
+    wind_dict = _wind_dict(n_rotation=n)
+    wind_dict["roll"] = np.zeros(n) * units.rad
+    wind_dict["pitch"] = np.full(n, -0.1) * units.rad
+    wind_dict["speed_east"] = np.full(n, ground_east) * units.m / units.s
+    wind_dict["speed_north"] = np.full(n, ground_north) * units.m / units.s
+    return wind_dict
+
+
+def test_moving_platform_adds_the_ground_velocity():
+    coefs = utils.coef_manager.get_coefs('Wind', 944)
+    relative = float(coefs['A']) * np.sqrt(np.tan(0.1)) + float(coefs['B'])
+    wind = _wind_profile()
+
+    az, speed, _ = wind._calc_winds(_tilted_north(0., 0.),
+                                    moving_platform=True)
+    np.testing.assert_allclose(az.m_as(units.deg), 0., atol=1e-9)
+    np.testing.assert_allclose(speed.m_as(units.m / units.s), relative)
+
+    # Flying north at the relative wind speed in still air
+    az, speed, _ = wind._calc_winds(_tilted_north(0., relative),
+                                    moving_platform=True)
+    np.testing.assert_allclose(speed.m_as(units.m / units.s), 0., atol=1e-9)
+
+    # Flying south at 3 m/s into a wind from the north
+    az, speed, _ = wind._calc_winds(_tilted_north(0., -3.),
+                                    moving_platform=True)
+    np.testing.assert_allclose(az.m_as(units.deg) % 360., 0., atol=1e-9)
+    np.testing.assert_allclose(speed.m_as(units.m / units.s), relative + 3.)
+
+    # Flying east at 3 m/s with the same tilt, so the wind also blows east,
+    # i.e. it comes from the north west
+    az, speed, _ = wind._calc_winds(_tilted_north(3., 0.),
+                                    moving_platform=True)
+    np.testing.assert_allclose(speed.m_as(units.m / units.s),
+                               np.hypot(relative, 3.))
+    np.testing.assert_allclose(az.m_as(units.deg),
+                               360. - np.degrees(np.arctan2(3., relative)))
+
+
+@pytest.mark.parametrize("reducer", ["mean", "median"])
+def test_directions_either_side_of_north_average_to_north(reducer):
+    start = dt.datetime(2020, 1, 1)
+    times = [start + dt.timedelta(seconds=0.1 * i) for i in range(200)]
+    # Alternating winds from 350 and 10 degrees at 5 m/s
+    direction = np.radians(np.where(np.arange(200) % 2 == 0, 350., 10.))
+    speed = np.full(200, 5.)
+    wind = _wind_profile()
+    wind.gridded_times = [start + dt.timedelta(seconds=5 * i)
+                          for i in range(5)]
+
+    wind._regrid_components(-speed * np.sin(direction),
+                            -speed * np.cos(direction), times, reducer)
+    wind._calc_speed_dir()
+
+    dirs = wind.dir.m_as(units.deg)
+    inner = ~np.isnan(dirs)
+    assert inner.any()
+    # 0 degrees, not the 180 averaging the directions would give
+    np.testing.assert_allclose(np.minimum(dirs[inner], 360. - dirs[inner]),
+                               0., atol=1e-6)
+    np.testing.assert_allclose(wind.speed.m_as(units.m / units.s)[inner],
+                               5. * np.cos(np.radians(10.)))